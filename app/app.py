@@ -1,53 +1,223 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 from flask_mail import Mail
-from flask_limiter import Limiter
+from flask_limiter import Limiter, RateLimitExceeded
 from flask_limiter.util import get_remote_address
 from functools import wraps
+import atexit
+import time
 from config.config import Config
 from .templates.templates import VALID_EMAIL_TYPES, get_template_description
-from .utils.utils import validate_email_request, validate_api_key, create_error_response
+from .utils.utils import (
+    validate_email_request, validate_batch_request, validate_api_key, create_error_response, get_redis_client,
+    parse_timestamp
+)
 from .services.email_service import EmailService
+from .services.smtp_pool import SMTPConnectionPool
+from .services.smtp_accounts import SMTPAccountPool
+from .services.circuit_breaker import CLOSED
+from .services.transports import create_transport
+from .services.mime_builder import MessageBuilder
+from .services.delivery_queue import DeliveryQueue
+from .services.lanes import LaneRouter
+from .services.outbox import Outbox
+from .services.scheduler import ScheduleStore
+from .services.redis_queue import RedisStreamQueue
+from .services.render_cache import RenderCache
+from .services.retry import RetryBudget, RetryPolicy
+from .services.dead_letters import create_dead_letter_store
+from .services.admission import AdmissionController, LatencyTracker
+from .services.idempotency import create_idempotency_store, fingerprint, REPLAY, MISMATCH, IN_PROGRESS
+from .services.rate_limit_storage import SCHEME as HYBRID_RATE_LIMIT_SCHEME, FAILOVER_SCHEME as FAILOVER_RATE_LIMIT_SCHEME
+from .services import metrics
+from .services.metrics import (
+    Gauge, REQUEST_SECONDS, RATE_LIMIT_CHECK_SECONDS, RATE_LIMITED_TOTAL,
+    SEND_STAGE_SECONDS, SENDS_TOTAL, IDEMPOTENT_REQUESTS_TOTAL, bounded_label
+)
 
 app = Flask(__name__)
 app.config.from_object(Config)
+metrics.REGISTRY.enabled = app.config['METRICS_ENABLED']
 
 mail = Mail(app)
-email_service = EmailService(mail)
+transport = create_transport(app.config, mail)
+outbox = Outbox.from_config(app.config) if app.config['OUTBOX_ENABLED'] else None
+message_builder = MessageBuilder() if app.config['FAST_MIME_BUILDER'] else None
+render_cache = None
+if app.config['RENDER_CACHE_SIZE'] > 0:
+    render_cache = RenderCache.from_config(
+        app.config,
+        redis_client=get_redis_client(app.config, socket_timeout=0.5) if app.config['RENDER_CACHE_REDIS'] else None
+    )
+queue_redis = get_redis_client(app.config) if app.config['QUEUE_BACKEND'] == 'redis' else None
+# One budget shared by inline and queued retries, so an SMTP outage cannot multiply the load
+retry_budget = RetryBudget.from_config(app.config)
+dead_letters = create_dead_letter_store(app.config, queue_redis)
+idempotency = create_idempotency_store(app.config)
+lanes = LaneRouter.from_config(app.config)
+# Delivery times seen by this process, watched by admission control
+delivery_latency = LatencyTracker()
+email_service = EmailService(
+    mail, transport, outbox, message_builder, render_cache,
+    retry_policy=RetryPolicy.from_config(app.config, retry_budget),
+    sync_retry_policy=RetryPolicy.from_config(app.config, retry_budget, sync=True),
+    dead_letters=dead_letters,
+    expired_action=app.config['EXPIRED_EMAIL_ACTION'],
+    latency=delivery_latency
+)
+
+# Queue used when ASYNC_SEND is enabled or an email has a send_at: in-process workers,
+# or Redis Streams drained by separately scaled worker processes (python -m app.worker)
+if queue_redis is not None:
+    delivery_queue = RedisStreamQueue.from_config(queue_redis, app.config, outbox)
+else:
+    schedule = ScheduleStore.from_config(app.config)
+    delivery_queue = DeliveryQueue(
+        email_service,
+        app=app,
+        workers=app.config['DELIVERY_WORKERS'],
+        maxsize=app.config['DELIVERY_QUEUE_SIZE'],
+        history_size=app.config['DELIVERY_JOB_HISTORY'],
+        lanes=lanes,
+        max_wait=app.config['DELIVERY_LANE_MAX_WAIT'],
+        schedule=schedule,
+        release_rate=app.config['SCHEDULE_RELEASE_RATE']
+    )
+    atexit.register(delivery_queue.stop)
+    # Pick up emails scheduled before a restart
+    if schedule.next_due() is not None:
+        delivery_queue.start()
+atexit.register(email_service.close)
 
-# Initialize rate limiter with Redis or fallback to memory
+# Shed send requests while this process is overloaded (see services/admission.py)
+admission = None
+if app.config['ADMISSION_ENABLED']:
+    admission = AdmissionController.from_config(
+        app.config, lanes, depth=delivery_queue.depth, latency=delivery_latency,
+        concurrency=app.config['WORKER_CONCURRENCY'] if queue_redis is not None else app.config['DELIVERY_WORKERS']
+    )
+
+# Deliver anything a previous process accepted but did not finish sending
+if outbox is not None:
+    replayed = delivery_queue.replay(outbox.claim_pending(app.config['OUTBOX_REPLAY_GRACE']))
+    if replayed:
+        print(f"📬 Replaying {replayed} undelivered emails from the outbox")
+
+# Initialize rate limiter. Redis is connected in the background, so startup never waits on it;
+# until it is reachable (and whenever it is lost) limits are counted in memory.
 def get_storage_uri():
-    """Get storage URI for rate limiting - Redis if available, memory as fallback"""
-    try:
-        import redis
-        # Test Redis connection
-        r = redis.Redis(
-            host=app.config['REDIS_HOST'],
-            port=app.config['REDIS_PORT'],
-            db=app.config['REDIS_DB'],
-            password=app.config['REDIS_PASSWORD'],
-            socket_connect_timeout=2,
-            socket_timeout=2
-        )
-        r.ping()
-        print("✅ Redis connected successfully for rate limiting")
-        if app.config['REDIS_PASSWORD']:
-            return f"redis://:{app.config['REDIS_PASSWORD']}@{app.config['REDIS_HOST']}:{app.config['REDIS_PORT']}/{app.config['REDIS_DB']}"
-        else:
-            return f"redis://{app.config['REDIS_HOST']}:{app.config['REDIS_PORT']}/{app.config['REDIS_DB']}"
-    except Exception as e:
-        print(f"⚠️ Redis connection failed, falling back to in-memory storage: {e}")
+    """Get storage URI for rate limiting for the configured RATE_LIMIT_MODE"""
+    if rate_limit_mode == 'memory':
         return "memory://"
+    # Hybrid mode counts locally and syncs with Redis in batches instead of on every request
+    scheme = HYBRID_RATE_LIMIT_SCHEME if rate_limit_mode == 'hybrid' else FAILOVER_RATE_LIMIT_SCHEME
+    if app.config['REDIS_PASSWORD']:
+        return f"{scheme}://:{app.config['REDIS_PASSWORD']}@{app.config['REDIS_HOST']}:{app.config['REDIS_PORT']}/{app.config['REDIS_DB']}"
+    else:
+        return f"{scheme}://{app.config['REDIS_HOST']}:{app.config['REDIS_PORT']}/{app.config['REDIS_DB']}"
 
-# Get storage URI and determine storage type
-storage_uri = get_storage_uri()
-storage_type = 'redis' if 'redis://' in storage_uri else 'memory'
+def get_storage_options():
+    """Keyword arguments for the rate limit storage"""
+    if rate_limit_mode == 'hybrid':
+        return {
+            'sync_interval': app.config['RATE_LIMIT_SYNC_INTERVAL'],
+            'tolerance': app.config['RATE_LIMIT_TOLERANCE']
+        }
+    if rate_limit_mode == 'redis':
+        return {
+            'reconnect_interval': app.config['RATE_LIMIT_RECONNECT_INTERVAL'],
+            'max_reconnect_interval': app.config['RATE_LIMIT_MAX_RECONNECT_INTERVAL']
+        }
+    return {}
 
+rate_limit_mode = app.config['RATE_LIMIT_MODE']
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
-    storage_uri=storage_uri
+    storage_uri=get_storage_uri(),
+    storage_options=get_storage_options()
 )
 
+def rate_limit_storage_state():
+    """Active rate limit backend ('redis', 'memory' or 'connecting') and the storage's own stats"""
+    storage = limiter.storage
+    if not hasattr(storage, 'backend'):
+        return 'memory', None
+    return storage.backend, storage.stats()
+
+def rate_limited(f):
+    """Apply the per-second rate limit to a route, timing the limiter's check"""
+    @wraps(f)
+    def allowed(*args, **kwargs):
+        # Only reached once the limiter has let the request through
+        RATE_LIMIT_CHECK_SECONDS.observe(time.perf_counter() - g.rate_limit_start, request.endpoint, 'allowed')
+        return f(*args, **kwargs)
+    
+    limited = limiter.limit(f"{app.config['RATE_LIMIT']} per second")(allowed)
+    
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.rate_limit_start = time.perf_counter()
+        try:
+            return limited(*args, **kwargs)
+        except RateLimitExceeded:
+            RATE_LIMIT_CHECK_SECONDS.observe(time.perf_counter() - g.rate_limit_start, request.endpoint, 'rejected')
+            raise
+    return decorated_function
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    if 'request_start' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, request.endpoint or 'unknown', response.status_code)
+    return response
+
+# Scrape-time views of components that keep their own state
+Gauge('email_delivery_queue_depth', 'Emails waiting in the delivery queue', delivery_queue.depth)
+Gauge('email_delivery_lane_depth', 'Emails waiting in each priority lane',
+      lambda: {(name,): lane['depth'] for name, lane in delivery_queue.lanes().items()}, ('lane',))
+Gauge('email_delivery_lane_oldest_wait_seconds', 'How long the oldest email in each priority lane has waited',
+      lambda: {(name,): lane['oldest_wait'] for name, lane in delivery_queue.lanes().items()}, ('lane',))
+Gauge('email_delivery_retrying', 'Emails waiting for their next delivery attempt', delivery_queue.retrying)
+Gauge('email_delivery_scheduled', 'Emails waiting for their send_at time',
+      lambda: (delivery_queue.scheduled() or {}).get('pending', 0))
+if admission is not None:
+    Gauge('email_admission_load', 'Load seen by admission control (requests are shed from 0.5 to 1 by lane)',
+          lambda: admission.stats()['load'])
+if isinstance(transport, SMTPConnectionPool):
+    Gauge('email_smtp_pool_connections', 'SMTP pool connections by state',
+          lambda: {('idle',): transport.stats()['idle'], ('in_use',): transport.stats()['in_use']}, ('state',))
+    Gauge('email_smtp_pool_size', 'Maximum SMTP pool connections', lambda: transport.size)
+    Gauge('email_smtp_pool_opened_total', 'SMTP sessions opened by the pool',
+          lambda: transport.stats()['created'], kind='counter')
+    Gauge('email_smtp_pool_reconnects_total', 'Sends retried on a fresh session after a dropped connection',
+          lambda: transport.stats()['reconnects'], kind='counter')
+elif isinstance(transport, SMTPAccountPool):
+    Gauge('email_smtp_account_messages_total', 'Messages handled per SMTP account by outcome',
+          lambda: {key: value for account in transport.accounts
+                   for key, value in (((account.name, 'sent'), account.sent), ((account.name, 'failed'), account.failed))},
+          ('account', 'outcome'), kind='counter')
+    Gauge('email_smtp_account_available', 'Whether an SMTP account is taking traffic (0 while drained)',
+          lambda: {(a['name'],): int(a['available']) for a in transport.stats()['accounts']}, ('account',))
+elif transport is not None:
+    Gauge('email_transport_messages_total', 'Messages accepted by the mail transport',
+          lambda: {(app.config['MAIL_BACKEND'],): transport.stats()['sent']}, ('backend',), kind='counter')
+# Circuit breakers of the SMTP server or of each SMTP_ACCOUNTS entry
+smtp_breakers = []
+if isinstance(transport, SMTPConnectionPool):
+    smtp_breakers = [transport.breaker]
+elif isinstance(transport, SMTPAccountPool):
+    smtp_breakers = [account.pool.breaker for account in transport.accounts]
+smtp_breakers = [breaker for breaker in smtp_breakers if breaker is not None]
+if smtp_breakers:
+    Gauge('email_smtp_breaker_open', 'Whether an SMTP circuit breaker is failing sends (1 while open or half-open)',
+          lambda: {(breaker.name,): int(breaker.state != CLOSED) for breaker in smtp_breakers}, ('endpoint',))
+if render_cache is not None:
+    Gauge('email_render_cache_lookups_total', 'Render cache lookups by result',
+          lambda: {('hit',): render_cache.hits, ('miss',): render_cache.misses}, ('result',), kind='counter')
+
 def require_api_key(f):
     """Decorator to require API key for protected routes"""
     @wraps(f)
@@ -58,16 +228,98 @@ def require_api_key(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def breaker_queue():
+    """Delivery queue for inline sends the SMTP circuit breaker refuses, or None to answer them with 503"""
+    return delivery_queue if app.config['SMTP_BREAKER_OPEN_ACTION'] == 'queue' else None
+
+def smtp_unavailable():
+    """Whether inline sends should be queued instead, because the SMTP circuit breaker is open"""
+    return (app.config['SMTP_BREAKER_OPEN_ACTION'] == 'queue' and transport is not None
+            and not transport.available())
+
+def _requested_email_types(data):
+    """Email types a send request asks for (one, or each batch item's); values that are not strings are left out"""
+    if not isinstance(data, dict):
+        return []
+    items = data.get('items')
+    if isinstance(items, list):
+        email_types = [item.get('email_type') for item in items if isinstance(item, dict)]
+    else:
+        email_types = [data.get('email_type')]
+    return [email_type for email_type in email_types if isinstance(email_type, str)]
+
+def admission_controlled(f):
+    """Decorator rejecting send requests with 503 and Retry-After while the process is overloaded"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if admission is None:
+            return f(*args, **kwargs)
+        admitted, retry_after, _ = admission.admit(_requested_email_types(request.get_json(silent=True)))
+        if not admitted:
+            response = app.make_response(create_error_response("Server is overloaded, retry later", 503))
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        admission.enter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            admission.exit()
+    return decorated_function
+
+def idempotent(f):
+    """Decorator answering a repeated Idempotency-Key with the first response instead of running the route again"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if idempotency is None or key is None:
+            return f(*args, **kwargs)
+        if not key or len(key) > 255:
+            return create_error_response("Idempotency-Key must be 1 to 255 characters")
+        
+        key = f"{request.endpoint}:{key}"
+        state, stored = idempotency.acquire(
+            key, fingerprint(request.endpoint, request.get_data()), app.config['IDEMPOTENCY_WAIT_TIMEOUT']
+        )
+        IDEMPOTENT_REQUESTS_TOTAL.inc(request.endpoint, state)
+        if state == REPLAY:
+            status, content_type, body = stored
+            response = Response(body, status=status, content_type=content_type)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        if state == MISMATCH:
+            return create_error_response("Idempotency-Key was already used with a different request", 422)
+        if state == IN_PROGRESS:
+            return create_error_response("A request with this Idempotency-Key is still in progress", 409)
+        
+        try:
+            response = app.make_response(f(*args, **kwargs))
+        except BaseException:
+            idempotency.release(key)
+            raise
+        # Server errors are not remembered, so the client's retry sends for real
+        if response.status_code >= 500:
+            idempotency.release(key)
+        else:
+            idempotency.complete(key, (response.status_code, response.content_type, response.get_data()))
+        return response
+    return decorated_function
+
 @app.route('/send-email', methods=['POST'])
-@limiter.limit(f"{app.config['RATE_LIMIT']} per second")
+@rate_limited
 @require_api_key
+@admission_controlled
+@idempotent
 def send_email():
     """Send email using email type and variables"""
     data = request.get_json()
     
     # Validate request data
+    start = time.perf_counter()
     errors = validate_email_request(data)
+    email_type_label = bounded_label(data.get('email_type') if isinstance(data, dict) else None, VALID_EMAIL_TYPES)
+    SEND_STAGE_SECONDS.observe(time.perf_counter() - start, 'validate', email_type_label, 'error' if errors else 'ok')
     if errors:
+        SENDS_TOTAL.inc(email_type_label, 'invalid')
         return create_error_response("; ".join(errors))
     
     receiver_email = data.get('receiver_email')
@@ -75,12 +327,79 @@ def send_email():
     variables = data.get('variables', {})
     sender_name = data.get('sender_name')
     sender_email = data.get('sender_email')
+    send_at = parse_timestamp(data.get('send_at'))
+    expires_at = parse_timestamp(data.get('expires_at'), 'expires_at')
+    
+    # Queue for background delivery in async mode, when scheduled or while SMTP is down, otherwise send inline
+    if app.config['ASYNC_SEND'] or send_at is not None or smtp_unavailable():
+        return email_service.queue_email(delivery_queue, receiver_email, email_type, variables, sender_name, sender_email,
+                                         send_at, expires_at)
+    return email_service.send_email(receiver_email, email_type, variables, sender_name, sender_email,
+                                    breaker_queue=breaker_queue())
+
+@app.route('/send-email/batch', methods=['POST'])
+@rate_limited
+@require_api_key
+@admission_controlled
+@idempotent
+def send_email_batch():
+    """Send many emails with shared sender fields over one SMTP session"""
+    data = request.get_json()
     
-    # Send email using email service
-    return email_service.send_email(receiver_email, email_type, variables, sender_name, sender_email)
+    errors = validate_batch_request(data, app.config['BATCH_MAX_SIZE'])
+    if errors:
+        return create_error_response("; ".join(errors))
+    
+    send_at = parse_timestamp(data.get('send_at'))
+    return email_service.send_batch(
+        data['items'],
+        data.get('sender_name'),
+        data.get('sender_email'),
+        delivery_queue=delivery_queue if app.config['ASYNC_SEND'] or send_at is not None or smtp_unavailable() else None,
+        send_at=send_at,
+        expires_at=parse_timestamp(data.get('expires_at'), 'expires_at'),
+        breaker_queue=breaker_queue()
+    )
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@rate_limited
+@require_api_key
+def get_job_status(job_id):
+    """Get the delivery status of an asynchronously queued email"""
+    job = delivery_queue.get_job(job_id)
+    if not job:
+        return create_error_response(f"Job '{job_id}' not found", 404)
+    return jsonify(job.to_dict())
+
+@app.route('/dead-letters', methods=['GET'])
+@rate_limited
+@require_api_key
+def list_dead_letters():
+    """List emails that could not be delivered, most recent first"""
+    if dead_letters is None:
+        return create_error_response("Dead-letter store is disabled", 404)
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+    except ValueError:
+        return create_error_response("limit must be an integer")
+    entries = dead_letters.list(limit, request.args.get('email_type'), request.args.get('reason'))
+    return jsonify({
+        'count': dead_letters.count(),
+        'dead_letters': [entry.to_dict() for entry in entries]
+    })
+
+@app.route('/dead-letters/<entry_id>', methods=['GET'])
+@rate_limited
+@require_api_key
+def get_dead_letter(entry_id):
+    """Get one undeliverable email"""
+    entry = dead_letters.get(entry_id) if dead_letters is not None else None
+    if not entry:
+        return create_error_response(f"Dead letter '{entry_id}' not found", 404)
+    return jsonify(entry.to_dict())
 
 @app.route('/email-types', methods=['GET'])
-@limiter.limit(f"{app.config['RATE_LIMIT']} per second")
+@rate_limited
 @require_api_key
 def get_email_types():
     """Get list of available email types with descriptions"""
@@ -91,23 +410,49 @@ def get_email_types():
         }
     return jsonify(email_types)
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics (no API key required)"""
+    if not app.config['METRICS_ENABLED']:
+        return create_error_response("Metrics are disabled", 404)
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint (no API key required)"""
+    rate_limit_backend, rate_limit_stats = rate_limit_storage_state()
     return jsonify({
         'status': 'healthy',
         'service': 'Email Server',
         'version': '2.1.0',
         'email_types_count': len(VALID_EMAIL_TYPES),
+        'delivery': {
+            'mode': 'async' if app.config['ASYNC_SEND'] else 'sync',
+            'queue_backend': app.config['QUEUE_BACKEND'],
+            'queue_depth': delivery_queue.depth(),
+            'lanes': delivery_queue.lanes(),
+            'retrying': delivery_queue.retrying(),
+            'scheduled': delivery_queue.scheduled(),
+            'retry_budget': retry_budget.stats(),
+            'dead_letters': dead_letters.stats() if dead_letters is not None else None,
+            'mail_backend': app.config['MAIL_BACKEND'],
+            'transport': transport.stats() if transport is not None else None
+        },
+        'render_cache': render_cache.stats() if render_cache is not None else None,
+        'idempotency': idempotency.stats() if idempotency is not None else None,
+        'admission': admission.stats() if admission is not None else None,
         'rate_limiting': {
             'limit': f"{app.config['RATE_LIMIT']} per second",
-            'storage': storage_type
+            'storage': rate_limit_backend,
+            'mode': rate_limit_mode,
+            'sync': rate_limit_stats
         }
     })
 
 # Error handler for rate limit exceeded
 @app.errorhandler(429)
 def ratelimit_handler(e):
+    RATE_LIMITED_TOTAL.inc(request.endpoint or 'unknown')
     return create_error_response("Rate limit exceeded. Please try again later.", 429)
 
 if __name__ == '__main__':
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Inspect and replay the dead-letter store.
+
+Usage:
+    python -m app.dead_letters list [--limit N] [--email-type TYPE] [--reason permanent|exhausted|expired]
+    python -m app.dead_letters show ID
+    python -m app.dead_letters replay (ID ... | --all [--email-type TYPE] [--reason REASON] [--limit N])
+    python -m app.dead_letters discard ID ...
+
+replay sends each entry again through the configured MAIL_BACKEND. Entries
+that go through are removed from the store. Entries that fail again stay,
+with the new error and attempt count.
+"""
+
+import argparse
+import sys
+import time
+from flask import Flask
+from flask_mail import Mail
+from config.config import Config
+from .services.dead_letters import create_dead_letter_store
+from .services.email_service import EmailService
+from .services.retry import failure_reason
+from .services.transports import create_transport
+
+
+def _format(entry):
+    failed_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.failed_at))
+    return (f"{entry.id}  {failed_at}  {entry.reason:<9}  attempts={entry.attempts}  "
+            f"{entry.email_type or '-'}  {entry.receiver_email or '-'}  {entry.error}")
+
+
+def replay(store, email_service, entries, app=None):
+    """Deliver entries again; returns the number delivered"""
+    delivered = 0
+    for entry in entries:
+        try:
+            if app is not None:
+                with app.app_context():
+                    email_service.deliver_envelope(entry.envelope)
+            else:
+                email_service.deliver_envelope(entry.envelope)
+        except Exception as e:
+            store.add(entry.id, entry.envelope, str(e) or type(e).__name__, entry.attempts + 1, failure_reason(e),
+                      entry.email_type, entry.receiver_email, entry.subject)
+            print(f"❌ {entry.id} to {entry.receiver_email}: {e}")
+            continue
+        store.remove(entry.id)
+        delivered += 1
+        print(f"✅ {entry.id} delivered to {entry.receiver_email}")
+    return delivered
+
+
+def main():
+    """Dead-letter command entry point"""
+    parser = argparse.ArgumentParser(description="Inspect and replay emails that could not be delivered")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_filters(command):
+        command.add_argument('--limit', type=int, default=50)
+        command.add_argument('--email-type')
+        command.add_argument('--reason', choices=['permanent', 'exhausted', 'expired'])
+
+    add_filters(commands.add_parser('list', help='list entries, most recent first'))
+    commands.add_parser('show', help='print one entry with its message').add_argument('id')
+    replay_command = commands.add_parser('replay', help='send entries again')
+    replay_command.add_argument('ids', nargs='*')
+    replay_command.add_argument('--all', action='store_true', help='replay every entry matching the filters')
+    add_filters(replay_command)
+    commands.add_parser('discard', help='delete entries without sending them').add_argument('ids', nargs='+')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    store = create_dead_letter_store(app.config)
+    if store is None:
+        print("Dead-letter store is disabled (DEAD_LETTER_ENABLED=False)")
+        return 1
+
+    if args.command == 'list':
+        entries = store.list(args.limit, args.email_type, args.reason)
+        for entry in entries:
+            print(_format(entry))
+        print(f"{len(entries)} of {store.count()} entries")
+        return 0
+
+    if args.command == 'show':
+        entry = store.get(args.id)
+        if entry is None:
+            print(f"Dead letter '{args.id}' not found")
+            return 1
+        print(_format(entry))
+        sys.stdout.flush()
+        sys.stdout.buffer.write(entry.envelope[2])
+        return 0
+
+    if args.command == 'discard':
+        removed = sum(1 for entry_id in args.ids if store.remove(entry_id))
+        print(f"🗑️ Discarded {removed} of {len(args.ids)} entries")
+        return 0
+
+    if args.all:
+        entries = store.list(args.limit, args.email_type, args.reason)
+    elif args.ids:
+        entries = [entry for entry in (store.get(entry_id) for entry_id in args.ids) if entry is not None]
+    else:
+        parser.error("replay needs entry ids or --all")
+    mail = Mail(app)
+    email_service = EmailService(mail, create_transport(app.config, mail))
+    try:
+        delivered = replay(store, email_service, entries, app)
+    finally:
+        email_service.close()
+    print(f"📨 Replayed {len(entries)} entries: {delivered} delivered, {len(entries) - delivered} failed again")
+    return 0 if delivered == len(entries) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -54,7 +54,9 @@ def main():
         print("\nPress Ctrl+C to stop the server")
         print("=" * 40)
         
-        app.run(debug=True, host='0.0.0.0', port=5000)
+        # Development server only; production runs under gunicorn (see config/gunicorn.conf.py)
+        debug = os.getenv('FLASK_DEBUG', 'False').lower() in ('true', '1', 'yes')
+        app.run(debug=debug, host='0.0.0.0', port=5000)
         
     except ImportError as e:
         print(f"❌ Error importing Flask application: {e}")
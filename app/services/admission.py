@@ -0,0 +1,166 @@
+"""
+Admission control for the send endpoints.
+
+The rate limiter caps each client, but nothing capped the service as a
+whole. When the mail server slows down, send requests pile up in the request
+threads. Health checks then time out and the container is restarted, which
+drops everything in flight. Now each API process measures its own load and
+rejects send requests early with 503 and a Retry-After header. The work it
+does accept still finishes in bounded time.
+
+Load is the highest of three ratios, each against its ADMISSION_* limit:
+
+    in_flight    send requests this process is handling
+    queue_depth  emails waiting in the delivery queue
+    latency      recent SMTP delivery time (decays while nothing is sent)
+
+A request is admitted while the load is below its lane's threshold,
+0.5 + 0.5 * weight / highest weight. With the default lanes, bulk mail is
+shed from a load of about 0.56 and default mail from 0.75. Transactional
+mail is admitted until the load reaches 1. Retry-After is the estimated
+time to work off the current backlog.
+"""
+
+import math
+import threading
+import time
+
+from .metrics import ADMISSION_REJECTED_TOTAL
+
+
+class LatencyTracker:
+    """Exponentially weighted average of delivery times that fades while there are no deliveries.
+
+    Without the fading, shedding every request after an outage would leave
+    nothing to show that the mail server has recovered.
+    """
+
+    def __init__(self, alpha=0.2, half_life=10.0):
+        self.alpha = alpha
+        self.half_life = half_life
+        self._average = None
+        self._updated = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            if self._average is None:
+                self._average = seconds
+            else:
+                self._average = self._decayed(time.monotonic())
+                self._average += self.alpha * (seconds - self._average)
+            self._updated = time.monotonic()
+
+    def _decayed(self, now):
+        return self._average * 0.5 ** ((now - self._updated) / self.half_life)
+
+    def value(self):
+        """Seconds, or None before the first delivery"""
+        with self._lock:
+            if self._average is None:
+                return None
+            return self._decayed(time.monotonic())
+
+
+class AdmissionController:
+    def __init__(self, router, max_in_flight=8, max_queue_depth=2000, max_latency=5.0, depth=None,
+                 latency=None, concurrency=4, max_retry_after=60, depth_max_age=1.0):
+        self.router = router
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.max_latency = max_latency
+        # Delivery queue depth function, and the deliveries it can run at once
+        self.depth = depth
+        self.concurrency = concurrency
+        self.latency = latency or LatencyTracker()
+        self.max_retry_after = max_retry_after
+        self.depth_max_age = depth_max_age
+        top = max(lane.weight for lane in router.lanes)
+        self.thresholds = {lane.name: 0.5 + 0.5 * lane.weight / top for lane in router.lanes}
+        self._in_flight = 0
+        self._depth = 0
+        self._depth_at = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    @classmethod
+    def from_config(cls, config, router, depth=None, latency=None, concurrency=None):
+        return cls(
+            router,
+            max_in_flight=config['ADMISSION_MAX_IN_FLIGHT'],
+            max_queue_depth=config['ADMISSION_MAX_QUEUE_DEPTH'],
+            max_latency=config['ADMISSION_MAX_LATENCY'],
+            depth=depth,
+            latency=latency,
+            concurrency=concurrency or config['DELIVERY_WORKERS'],
+            max_retry_after=config['ADMISSION_MAX_RETRY_AFTER']
+        )
+
+    def _queue_depth(self):
+        # Reading the depth can mean a Redis round trip per lane; reuse it for depth_max_age seconds
+        if self.depth is None:
+            return 0
+        now = time.monotonic()
+        if self._depth_at is None or now - self._depth_at > self.depth_max_age:
+            try:
+                self._depth = self.depth()
+            except Exception:
+                pass
+            self._depth_at = now
+        return self._depth
+
+    def signals(self):
+        """Current (in_flight, queue_depth, latency) and the load ratio of each"""
+        in_flight, depth, latency = self._in_flight, self._queue_depth(), self.latency.value()
+        ratios = {
+            'in_flight': in_flight / self.max_in_flight if self.max_in_flight else 0,
+            'queue_depth': depth / self.max_queue_depth if self.max_queue_depth else 0,
+            'latency': (latency or 0) / self.max_latency if self.max_latency else 0
+        }
+        return in_flight, depth, latency, ratios
+
+    def admit(self, email_types):
+        """(True, None, None) to admit a request for these email types, or (False, retry_after, reason).
+
+        A request with several types (a batch) is judged by its lowest-priority one.
+        Types that are not strings (raw client JSON) get the default lane.
+        """
+        lane = min((self.router.lane_for(email_type) if isinstance(email_type, str) else self.router.default
+                    for email_type in email_types),
+                   key=lambda candidate: self.thresholds[candidate.name], default=self.router.default)
+        in_flight, depth, latency, ratios = self.signals()
+        reason = max(ratios, key=ratios.get)
+        if ratios[reason] < self.thresholds[lane.name]:
+            return True, None, None
+        with self._lock:
+            self.rejected += 1
+        ADMISSION_REJECTED_TOTAL.inc(lane.name, reason)
+        return False, self.retry_after(in_flight, depth, latency), reason
+
+    def retry_after(self, in_flight, depth, latency):
+        """Whole seconds for the current backlog to drain at the observed delivery time"""
+        per_email = latency if latency else self.max_latency
+        estimate = (in_flight + depth) * per_email / max(1, self.concurrency)
+        return int(min(self.max_retry_after, max(1, math.ceil(estimate))))
+
+    def enter(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def exit(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self):
+        """Load, its signals and the shedding thresholds for the health endpoint"""
+        in_flight, depth, latency, ratios = self.signals()
+        return {
+            'load': round(max(ratios.values()), 3),
+            'in_flight': in_flight,
+            'queue_depth': depth,
+            'latency': round(latency, 3) if latency is not None else None,
+            'limits': {'in_flight': self.max_in_flight, 'queue_depth': self.max_queue_depth,
+                       'latency': self.max_latency},
+            'thresholds': {name: round(value, 3) for name, value in self.thresholds.items()},
+            'rejected': self.rejected
+        }
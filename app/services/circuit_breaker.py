@@ -0,0 +1,147 @@
+"""
+Circuit breaker for an SMTP endpoint.
+
+When the mail server is unreachable or rejects logins, every send waits for
+a full connect or TLS timeout (SMTP_TIMEOUT) before failing. That ties up
+request threads and delivery workers, and an SMTP outage becomes an API
+outage. Each SMTP connection pool (one per SMTP_ACCOUNTS entry) therefore
+has a breaker:
+
+    closed     sends go through; SMTP_BREAKER_FAILURE_THRESHOLD endpoint
+               failures in a row open the breaker
+    open       sends fail at once with CircuitOpenError, without touching
+               the network, for SMTP_BREAKER_PROBE_INTERVAL seconds
+    half_open  one send is let through as a probe; it closes the breaker if
+               the server answers, and opens it again if it does not
+
+Only failures of the endpoint count: connection errors and timeouts, failed
+logins and 421 "service not available" replies. A rejected message means
+the server is up. CircuitOpenError is transient, so queued emails are
+retried once the breaker has had a chance to probe.
+"""
+
+import math
+import threading
+import time
+
+from .metrics import SMTP_BREAKER_REJECTED_TOTAL
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending while a breaker is open"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"SMTP server {name} is unavailable; next attempt in {max(1, math.ceil(retry_after))}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, probe_interval=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+        self.last_error = None
+
+    @classmethod
+    def from_config(cls, config, name):
+        """A breaker for the endpoint called name, or None with SMTP_BREAKER_ENABLED off"""
+        if not config.get('SMTP_BREAKER_ENABLED'):
+            return None
+        return cls(name, config['SMTP_BREAKER_FAILURE_THRESHOLD'], config['SMTP_BREAKER_PROBE_INTERVAL'])
+
+    def _current(self, now):
+        # An open breaker becomes half-open once the probe interval has passed
+        if self._state == OPEN and now - self._opened_at >= self.probe_interval:
+            self._state = HALF_OPEN
+            self._probing = False
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current(time.monotonic())
+
+    def available(self):
+        """Whether a send would be let through now (does not take the probe)"""
+        with self._lock:
+            state = self._current(time.monotonic())
+            return state == CLOSED or (state == HALF_OPEN and not self._probing)
+
+    def allow(self):
+        """Let a send through, or raise CircuitOpenError.
+
+        Every allowed send must be followed by success(), failure() or release().
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current(now)
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+            retry_after = self.probe_interval - (now - self._opened_at) if state == OPEN else self.probe_interval
+        SMTP_BREAKER_REJECTED_TOTAL.inc(self.name)
+        raise CircuitOpenError(self.name, retry_after)
+
+    def success(self):
+        """The server answered"""
+        with self._lock:
+            recovered = self._state != CLOSED
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+        if recovered:
+            print(f"🔌 SMTP circuit breaker for {self.name} closed")
+
+    def failure(self, error):
+        """The endpoint failed: unreachable, timed out or refused the login"""
+        with self._lock:
+            # Only the class: breaker stats are shown on the unauthenticated /health endpoint
+            self.last_error = type(error).__name__
+            self._failures += 1
+            self._current(time.monotonic())
+            # A send that started before the breaker opened does not extend the open interval
+            if self._state == OPEN or (self._state == CLOSED and self._failures < self.failure_threshold):
+                return
+            reopened = self._state == HALF_OPEN
+            self._state = OPEN
+            self._opened_at = time.monotonic()
+            self._probing = False
+            self.opened += 1
+        if reopened:
+            print(f"⚡ SMTP circuit breaker for {self.name} probe failed, open for {self.probe_interval}s: {error}")
+        else:
+            print(f"⚡ SMTP circuit breaker for {self.name} open for {self.probe_interval}s: {error}")
+
+    def release(self):
+        """The send ended without telling anything about the endpoint (e.g. no free connection)"""
+        with self._lock:
+            self._probing = False
+
+    def stats(self):
+        """Breaker state for the health endpoint"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current(now)
+            return {
+                'state': state,
+                'failures': self._failures,
+                'opened': self.opened,
+                'rejected': self.rejected,
+                'retry_after': round(max(0, self.probe_interval - (now - self._opened_at)), 1) if state == OPEN else 0,
+                'last_error': self.last_error
+            }
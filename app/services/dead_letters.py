@@ -0,0 +1,256 @@
+"""
+Dead-letter store for messages that could not be delivered.
+
+A message lands here when the server rejects it permanently (5xx) or when
+its transient failures have used up the retry policy. Each entry keeps the
+full envelope, so it can be inspected through GET /dead-letters and sent
+again with the replay command (python -m app.dead_letters replay).
+
+SQLiteDeadLetterStore keeps entries in a local database. With
+QUEUE_BACKEND=redis, RedisDeadLetterStore keeps them in Redis instead, so
+every API process and worker shares one store.
+"""
+
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id TEXT PRIMARY KEY,
+    email_type TEXT,
+    receiver_email TEXT,
+    subject TEXT,
+    sender TEXT NOT NULL,
+    recipients TEXT NOT NULL,
+    message BLOB NOT NULL,
+    mail_options TEXT NOT NULL,
+    rcpt_options TEXT NOT NULL,
+    error TEXT,
+    reason TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    failed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dead_letters_failed_at ON dead_letters (failed_at);
+'''
+
+_COLUMNS = ('id, email_type, receiver_email, subject, sender, recipients, message, '
+            'mail_options, rcpt_options, error, reason, attempts, failed_at')
+
+
+class DeadLetter:
+    __slots__ = ('id', 'email_type', 'receiver_email', 'subject', 'envelope',
+                 'error', 'reason', 'attempts', 'failed_at')
+
+    def __init__(self, id, email_type, receiver_email, subject, envelope, error, reason, attempts, failed_at):
+        self.id = id
+        self.email_type = email_type
+        self.receiver_email = receiver_email
+        self.subject = subject
+        self.envelope = envelope
+        self.error = error
+        self.reason = reason
+        self.attempts = attempts
+        self.failed_at = failed_at
+
+    def to_dict(self):
+        """Public view of the entry (without the message itself)"""
+        return {
+            'id': self.id,
+            'email_type': self.email_type,
+            'receiver_email': self.receiver_email,
+            'subject': self.subject,
+            'sender': self.envelope[0],
+            'recipients': list(self.envelope[1]),
+            'size': len(self.envelope[2]),
+            'error': self.error,
+            'reason': self.reason,
+            'attempts': self.attempts,
+            'failed_at': self.failed_at
+        }
+
+
+class SQLiteDeadLetterStore:
+    backend = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        # Opened on first use so a server that never dead-letters anything creates no file
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(_SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def add(self, entry_id, envelope, error, attempts, reason, email_type=None, receiver_email=None, subject=None):
+        """Record a message that could not be delivered (replacing an earlier entry with the same id)"""
+        sender, recipients, message, mail_options, rcpt_options = envelope
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        with self._lock:
+            self._db().execute(
+                f'INSERT OR REPLACE INTO dead_letters ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (entry_id, email_type, receiver_email, subject, sender, json.dumps(list(recipients)), message,
+                 json.dumps(list(mail_options)), json.dumps(list(rcpt_options)), error, reason, attempts, time.time())
+            )
+
+    @staticmethod
+    def _entry(row):
+        envelope = (row[4], json.loads(row[5]), bytes(row[6]), json.loads(row[7]), json.loads(row[8]))
+        return DeadLetter(row[0], row[1], row[2], row[3], envelope, row[9], row[10], row[11], row[12])
+
+    def list(self, limit=50, email_type=None, reason=None):
+        """Most recent entries first, optionally filtered by email type or reason"""
+        conditions, params = [], []
+        if email_type:
+            conditions.append('email_type = ?')
+            params.append(email_type)
+        if reason:
+            conditions.append('reason = ?')
+            params.append(reason)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._lock:
+            rows = self._db().execute(
+                f'SELECT {_COLUMNS} FROM dead_letters {where} ORDER BY failed_at DESC LIMIT ?', params + [limit]
+            ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def get(self, entry_id):
+        with self._lock:
+            row = self._db().execute(f'SELECT {_COLUMNS} FROM dead_letters WHERE id = ?', (entry_id,)).fetchone()
+        return self._entry(row) if row else None
+
+    def remove(self, entry_id):
+        """Delete an entry; returns whether it existed"""
+        with self._lock:
+            return self._db().execute('DELETE FROM dead_letters WHERE id = ?', (entry_id,)).rowcount > 0
+
+    def count(self):
+        if self._connection is None and not os.path.exists(self.path):
+            return 0
+        with self._lock:
+            return self._db().execute('SELECT COUNT(*) FROM dead_letters').fetchone()[0]
+
+    def stats(self):
+        """Store state for the health endpoint"""
+        return {'backend': self.backend, 'count': self.count()}
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class RedisDeadLetterStore:
+    """Entries in one hash each, indexed by a sorted set of failure times"""
+
+    backend = 'redis'
+
+    def __init__(self, redis_client, key='email:dead-letters'):
+        self.redis = redis_client
+        self.key = key
+
+    def _entry_key(self, entry_id):
+        return f"{self.key}:{entry_id}"
+
+    def add(self, entry_id, envelope, error, attempts, reason, email_type=None, receiver_email=None, subject=None):
+        sender, recipients, message, mail_options, rcpt_options = envelope
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(self._entry_key(entry_id), mapping={
+            'email_type': email_type or '',
+            'receiver_email': receiver_email or '',
+            'subject': subject or '',
+            'sender': sender,
+            'recipients': json.dumps(list(recipients)),
+            'message': base64.b64encode(message),
+            'mail_options': json.dumps(list(mail_options)),
+            'rcpt_options': json.dumps(list(rcpt_options)),
+            'error': error or '',
+            'reason': reason,
+            'attempts': attempts,
+            'failed_at': now
+        })
+        pipe.zadd(self.key, {entry_id: now})
+        pipe.execute()
+
+    @staticmethod
+    def _entry(entry_id, data):
+        data = {key.decode(): value for key, value in data.items()}
+        text = {key: value.decode() for key, value in data.items() if key != 'message'}
+        envelope = (
+            text['sender'], json.loads(text['recipients']), base64.b64decode(data['message']),
+            json.loads(text['mail_options']), json.loads(text['rcpt_options'])
+        )
+        return DeadLetter(
+            entry_id, text['email_type'] or None, text['receiver_email'] or None, text['subject'] or None,
+            envelope, text['error'] or None, text['reason'], int(text['attempts']), float(text['failed_at'])
+        )
+
+    def list(self, limit=50, email_type=None, reason=None):
+        entries = []
+        start = 0
+        # Filters are applied here, so read the index in pages until enough entries match
+        while len(entries) < limit:
+            ids = self.redis.zrevrange(self.key, start, start + max(limit, 100) - 1)
+            if not ids:
+                break
+            start += len(ids)
+            pipe = self.redis.pipeline(transaction=False)
+            for entry_id in ids:
+                pipe.hgetall(self._entry_key(entry_id.decode()))
+            for entry_id, data in zip(ids, pipe.execute()):
+                if not data:
+                    continue
+                entry = self._entry(entry_id.decode(), data)
+                if (email_type and entry.email_type != email_type) or (reason and entry.reason != reason):
+                    continue
+                entries.append(entry)
+        return entries[:limit]
+
+    def get(self, entry_id):
+        data = self.redis.hgetall(self._entry_key(entry_id))
+        return self._entry(entry_id, data) if data else None
+
+    def remove(self, entry_id):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(self._entry_key(entry_id))
+        pipe.zrem(self.key, entry_id)
+        return pipe.execute()[0] > 0
+
+    def count(self):
+        return self.redis.zcard(self.key)
+
+    def stats(self):
+        try:
+            count = self.count()
+        except Exception:
+            count = None
+        return {'backend': self.backend, 'count': count}
+
+    def close(self):
+        pass
+
+
+def create_dead_letter_store(config, redis_client=None):
+    """The store for the configured queue backend, or None when DEAD_LETTER_ENABLED is off"""
+    if not config['DEAD_LETTER_ENABLED']:
+        return None
+    if config['QUEUE_BACKEND'] == 'redis':
+        if redis_client is None:
+            from ..utils.utils import get_redis_client
+            redis_client = get_redis_client(config)
+        return RedisDeadLetterStore(redis_client, config['DEAD_LETTER_REDIS_KEY'])
+    return SQLiteDeadLetterStore(config['DEAD_LETTER_PATH'])
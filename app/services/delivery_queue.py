@@ -0,0 +1,381 @@
+"""
+In-process delivery queue for asynchronous sends.
+
+The /send-email route validates and renders the message, enqueues it and
+returns 202 immediately. A pool of background worker threads drains the
+queue through EmailService, taking jobs from the priority lanes by weight.
+When the service has an outbox, jobs are made durable before they are
+acknowledged.
+
+A job that fails transiently is put on a delay heap for the backoff chosen
+by the service's retry policy; a scheduler thread moves it back onto the
+queue when it is due.
+
+Emails with a future send_at are kept in a ScheduleStore on disk, not in
+memory, until a timer thread releases them onto the queue (see scheduler.py).
+
+A job may carry a deadline (expires_at), such as the expiry of the link in a
+password reset. A job still waiting when its deadline passes is expired
+instead of sent, and so is a failed job whose next retry would come too late.
+"""
+
+import heapq
+import itertools
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .lanes import Lane, LaneQueue, LaneRouter
+from .metrics import DELIVERY_RETRIES_TOTAL
+from .scheduler import Scheduler
+
+# Job states
+SCHEDULED = 'scheduled'
+QUEUED = 'queued'
+SENDING = 'sending'
+RETRYING = 'retrying'
+SENT = 'sent'
+FAILED = 'failed'
+EXPIRED = 'expired'
+
+
+class QueueFullError(Exception):
+    """Raised when the delivery queue has no room for another job"""
+
+
+class DeliveryJob:
+    __slots__ = ('id', 'envelope', 'email_type', 'receiver_email', 'subject', 'lane', 'status', 'error',
+                 'attempts', 'send_at', 'expires_at', 'next_attempt_at', 'created_at', 'finished_at')
+
+    def __init__(self, envelope, email_type, receiver_email, subject, expires_at=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.envelope = envelope
+        self.email_type = email_type
+        self.receiver_email = receiver_email
+        self.subject = subject
+        self.lane = None
+        self.status = QUEUED
+        self.error = None
+        self.attempts = 0
+        self.send_at = None
+        self.expires_at = expires_at
+        self.next_attempt_at = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        """Public view of the job for API responses"""
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'email_type': self.email_type,
+            'receiver_email': self.receiver_email,
+            'subject': self.subject,
+            'lane': self.lane,
+            'error': self.error,
+            'attempts': self.attempts,
+            'send_at': self.send_at,
+            'expires_at': self.expires_at,
+            'next_attempt_at': self.next_attempt_at,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+
+class DeliveryQueue:
+    def __init__(self, email_service, app=None, workers=4, maxsize=10000, history_size=10000,
+                 lanes=None, max_wait=30, schedule=None, release_rate=100):
+        self.email_service = email_service
+        self.app = app
+        self.worker_count = workers
+        self.history_size = history_size
+
+        # maxsize applies to each lane
+        self._queue = LaneQueue(lanes or LaneRouter([Lane('default')]), maxsize, max_wait)
+        self._jobs = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._threads = []
+        self._started = False
+        self._start_lock = threading.Lock()
+        # (due, sequence, job) heap of jobs waiting to be retried
+        self._delayed = []
+        self._delayed_cond = threading.Condition()
+        self._sequence = itertools.count()
+        self._scheduler = None
+        self._stopping = False
+        # Emails with a future send_at, released by a timer thread
+        self.schedule_store = schedule
+        self._timer = None
+        if schedule is not None:
+            self._timer = Scheduler(schedule, self._release_scheduled, release_rate, record=self._record_scheduled)
+
+    def start(self):
+        """Start the delivery worker threads"""
+        with self._start_lock:
+            if self._started:
+                return
+            for index in range(self.worker_count):
+                thread = threading.Thread(target=self._worker, name=f"delivery-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._stopping = False
+            self._scheduler = threading.Thread(target=self._schedule_loop, name="delivery-scheduler", daemon=True)
+            self._scheduler.start()
+            if self._timer is not None:
+                self._timer.start()
+            self._started = True
+
+    def stop(self, timeout=10):
+        """Signal workers to exit after draining the queue and wait for them.
+        
+        Jobs still waiting for a retry are dropped; with an outbox they are
+        replayed by the next process.
+        """
+        with self._start_lock:
+            if not self._started:
+                return
+            with self._delayed_cond:
+                self._stopping = True
+                self._delayed_cond.notify()
+            if self._timer is not None:
+                self._timer.stop()
+            for _ in self._threads:
+                self._queue.put(None)
+            deadline = time.monotonic() + timeout
+            for thread in self._threads:
+                thread.join(max(0, deadline - time.monotonic()))
+            self._threads = []
+            self._scheduler.join(max(0, deadline - time.monotonic()))
+            self._started = False
+
+    def enqueue(self, envelope, email_type, receiver_email, subject, expires_at=None):
+        """Queue a prepared message for delivery and return its job"""
+        job = self.enqueue_many([(envelope, email_type, receiver_email, subject, expires_at)])[0]
+        if isinstance(job, Exception):
+            raise job
+        return job
+
+    def enqueue_many(self, messages):
+        """Queue (envelope, email_type, receiver_email, subject[, expires_at]) tuples.
+
+        Returns a job, or the QueueFullError that rejected it, for each message.
+        """
+        self.start()
+        jobs = [DeliveryJob(*message) for message in messages]
+
+        outbox = self.email_service.outbox
+        if outbox is not None:
+            outbox.append_many([
+                (job.id, job.email_type, job.receiver_email, job.subject, job.envelope, job.expires_at) for job in jobs
+            ])
+
+        results = []
+        for job in jobs:
+            self._remember(job)
+            try:
+                self._queue.put_nowait(job)
+                results.append(job)
+            except queue.Full:
+                self._forget(job)
+                if outbox is not None:
+                    outbox.mark_failed(job.id, "Delivery queue is full")
+                results.append(QueueFullError("Delivery queue is full"))
+        return results
+
+    def schedule_many(self, messages, send_at):
+        """Hold (envelope, email_type, receiver_email, subject[, expires_at]) tuples until the time.time() value send_at.
+
+        Messages already due are queued straight away. Returns a job, or the
+        QueueFullError that rejected it, for each message.
+        """
+        if self.schedule_store is None or send_at <= time.time():
+            return self.enqueue_many(messages)
+        jobs = [DeliveryJob(*message) for message in messages]
+        self.schedule_store.add_many([
+            (job.id, send_at, job.email_type, job.receiver_email, job.subject, job.envelope, job.expires_at)
+            for job in jobs
+        ])
+        for job in jobs:
+            job.status = SCHEDULED
+            job.send_at = send_at
+            job.lane = self._queue.router.lane_for(job.email_type).name
+            # The store holds the message until it is released
+            job.envelope = None
+        self.start()
+        self._timer.wake(send_at)
+        return jobs
+
+    def schedule(self, envelope, email_type, receiver_email, subject, send_at, expires_at=None):
+        """Hold a prepared message until send_at and return its job"""
+        job = self.schedule_many([(envelope, email_type, receiver_email, subject, expires_at)], send_at)[0]
+        if isinstance(job, Exception):
+            raise job
+        return job
+
+    def _record_scheduled(self, entries):
+        # Runs before the entries leave the schedule, so a crash in between loses nothing
+        outbox = self.email_service.outbox
+        if outbox is not None:
+            outbox.append_many([
+                (entry.id, entry.email_type, entry.receiver_email, entry.subject, entry.envelope, entry.expires_at)
+                for entry in entries
+            ])
+
+    def _release_scheduled(self, entries):
+        for entry in entries:
+            job = DeliveryJob(entry.envelope, entry.email_type, entry.receiver_email, entry.subject,
+                              entry.expires_at, job_id=entry.id)
+            job.created_at = entry.created_at
+            job.send_at = entry.send_at
+            self._remember(job)
+            # Block rather than drop: these were already acknowledged to clients
+            self._queue.put(job)
+
+    def replay(self, entries):
+        """Queue outbox entries left undelivered by a previous process, in the background"""
+        if not entries:
+            return 0
+        self.start()
+        threading.Thread(target=self._replay, args=(entries,), name="outbox-replay", daemon=True).start()
+        return len(entries)
+
+    def _replay(self, entries):
+        for entry in entries:
+            job = DeliveryJob(entry.envelope, entry.email_type, entry.receiver_email, entry.subject,
+                              entry.expires_at, job_id=entry.id)
+            job.created_at = entry.created_at
+            self._remember(job)
+            # Block rather than drop: these were already acknowledged to clients
+            self._queue.put(job)
+
+    def get_job(self, job_id):
+        """Look up a recently queued job by id"""
+        with self._jobs_lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.schedule_store is not None:
+            entry = self.schedule_store.get(job_id)
+            if entry is not None:
+                job = DeliveryJob(None, entry.email_type, entry.receiver_email, entry.subject,
+                                  entry.expires_at, job_id=entry.id)
+                job.status = SCHEDULED
+                job.send_at = entry.send_at
+                job.created_at = entry.created_at
+                job.lane = self._queue.router.lane_for(entry.email_type).name
+        return job
+
+    def depth(self):
+        """Number of jobs waiting for a worker"""
+        return self._queue.qsize()
+
+    def lanes(self):
+        """Depth and wait times of each priority lane"""
+        return self._queue.stats()
+
+    def scheduled(self):
+        """Scheduled emails waiting for their send time, or None without a schedule"""
+        return self._timer.stats() if self._timer is not None else None
+
+    def retrying(self):
+        """Number of jobs waiting for their next attempt"""
+        with self._delayed_cond:
+            return len(self._delayed)
+
+    def _schedule(self, job, due):
+        """Queue a job again once the time.time() value due has passed"""
+        with self._delayed_cond:
+            heapq.heappush(self._delayed, (due, next(self._sequence), job))
+            self._delayed_cond.notify()
+
+    def _schedule_loop(self):
+        """Move due jobs from the delay heap onto the queue"""
+        while True:
+            with self._delayed_cond:
+                while not self._stopping and not (self._delayed and self._delayed[0][0] <= time.time()):
+                    timeout = self._delayed[0][0] - time.time() if self._delayed else None
+                    self._delayed_cond.wait(timeout)
+                if self._stopping:
+                    return
+                due = []
+                while self._delayed and self._delayed[0][0] <= time.time():
+                    due.append(heapq.heappop(self._delayed)[2])
+            for job in due:
+                job.status = QUEUED
+                # Block rather than drop: these were already acknowledged to clients
+                self._queue.put(job)
+
+    def _remember(self, job):
+        with self._jobs_lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history_size:
+                self._jobs.popitem(last=False)
+
+    def _forget(self, job):
+        with self._jobs_lock:
+            self._jobs.pop(job.id, None)
+
+    def _worker(self):
+        """Deliver queued jobs until a stop sentinel is received"""
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            self._deliver(job)
+
+    def _deliver(self, job):
+        if job.expires_at is not None and time.time() >= job.expires_at:
+            self._expire(job)
+            return
+        job.status = SENDING
+        job.attempts += 1
+        policy = self.email_service.retry_policy
+        if policy is not None and job.attempts == 1:
+            policy.begin()
+        try:
+            if self.app is not None:
+                with self.app.app_context():
+                    self.email_service.deliver_envelope(job.envelope)
+            else:
+                self.email_service.deliver_envelope(job.envelope)
+        except Exception as e:
+            job.error = str(e)
+            delay = policy.next_delay(e, job.attempts) if policy is not None else None
+            if delay is not None and job.expires_at is not None and time.time() + delay >= job.expires_at:
+                # The retry would come after the deadline
+                self._expire(job)
+                return
+            if delay is not None:
+                job.status = RETRYING
+                job.next_attempt_at = time.time() + delay
+                DELIVERY_RETRIES_TOTAL.inc('queued')
+                self._schedule(job, job.next_attempt_at)
+                return
+            job.status = FAILED
+            self._record(self.email_service.record_failure, job.id, job.envelope, e, job.attempts,
+                         job.email_type, job.receiver_email, job.subject)
+        else:
+            job.status = SENT
+            job.error = None
+            self._record(self.email_service.record_delivered, job.id)
+        # The rendered message is no longer needed once delivery has finished
+        job.envelope = None
+        job.next_attempt_at = None
+        job.finished_at = time.time()
+
+    def _expire(self, job):
+        """Give up a job whose deadline has passed, without sending it"""
+        job.status = EXPIRED
+        job.error = "Deadline passed before delivery"
+        self._record(self.email_service.record_expired, job.id, job.envelope, job.attempts,
+                     job.email_type, job.receiver_email, job.subject)
+        job.envelope = None
+        job.next_attempt_at = None
+        job.finished_at = time.time()
+
+    @staticmethod
+    def _record(record, *args):
+        try:
+            record(*args)
+        except Exception as e:
+            print(f"⚠️ Failed to record a delivery outcome: {e}")
@@ -1,40 +1,266 @@
-from flask_mail import Message
-from ..templates.templates import TEMPLATE_MAP, get_template_by_type, is_valid_email_type
-from ..utils.utils import render_template, create_success_response, create_error_response
+import math
+import time
+import uuid
+from contextlib import contextmanager
+from flask_mail import Message, BadHeaderError, sanitize_address, sanitize_addresses
+from ..templates.templates import TEMPLATE_MAP, is_valid_email_type
+from ..templates.engine import get_compiled_template
+from ..utils.utils import (
+    validate_email_request, create_success_response, create_accepted_response,
+    create_batch_response, create_error_response, delivery_deadline, parse_timestamp
+)
+from .circuit_breaker import CircuitOpenError
+from .delivery_queue import QueueFullError, SCHEDULED
+from .retry import failure_reason
+from .metrics import (
+    DEAD_LETTERS_TOTAL, DELIVERY_RETRIES_TOTAL, EXPIRED_DELIVERIES_TOTAL, SEND_STAGE_SECONDS, SENDS_TOTAL, bounded_label
+)
+
+class _FlaskMailSession:
+    """Adapts a Flask-Mail connection to the sendmail(*envelope) session interface"""
+    
+    def __init__(self, connection):
+        self.connection = connection
+    
+    def sendmail(self, *envelope):
+        # host is None when Flask-Mail is configured to suppress sending
+        if self.connection.host is not None:
+            self.connection.host.sendmail(*envelope)
 
 class EmailService:
-    def __init__(self, mail):
+    def __init__(self, mail, transport=None, outbox=None, message_builder=None, render_cache=None,
+                 retry_policy=None, sync_retry_policy=None, dead_letters=None, expired_action='drop', latency=None):
         self.mail = mail
+        # SMTP pool or another MAIL_BACKEND transport; None delivers through Flask-Mail
+        self.transport = transport
+        self.outbox = outbox
+        self.message_builder = message_builder
+        self.render_cache = render_cache
+        # Retries for queued deliveries (scheduled by the queue) and for deliveries a client waits on (inline)
+        self.retry_policy = retry_policy
+        self.sync_retry_policy = sync_retry_policy
+        self.dead_letters = dead_letters
+        # What happens to a queued email whose deadline passed: 'drop' or 'dead_letter'
+        self.expired_action = expired_action
+        # Tracker fed with every delivery's duration (admission control watches it)
+        self.latency = latency
     
-    def send_email(self, receiver_email, email_type, variables, sender_name=None, sender_email=None):
-        """Send email using specified email type and variables"""
+    def deliver(self, msg, session=None):
+        """Deliver a message over the transport, or through Flask-Mail when there is none"""
+        self.deliver_envelope(self.envelope(msg), session)
+    
+    def deliver_envelope(self, envelope, session=None):
+        """Deliver prepared sendmail arguments, optionally over an already open session"""
+        start = time.perf_counter()
+        timed = True
         try:
-            if not is_valid_email_type(email_type):
-                return create_error_response(f"Email type '{email_type}' is not valid")
-            
-            template = get_template_by_type(email_type)
-            if not template:
-                return create_error_response(f"Template not found for email type '{email_type}'")
-            
-            subject = render_template(template['subject'], variables)
-            body = render_template(template['body'], variables)
-            
-            # Set sender with name and email
-            if sender_name and sender_email:
-                sender = f"{sender_name} <{sender_email}>"
-            elif sender_email:
-                sender = sender_email
+            if session is not None:
+                session.sendmail(*envelope)
+            elif self.transport is None:
+                with self.session() as session:
+                    session.sendmail(*envelope)
             else:
-                return create_error_response("Sender email is required")
-            
-            msg = Message(
-                subject=subject,
-                recipients=[receiver_email],
-                html=body,
-                sender=sender
-            )
+                self.transport.sendmail(*envelope)
+        except CircuitOpenError:
+            # Nothing was sent, so there is no delivery time to record
+            timed = False
+            raise
+        finally:
+            # Failures count too: a connect timeout is the slowness to react to
+            if timed and self.latency is not None:
+                self.latency.observe(time.perf_counter() - start)
+    
+    @staticmethod
+    def envelope(msg):
+        """Verify a message and return the sendmail arguments for it"""
+        if msg.has_bad_headers():
+            raise BadHeaderError
+        if msg.date is None:
+            msg.date = time.time()
+        
+        return (
+            sanitize_address(msg.sender),
+            list(sanitize_addresses(msg.send_to)),
+            msg.as_bytes(),
+            msg.mail_options,
+            msg.rcpt_options
+        )
+    
+    @contextmanager
+    def session(self):
+        """Hold one transport session for delivering several messages"""
+        if self.transport is None:
+            with self.mail.connect() as connection:
+                yield _FlaskMailSession(connection)
+            return
+        
+        with self.transport.session() as transport_session:
+            yield transport_session
+    
+    def deliver_recorded(self, entry_id, envelope, session=None):
+        """Deliver an entry already written to the outbox and record the outcome.
+        
+        Transient failures are retried inline under the sync retry policy. A
+        failure that is not retried is marked in the outbox and raised, but not
+        dead-lettered: the client is told the send failed and may resend, so a
+        dead-letter replay would deliver a second copy.
+        """
+        policy = self.sync_retry_policy
+        if policy is not None:
+            policy.begin()
+        attempt = 1
+        while True:
+            try:
+                self.deliver_envelope(envelope, session)
+                break
+            except Exception as e:
+                delay = policy.next_delay(e, attempt) if policy is not None else None
+                if delay is None:
+                    if self.outbox is not None:
+                        self.outbox.mark_failed(entry_id, str(e))
+                    raise
+                DELIVERY_RETRIES_TOTAL.inc('sync')
+                time.sleep(delay)
+                attempt += 1
+        self.record_delivered(entry_id)
+    
+    def record_delivered(self, entry_id):
+        """Mark an outbox entry delivered"""
+        if self.outbox is not None:
+            self.outbox.mark_delivered(entry_id)
+    
+    def record_failure(self, entry_id, envelope, error, attempts, email_type=None, receiver_email=None, subject=None):
+        """Record a queued delivery that will not be retried, in the outbox and the dead-letter store"""
+        if self.outbox is not None:
+            self.outbox.mark_failed(entry_id, str(error))
+        reason = failure_reason(error)
+        DEAD_LETTERS_TOTAL.inc(reason)
+        if self.dead_letters is None:
+            return
+        try:
+            self.dead_letters.add(entry_id, envelope, str(error) or type(error).__name__, attempts, reason,
+                                  email_type, receiver_email, subject)
+        except Exception as e:
+            print(f"⚠️ Failed to record undeliverable email {entry_id} in the dead-letter store: {e}")
+    
+    def record_expired(self, entry_id, envelope, attempts, email_type=None, receiver_email=None, subject=None):
+        """Record a queued email given up because its deadline passed, dead-lettering it if configured"""
+        error = "Deadline passed before delivery"
+        if self.outbox is not None:
+            self.outbox.mark_failed(entry_id, error)
+        action = 'dead_letter' if self.expired_action == 'dead_letter' and self.dead_letters is not None else 'drop'
+        EXPIRED_DELIVERIES_TOTAL.inc(email_type or 'unknown', action)
+        if action == 'drop':
+            return
+        DEAD_LETTERS_TOTAL.inc('expired')
+        try:
+            self.dead_letters.add(entry_id, envelope, error, attempts, 'expired', email_type, receiver_email, subject)
+        except Exception as e:
+            print(f"⚠️ Failed to record expired email {entry_id} in the dead-letter store: {e}")
+    
+    def close(self):
+        """Close the transport (pooled SMTP connections), flush the outbox and close the dead-letter store"""
+        if self.transport is not None:
+            self.transport.close()
+        if self.outbox is not None:
+            self.outbox.close()
+        if self.dead_letters is not None:
+            self.dead_letters.close()
+    
+    @staticmethod
+    def _format_sender(sender_name, sender_email):
+        """Set sender with name and email"""
+        if sender_name and sender_email:
+            return f"{sender_name} <{sender_email}>"
+        return sender_email
+    
+    def build_message(self, receiver_email, email_type, variables, sender_name=None, sender_email=None):
+        """Render the template and build the message, returning (message, subject, error)"""
+        if not is_valid_email_type(email_type):
+            return None, None, f"Email type '{email_type}' is not valid"
+        
+        template = get_compiled_template(email_type)
+        if not template:
+            return None, None, f"Template not found for email type '{email_type}'"
+        
+        sender = self._format_sender(sender_name, sender_email)
+        if not sender:
+            return None, None, "Sender email is required"
+        
+        with SEND_STAGE_SECONDS.time('render', email_type):
+            subject, body = self._render(email_type, template, variables)
+        
+        msg = Message(
+            subject=subject,
+            recipients=[receiver_email],
+            html=body,
+            sender=sender
+        )
+        return msg, subject, None
+    
+    def build_envelope(self, receiver_email, email_type, variables, sender_name=None, sender_email=None):
+        """Render the template into sendmail arguments, returning (envelope, subject, error)"""
+        if self.message_builder is None:
+            msg, subject, error = self.build_message(receiver_email, email_type, variables, sender_name, sender_email)
+            if error:
+                return None, None, error
+            with SEND_STAGE_SECONDS.time('build', email_type):
+                envelope = self.envelope(msg)
+            return envelope, subject, None
+        
+        if not is_valid_email_type(email_type):
+            return None, None, f"Email type '{email_type}' is not valid"
+        
+        template = get_compiled_template(email_type)
+        if not template:
+            return None, None, f"Template not found for email type '{email_type}'"
+        
+        sender = self._format_sender(sender_name, sender_email)
+        if not sender:
+            return None, None, "Sender email is required"
+        
+        with SEND_STAGE_SECONDS.time('render', email_type):
+            subject, body = self._render(email_type, template, variables, encoded=True)
+        with SEND_STAGE_SECONDS.time('build', email_type):
+            envelope = self.message_builder.build(email_type, variables, subject, sender, receiver_email, body)
+        return envelope, subject, None
+    
+    def _render(self, email_type, template, variables, encoded=False):
+        """Render (subject, body), through the render cache when one is configured.
+        
+        With encoded=True the body is the message builder's quoted-printable bytes.
+        """
+        def render():
+            subject = template['subject'].render(variables)
+            if encoded:
+                return subject, self.message_builder.encode_body(email_type, variables)
+            return subject, template['body'].render(variables)
+        
+        if self.render_cache is None:
+            return render()
+        key = self.render_cache.key(email_type, template, variables, 'qp' if encoded else 'html')
+        return self.render_cache.get_or_render(key, render)
+    
+    def send_email(self, receiver_email, email_type, variables, sender_name=None, sender_email=None,
+                   breaker_queue=None):
+        """Send email using specified email type and variables.
+        
+        If the circuit breaker refuses the send and breaker_queue is given, the
+        email is queued there instead (202).
+        """
+        try:
+            envelope, subject, error = self.build_envelope(receiver_email, email_type, variables, sender_name, sender_email)
+            if error:
+                SENDS_TOTAL.inc(bounded_label(email_type, TEMPLATE_MAP), 'invalid')
+                return create_error_response(error)
             
-            self.mail.send(msg)
+            entry_id = uuid.uuid4().hex
+            if self.outbox is not None:
+                with SEND_STAGE_SECONDS.time('outbox', email_type):
+                    self.outbox.append(entry_id, email_type, receiver_email, subject, envelope)
+            with SEND_STAGE_SECONDS.time('deliver', email_type):
+                self.deliver_recorded(entry_id, envelope)
+            SENDS_TOTAL.inc(email_type, 'sent')
             
             return create_success_response(
                 f"Email sent successfully to {receiver_email}",
@@ -42,9 +268,191 @@ class EmailService:
                 subject
             )
             
+        except CircuitOpenError as e:
+            if breaker_queue is not None:
+                return self._queue_envelope(breaker_queue, envelope, email_type, receiver_email, subject,
+                                            delivery_deadline(email_type, variables))
+            SENDS_TOTAL.inc(email_type, 'failed')
+            body, status = create_error_response(f"Failed to send email: {str(e)}", 503)
+            return body, status, {'Retry-After': str(max(1, math.ceil(e.retry_after)))}
         except Exception as e:
+            SENDS_TOTAL.inc(bounded_label(email_type, TEMPLATE_MAP), 'failed')
             return create_error_response(f"Failed to send email: {str(e)}", 500)
     
+    def _queue_envelope(self, delivery_queue, envelope, email_type, receiver_email, subject, deadline):
+        """Queue an already built email an inline send could not deliver, returning 202 with the job id"""
+        try:
+            job = delivery_queue.enqueue(envelope, email_type, receiver_email, subject, deadline)
+        except QueueFullError as e:
+            SENDS_TOTAL.inc(email_type, 'rejected')
+            return create_error_response(str(e), 503)
+        except Exception as e:
+            SENDS_TOTAL.inc(email_type, 'failed')
+            return create_error_response(f"Failed to queue email: {str(e)}", 500)
+        SENDS_TOTAL.inc(email_type, 'queued')
+        return create_accepted_response(
+            f"Email to {receiver_email} queued for delivery",
+            email_type,
+            subject,
+            job.id
+        )
+    
+    def queue_email(self, delivery_queue, receiver_email, email_type, variables, sender_name=None, sender_email=None,
+                    send_at=None, expires_at=None):
+        """Render the email and hand it to the delivery queue (to hold until send_at if given), returning 202 with the job id.
+        
+        The job expires at expires_at, or after the template's expiry_hours.
+        """
+        try:
+            envelope, subject, error = self.build_envelope(receiver_email, email_type, variables, sender_name, sender_email)
+            if error:
+                SENDS_TOTAL.inc(bounded_label(email_type, TEMPLATE_MAP), 'invalid')
+                return create_error_response(error)
+            
+            deadline = delivery_deadline(email_type, variables, expires_at, send_at)
+            with SEND_STAGE_SECONDS.time('enqueue', email_type):
+                if send_at is not None:
+                    job = delivery_queue.schedule(envelope, email_type, receiver_email, subject, send_at, deadline)
+                else:
+                    job = delivery_queue.enqueue(envelope, email_type, receiver_email, subject, deadline)
+            
+            if job.status == SCHEDULED:
+                SENDS_TOTAL.inc(email_type, 'scheduled')
+                return create_accepted_response(
+                    f"Email to {receiver_email} scheduled for delivery",
+                    email_type,
+                    subject,
+                    job.id,
+                    job.send_at
+                )
+            SENDS_TOTAL.inc(email_type, 'queued')
+            return create_accepted_response(
+                f"Email to {receiver_email} queued for delivery",
+                email_type,
+                subject,
+                job.id
+            )
+            
+        except QueueFullError as e:
+            SENDS_TOTAL.inc(email_type, 'rejected')
+            return create_error_response(str(e), 503)
+        except Exception as e:
+            SENDS_TOTAL.inc(bounded_label(email_type, TEMPLATE_MAP), 'failed')
+            return create_error_response(f"Failed to queue email: {str(e)}", 500)
+    
+    def send_batch(self, items, sender_name=None, sender_email=None, delivery_queue=None, send_at=None, expires_at=None,
+                   breaker_queue=None):
+        """Send a list of emails over one SMTP session (or queue them, held until send_at if given), returning per-item results.
+        
+        Queued items expire at their own expires_at, the batch's, or after their template's expiry_hours.
+        Items the circuit breaker refuses to send inline are queued on breaker_queue if given.
+        """
+        results = []
+        messages = []
+        
+        for index, item in enumerate(items):
+            # One malformed item is reported in its own result and does not fail the batch
+            if not isinstance(item, dict):
+                results.append({'index': index, 'receiver_email': None, 'email_type': None, 'success': False,
+                                'error': "Item must be an object"})
+                continue
+            receiver_email = item.get('receiver_email')
+            email_type = item.get('email_type')
+            result = {'index': index, 'receiver_email': receiver_email, 'email_type': email_type, 'success': False}
+            results.append(result)
+            
+            try:
+                errors = validate_email_request(dict(item, sender_email=sender_email))
+            except Exception as e:
+                errors = [f"Invalid item: {str(e) or type(e).__name__}"]
+            if errors:
+                result['error'] = "; ".join(errors)
+                continue
+            
+            try:
+                envelope, subject, error = self.build_envelope(receiver_email, email_type, item.get('variables', {}), sender_name, sender_email)
+            except Exception as e:
+                error = f"Failed to build email: {str(e) or type(e).__name__}"
+            if error:
+                result['error'] = error
+                continue
+            
+            result['subject'] = subject
+            item_expires_at = parse_timestamp(item.get('expires_at'), 'expires_at')
+            deadline = delivery_deadline(email_type, item.get('variables', {}),
+                                         item_expires_at if item_expires_at is not None else expires_at, send_at)
+            messages.append((result, envelope, deadline))
+        
+        if delivery_queue is not None:
+            batch = [
+                (envelope, result['email_type'], result['receiver_email'], result['subject'], deadline)
+                for result, envelope, deadline in messages
+            ]
+            try:
+                if send_at is not None:
+                    jobs = delivery_queue.schedule_many(batch, send_at)
+                else:
+                    jobs = delivery_queue.enqueue_many(batch)
+            except Exception as e:
+                jobs = [e] * len(messages)
+            for (result, _, _), job in zip(messages, jobs):
+                if isinstance(job, Exception):
+                    result['error'] = str(job)
+                else:
+                    result['success'] = True
+                    result['job_id'] = job.id
+                    result['status'] = job.status
+                    if job.send_at is not None:
+                        result['send_at'] = job.send_at
+        elif messages:
+            entry_ids = [uuid.uuid4().hex for _ in messages]
+            try:
+                if self.outbox is not None:
+                    self.outbox.append_many([
+                        (entry_id, result['email_type'], result['receiver_email'], result['subject'], envelope)
+                        for entry_id, (result, envelope, _) in zip(entry_ids, messages)
+                    ])
+                refused = []
+                with self.session() as session:
+                    for entry_id, (result, envelope, deadline) in zip(entry_ids, messages):
+                        try:
+                            self.deliver_recorded(entry_id, envelope, session)
+                            result['success'] = True
+                        except CircuitOpenError as e:
+                            result['error'] = f"Failed to send email: {str(e)}"
+                            refused.append((result, envelope, deadline))
+                        except Exception as e:
+                            result['error'] = f"Failed to send email: {str(e)}"
+                if refused and breaker_queue is not None:
+                    self._queue_refused(breaker_queue, refused)
+            except Exception as e:
+                # Could not record the batch or open (or cleanly close) the SMTP session
+                for result, _, _ in messages:
+                    if not result['success'] and 'error' not in result:
+                        result['error'] = f"Failed to send email: {str(e)}"
+        
+        succeeded = sum(1 for result in results if result['success'])
+        return create_batch_response(results, succeeded, queued=delivery_queue is not None)
+    
+    @staticmethod
+    def _queue_refused(delivery_queue, refused):
+        """Queue batch items the circuit breaker kept from being sent inline"""
+        try:
+            jobs = delivery_queue.enqueue_many([
+                (envelope, result['email_type'], result['receiver_email'], result['subject'], deadline)
+                for result, envelope, deadline in refused
+            ])
+        except Exception as e:
+            jobs = [e] * len(refused)
+        for (result, _, _), job in zip(refused, jobs):
+            if isinstance(job, Exception):
+                result['error'] = f"Failed to queue email: {str(job)}"
+            else:
+                del result['error']
+                result['success'] = True
+                result['job_id'] = job.id
+                result['status'] = job.status
+    
     def send_welcome_email(self, receiver_email, name, email, login_url, sender_name, sender_email):
         """Send welcome email to new users"""
         variables = {
@@ -0,0 +1,237 @@
+"""
+Idempotency keys for send requests.
+
+Clients retry /send-email when a slow SMTP exchange times out on their side.
+The first send often still goes through, so the retry used to send the email
+a second time. A client that sets an Idempotency-Key header gets the stored
+response of the first request back instead, without another send.
+
+A key is claimed before the request runs. A duplicate that arrives while the
+first request is still sending waits for it and then gets its response,
+instead of racing it to the mail server. If the first request fails with a
+server error the key is released, so the retry sends for real.
+
+Each key remembers a fingerprint of the request body. Reusing a key with a
+different body is rejected rather than answered with an unrelated response.
+
+IdempotencyStore keeps keys in a bounded in-process LRU. RedisIdempotencyStore
+keeps them in Redis, so a retry that lands on another API process is still
+recognised.
+"""
+
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Outcomes of IdempotencyStore.acquire
+NEW = 'new'                  # the caller owns the key and must complete() or release() it
+REPLAY = 'replayed'          # the key finished earlier; the stored response comes with it
+MISMATCH = 'mismatch'        # the key was used with a different request body
+IN_PROGRESS = 'in_progress'  # the first request was still running when the wait timed out
+
+
+def fingerprint(*parts):
+    """Digest identifying a request (endpoint, body) for a key"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class _Entry:
+    __slots__ = ('fingerprint', 'response', 'expires_at', 'done')
+
+    def __init__(self, fingerprint, expires_at):
+        self.fingerprint = fingerprint
+        self.response = None
+        self.expires_at = expires_at
+        self.done = threading.Event()
+
+
+class IdempotencyStore:
+    """Keys in a bounded LRU; responses are (status, content_type, body) tuples"""
+
+    backend = 'memory'
+
+    def __init__(self, ttl=86400, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.replays = 0
+        self.evictions = 0
+
+    def acquire(self, key, fingerprint, timeout=30):
+        """Claim key for a request, waiting up to timeout seconds while another request holds it"""
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry.expires_at <= now:
+                    del self._entries[key]
+                    entry = None
+                if entry is None:
+                    self._entries[key] = _Entry(fingerprint, now + self.ttl)
+                    self._evict()
+                    return NEW, None
+                if entry.fingerprint != fingerprint:
+                    return MISMATCH, None
+                if entry.response is not None:
+                    self._entries.move_to_end(key)
+                    self.replays += 1
+                    return REPLAY, entry.response
+                done = entry.done
+            # Released keys are claimed by the next waiter on the following pass
+            if not done.wait(max(0, deadline - now)):
+                return IN_PROGRESS, None
+
+    def complete(self, key, response):
+        """Store the response for a claimed key and wake requests waiting on it"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.response = response
+            self._entries.move_to_end(key)
+        entry.done.set()
+
+    def release(self, key):
+        """Give up a claimed key without a response, so a retry runs the request again"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.done.set()
+
+    def _evict(self):
+        # Oldest finished keys go first; keys still in flight are never dropped
+        while len(self._entries) > self.max_entries:
+            for key, entry in self._entries.items():
+                if entry.response is not None:
+                    break
+            else:
+                return
+            del self._entries[key]
+            self.evictions += 1
+
+    def stats(self):
+        """Store state for the health endpoint"""
+        with self._lock:
+            in_flight = sum(1 for entry in self._entries.values() if entry.response is None)
+            return {
+                'backend': self.backend,
+                'keys': len(self._entries),
+                'in_flight': in_flight,
+                'max_entries': self.max_entries,
+                'replays': self.replays,
+                'evictions': self.evictions
+            }
+
+
+class RedisIdempotencyStore:
+    """Keys shared by every API process, expiring after ttl.
+
+    A claimed key holds a pending marker that expires after lock_ttl, so a
+    process that dies mid-send does not block the key for the full ttl.
+    Duplicates in other processes poll until the marker is replaced by the
+    response. Redis errors let the request through without idempotency.
+    """
+
+    backend = 'redis'
+
+    def __init__(self, redis_client, ttl=86400, lock_ttl=120, prefix='email:idempotency:', poll_interval=0.05):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.prefix = prefix
+        self.poll_interval = poll_interval
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self.replays = 0
+        self.errors = 0
+
+    def acquire(self, key, fingerprint, timeout=30):
+        deadline = time.monotonic() + timeout
+        token = uuid.uuid4().hex
+        pending = json.dumps({'fingerprint': fingerprint, 'token': token})
+        try:
+            while True:
+                if self.redis.set(self.prefix + key, pending, nx=True, ex=self.lock_ttl):
+                    with self._lock:
+                        self._tokens[key] = token
+                    return NEW, None
+                data = self.redis.get(self.prefix + key)
+                if data is not None:
+                    stored = json.loads(data)
+                    if stored['fingerprint'] != fingerprint:
+                        return MISMATCH, None
+                    if 'status' in stored:
+                        with self._lock:
+                            self.replays += 1
+                        return REPLAY, (stored['status'], stored['content_type'], stored['body'].encode('utf-8'))
+                if time.monotonic() >= deadline:
+                    return IN_PROGRESS, None
+                time.sleep(self.poll_interval)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            return NEW, None
+
+    def _owned(self, key):
+        """The pending marker of a key this process claimed, or None if it is no longer ours"""
+        with self._lock:
+            token = self._tokens.pop(key, None)
+        if token is None:
+            return None
+        data = self.redis.get(self.prefix + key)
+        # The marker may have expired and been claimed by another request in the meantime
+        pending = json.loads(data) if data is not None else None
+        return pending if pending is not None and pending.get('token') == token else None
+
+    def complete(self, key, response):
+        status, content_type, body = response
+        try:
+            pending = self._owned(key)
+            if pending is not None:
+                self.redis.set(self.prefix + key, json.dumps({
+                    'fingerprint': pending['fingerprint'],
+                    'status': status,
+                    'content_type': content_type,
+                    'body': body.decode('utf-8')
+                }), ex=self.ttl)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+
+    def release(self, key):
+        try:
+            if self._owned(key) is not None:
+                self.redis.delete(self.prefix + key)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.backend,
+                'in_flight': len(self._tokens),
+                'replays': self.replays,
+                'errors': self.errors
+            }
+
+
+def create_idempotency_store(config, redis_client=None):
+    """The store for IDEMPOTENCY_BACKEND, or None when IDEMPOTENCY_ENABLED is off"""
+    if not config['IDEMPOTENCY_ENABLED']:
+        return None
+    if config['IDEMPOTENCY_BACKEND'] == 'redis':
+        if redis_client is None:
+            from ..utils.utils import get_redis_client
+            redis_client = get_redis_client(config, socket_timeout=1)
+        return RedisIdempotencyStore(redis_client, config['IDEMPOTENCY_TTL'], config['IDEMPOTENCY_LOCK_TTL'])
+    return IdempotencyStore(config['IDEMPOTENCY_TTL'], config['IDEMPOTENCY_MAX_ENTRIES'])
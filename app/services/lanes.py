@@ -0,0 +1,210 @@
+"""
+Priority lanes for queued deliveries.
+
+Every email type belongs to a lane. Workers take jobs from the lanes by
+smooth weighted round-robin, so with the default lanes a login link or
+password reset waits behind at most a few other jobs even while an invoice
+run fills the bulk lane:
+
+    transactional  weight 8  password_reset_email, account_confirmation_email, access_key_email
+    default        weight 4  every type not listed in another lane
+    bulk           weight 1  invoice_email
+
+Every lane has a weight of at least 1, so low-priority work always keeps its
+share and is never starved. On top of that, a job that has waited
+DELIVERY_LANE_MAX_WAIT seconds is served ahead of its turn. Aged jobs take at
+most every other pick, so fresh high-priority work is never pushed back
+behind a long backlog.
+"""
+
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+from .metrics import DELIVERY_QUEUE_WAIT_SECONDS
+
+DEFAULT_LANES = [
+    {'name': 'transactional', 'weight': 8,
+     'email_types': ['password_reset_email', 'account_confirmation_email', 'access_key_email']},
+    {'name': 'default', 'weight': 4},
+    {'name': 'bulk', 'weight': 1, 'email_types': ['invoice_email']}
+]
+
+
+class Lane:
+    def __init__(self, name, weight=1, email_types=()):
+        self.name = name
+        self.weight = weight
+        self.email_types = tuple(email_types)
+        self.current = 0  # smooth weighted round-robin state
+
+
+def parse_lanes(config):
+    """Lanes from DELIVERY_LANES (a JSON list), or DEFAULT_LANES when it is not set.
+
+    Each entry takes name, weight and email_types. The lane without
+    email_types takes every other type; if no lane is marked that way, a
+    'default' lane with weight 1 is added.
+    """
+    raw = config.get('DELIVERY_LANES') or ''
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw) if raw.strip() else DEFAULT_LANES
+        except ValueError as e:
+            raise ValueError(f"DELIVERY_LANES is not valid JSON: {e}")
+    if not isinstance(raw, list) or not raw:
+        raise ValueError("DELIVERY_LANES must be a non-empty JSON list of lanes")
+
+    lanes, names, assigned = [], set(), {}
+    for index, entry in enumerate(raw):
+        if not isinstance(entry, dict) or not entry.get('name'):
+            raise ValueError(f"DELIVERY_LANES[{index}] must be an object with a name")
+        name = str(entry['name'])
+        if name in names:
+            raise ValueError(f"DELIVERY_LANES has two lanes named '{name}'")
+        names.add(name)
+        weight = int(entry.get('weight', 1))
+        if weight < 1:
+            raise ValueError(f"DELIVERY_LANES[{index}] weight must be at least 1")
+        email_types = entry.get('email_types') or []
+        for email_type in email_types:
+            if email_type in assigned:
+                raise ValueError(f"Email type '{email_type}' is in lanes '{assigned[email_type]}' and '{name}'")
+            assigned[email_type] = name
+        lanes.append(Lane(name, weight, email_types))
+
+    catch_all = [lane for lane in lanes if not lane.email_types]
+    if len(catch_all) > 1:
+        raise ValueError("Only one DELIVERY_LANES entry may leave out email_types")
+    if not catch_all:
+        if 'default' in names:
+            raise ValueError("The 'default' lane must leave out email_types")
+        lanes.append(Lane('default'))
+    return lanes
+
+
+class LaneRouter:
+    """Maps email types to lanes and picks the next lane to serve"""
+
+    def __init__(self, lanes):
+        self.lanes = lanes
+        self.default = next(lane for lane in lanes if not lane.email_types)
+        self._by_type = {email_type: lane for lane in lanes for email_type in lane.email_types}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(parse_lanes(config))
+
+    def lane_for(self, email_type):
+        return self._by_type.get(email_type, self.default)
+
+    def select(self, candidates):
+        """Next lane among candidates by smooth weighted round-robin"""
+        with self._lock:
+            total = 0
+            for lane in candidates:
+                lane.current += lane.weight
+                total += lane.weight
+            lane = max(candidates, key=lambda candidate: candidate.current)
+            lane.current -= total
+            return lane
+
+
+class _LaneState:
+    __slots__ = ('jobs', 'served', 'aged', 'total_wait')
+
+    def __init__(self):
+        self.jobs = deque()  # (time.monotonic() when queued, job)
+        self.served = 0
+        self.aged = 0
+        self.total_wait = 0.0
+
+
+class LaneQueue:
+    """Queue with one FIFO per lane, served by weight, with the get/put interface of queue.Queue.
+
+    maxsize bounds each lane separately, so a bulk run that fills its lane
+    never causes transactional mail to be rejected. Putting None queues a
+    stop signal that get() returns once every lane is empty.
+    """
+
+    def __init__(self, router, maxsize=0, max_wait=30):
+        self.router = router
+        self.maxsize = maxsize
+        self.max_wait = max_wait
+        self._states = {lane.name: _LaneState() for lane in router.lanes}
+        self._cond = threading.Condition()
+        self._stops = 0
+        self._last_aged = False
+
+    def put(self, job, block=True):
+        """Queue a job in its email type's lane, waiting for room unless block is False"""
+        with self._cond:
+            if job is None:
+                self._stops += 1
+                self._cond.notify()
+                return
+            lane = self.router.lane_for(job.email_type)
+            job.lane = lane.name
+            state = self._states[lane.name]
+            while self.maxsize and len(state.jobs) >= self.maxsize:
+                if not block:
+                    raise queue.Full
+                self._cond.wait()
+            state.jobs.append((time.monotonic(), job))
+            self._cond.notify_all()
+
+    def put_nowait(self, job):
+        self.put(job, block=False)
+
+    def get(self):
+        """Wait for the next job by lane priority, or None after a stop signal"""
+        with self._cond:
+            while True:
+                ready = [lane for lane in self.router.lanes if self._states[lane.name].jobs]
+                if ready:
+                    break
+                if self._stops:
+                    self._stops -= 1
+                    return None
+                self._cond.wait()
+
+            now = time.monotonic()
+            oldest = min(ready, key=lambda lane: self._states[lane.name].jobs[0][0])
+            aged = (self.max_wait and not self._last_aged
+                    and now - self._states[oldest.name].jobs[0][0] >= self.max_wait)
+            lane = oldest if aged else self.router.select(ready)
+            self._last_aged = bool(aged)
+
+            state = self._states[lane.name]
+            queued_at, job = state.jobs.popleft()
+            state.served += 1
+            state.aged += bool(aged)
+            state.total_wait += now - queued_at
+            # Wake producers blocked on a full lane
+            self._cond.notify_all()
+        DELIVERY_QUEUE_WAIT_SECONDS.observe(now - queued_at, lane.name)
+        return job
+
+    def qsize(self):
+        with self._cond:
+            return sum(len(state.jobs) for state in self._states.values())
+
+    def stats(self):
+        """Depth and waits per lane for the health endpoint"""
+        now = time.monotonic()
+        with self._cond:
+            return {
+                lane.name: {
+                    'weight': lane.weight,
+                    'depth': len(state.jobs),
+                    'oldest_wait': round(now - state.jobs[0][0], 3) if state.jobs else 0,
+                    'mean_wait': round(state.total_wait / state.served, 3) if state.served else 0,
+                    'served': state.served,
+                    'aged': state.aged
+                }
+                for lane, state in ((lane, self._states[lane.name]) for lane in self.router.lanes)
+            }
@@ -0,0 +1,272 @@
+"""
+Prometheus-style metrics with per-thread aggregation.
+
+Counters and histograms record into a dict owned by the calling thread, so
+an observation takes no lock and never contends with other request or
+delivery threads. A scrape merges every thread's values; values of threads
+that have exited are folded into a retired total and their shards dropped.
+Gauges are read from a callback at scrape time.
+
+Metrics are per process: with several server workers each /metrics scrape
+reports the worker that answered it.
+"""
+
+import math
+import threading
+import time
+from bisect import bisect_left
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from sub-millisecond renders up to slow SMTP sessions
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def bounded_label(value, allowed, other='unknown'):
+    """value if it is one of allowed, else other, so client input cannot create unbounded label sets"""
+    return value if isinstance(value, str) and value in allowed else other
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.enabled = True
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def unregister(self, name):
+        """Drop a metric by name (used when a component is replaced)"""
+        with self._lock:
+            self._metrics = [metric for metric in self._metrics if metric.name != name]
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _ShardedMetric:
+    """Values kept in one dict per thread, keyed by the label values tuple"""
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _values(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), values))
+            return values
+
+    def _merge(self, target, values):
+        raise NotImplementedError
+
+    def collect(self):
+        """Merged values across all threads"""
+        with self._lock:
+            live = []
+            for thread, values in self._shards:
+                if thread.is_alive():
+                    live.append((thread, values))
+                else:
+                    self._merge(self._retired, values)
+            self._shards = live
+            merged = {}
+            self._merge(merged, self._retired)
+            for _, values in live:
+                self._merge(merged, values)
+        return merged
+
+
+class Counter(_ShardedMetric):
+    kind = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        if not self.registry.enabled:
+            return
+        values = self._values()
+        values[labelvalues] = values.get(labelvalues, 0) + amount
+
+    def _merge(self, target, values):
+        for labels, value in list(values.items()):
+            target[labels] = target.get(labels, 0) + value
+
+    def samples(self):
+        for labels, value in sorted(self.collect().items()):
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}'
+
+
+class Histogram(_ShardedMetric):
+    """Each entry is a list of per-bucket counts followed by the sum of observations"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, help, labelnames, registry)
+
+    def observe(self, value, *labelvalues):
+        if not self.registry.enabled:
+            return
+        values = self._values()
+        entry = values.get(labelvalues)
+        if entry is None:
+            entry = values[labelvalues] = [0] * (len(self.buckets) + 1)
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def time(self, *labelvalues):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, labelvalues)
+
+    def _merge(self, target, values):
+        for labels, entry in list(values.items()):
+            current = target.get(labels)
+            if current is None:
+                target[labels] = list(entry)
+            else:
+                for index, value in enumerate(list(entry)):
+                    current[index] += value
+
+    def samples(self):
+        for labels, entry in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                le = f'le="{_format_number(float(bound))}"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}'
+            label_text = _format_labels(self.labelnames, labels)
+            yield f'{self.name}_sum{label_text} {_format_number(entry[-1])}'
+            yield f'{self.name}_count{label_text} {cumulative}'
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labelvalues', 'start')
+
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues, 'ok' if exc_type is None else 'error')
+
+
+class Gauge:
+    """Value read at scrape time from function(), which returns a number or a {labelvalues: number} dict.
+
+    kind='counter' exposes a running total kept elsewhere (such as a pool's stats()).
+    """
+
+    def __init__(self, name, help, function, labelnames=(), kind='gauge', registry=REGISTRY):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.function = function
+        self.labelnames = tuple(labelnames)
+        registry.unregister(name)
+        registry.register(self)
+
+    def samples(self):
+        try:
+            value = self.function()
+        except Exception:
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, number in sorted(value.items()):
+            if number is not None:
+                yield f'{self.name}{_format_labels(self.labelnames, labels)} {_format_number(number)}'
+
+
+# Send pipeline
+SEND_STAGE_SECONDS = Histogram(
+    'email_send_stage_seconds', 'Time spent in each stage of sending an email',
+    ('stage', 'email_type', 'outcome')
+)
+SENDS_TOTAL = Counter('email_sends_total', 'Emails handled by /send-email', ('email_type', 'outcome'))
+IDEMPOTENT_REQUESTS_TOTAL = Counter(
+    'email_idempotent_requests_total', 'Requests with an Idempotency-Key by result', ('endpoint', 'result')
+)
+DELIVERY_QUEUE_WAIT_SECONDS = Histogram(
+    'email_delivery_queue_wait_seconds', 'Time queued emails wait for a delivery worker', ('lane',),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+)
+DELIVERY_RETRIES_TOTAL = Counter(
+    'email_delivery_retries_total', 'Delivery attempts retried after a transient failure', ('mode',)
+)
+DEAD_LETTERS_TOTAL = Counter(
+    'email_dead_letters_total', 'Emails moved to the dead-letter store', ('reason',)
+)
+EXPIRED_DELIVERIES_TOTAL = Counter(
+    'email_expired_deliveries_total', 'Queued emails not sent because their deadline passed', ('email_type', 'action')
+)
+ADMISSION_REJECTED_TOTAL = Counter(
+    'email_admission_rejected_total', 'Send requests shed with 503 by admission control', ('lane', 'reason')
+)
+
+# SMTP transport
+SMTP_CONNECT_SECONDS = Histogram(
+    'email_smtp_connect_seconds', 'Time to open an SMTP session (connect, STARTTLS and login)', ('outcome',)
+)
+SMTP_SEND_SECONDS = Histogram(
+    'email_smtp_send_seconds', 'Time to transfer one message over an open SMTP session (MAIL, RCPT and DATA)',
+    ('outcome',)
+)
+SMTP_BREAKER_REJECTED_TOTAL = Counter(
+    'email_smtp_breaker_rejected_total', 'Sends failed at once because the SMTP circuit breaker was open', ('endpoint',)
+)
+
+# HTTP layer
+REQUEST_SECONDS = Histogram('email_http_request_seconds', 'HTTP request latency', ('endpoint', 'status'))
+RATE_LIMIT_CHECK_SECONDS = Histogram(
+    'email_rate_limit_check_seconds', 'Time spent in the rate limiter check', ('endpoint', 'outcome')
+)
+RATE_LIMITED_TOTAL = Counter('email_rate_limited_total', 'Requests rejected by the rate limiter', ('endpoint',))
@@ -0,0 +1,269 @@
+"""
+Durable on-disk outbox backed by SQLite in WAL mode.
+
+Every message is recorded before it is acknowledged, and marked delivered
+or failed once the SMTP exchange finishes, so a crash or redeploy never
+loses accepted mail: undelivered entries are replayed on startup.
+
+All writes go through a single writer thread that commits whatever has
+accumulated since its last commit in one transaction (group commit), so a
+burst of concurrent requests shares one fsync instead of paying one each.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Entry states
+PENDING = 'pending'
+DELIVERED = 'delivered'
+FAILED = 'failed'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    email_type TEXT,
+    receiver_email TEXT,
+    subject TEXT,
+    sender TEXT NOT NULL,
+    recipients TEXT NOT NULL,
+    message BLOB NOT NULL,
+    mail_options TEXT NOT NULL,
+    rcpt_options TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    expires_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, updated_at);
+'''
+
+# OR IGNORE: a scheduled email released again after a crash may already be recorded,
+# and one failed row must not fail the whole group commit
+_INSERT_SQL = '''
+INSERT OR IGNORE INTO outbox (id, status, email_type, receiver_email, subject, sender, recipients,
+                    message, mail_options, rcpt_options, expires_at, created_at, updated_at)
+VALUES (?, 'pending', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+_MARK_SQL = 'UPDATE outbox SET status = ?, error = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?'
+
+_TOUCH_SQL = 'UPDATE outbox SET updated_at = ? WHERE id = ?'
+
+_PURGE_SQL = "DELETE FROM outbox WHERE status = 'delivered' AND updated_at < ?"
+
+
+class OutboxEntry:
+    __slots__ = ('id', 'email_type', 'receiver_email', 'subject', 'envelope', 'expires_at', 'created_at')
+
+    def __init__(self, id, email_type, receiver_email, subject, envelope, expires_at, created_at):
+        self.id = id
+        self.email_type = email_type
+        self.receiver_email = receiver_email
+        self.subject = subject
+        self.envelope = envelope
+        self.expires_at = expires_at
+        self.created_at = created_at
+
+
+class _Commit:
+    """Completion signal for a write that the caller waits on"""
+
+    __slots__ = ('event', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.error = None
+
+
+class Outbox:
+    def __init__(self, path, retention_hours=168, purge_interval=3600):
+        self.path = path
+        self.retention = retention_hours * 3600
+        self.purge_interval = purge_interval
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._connection = self._connect()
+        self._connection.executescript(_SCHEMA)
+        self._migrate()
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._closed = False
+        self._appends = 0
+        self._commits = 0
+        self._last_purge = time.monotonic()
+
+        self._writer = threading.Thread(target=self._write_loop, name="outbox-writer", daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create an outbox from the Flask application config"""
+        return cls(config['OUTBOX_PATH'], retention_hours=config['OUTBOX_RETENTION_HOURS'])
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        # FULL syncs the WAL on every commit: an acknowledged entry is on disk
+        connection.execute('PRAGMA synchronous=FULL')
+        return connection
+
+    def _migrate(self):
+        # Outbox files written before delivery deadlines have no expires_at column
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info(outbox)')]
+        if 'expires_at' not in columns:
+            self._connection.execute('ALTER TABLE outbox ADD COLUMN expires_at REAL')
+
+    def append(self, entry_id, email_type, receiver_email, subject, envelope, expires_at=None):
+        """Durably record a message; returns once the entry has been committed to disk"""
+        self.append_many([(entry_id, email_type, receiver_email, subject, envelope, expires_at)])
+
+    def append_many(self, entries):
+        """Durably record (id, email_type, receiver_email, subject, envelope[, expires_at]) entries in one commit"""
+        now = time.time()
+        rows = []
+        for entry_id, email_type, receiver_email, subject, envelope, *deadline in entries:
+            sender, recipients, message, mail_options, rcpt_options = envelope
+            rows.append((
+                entry_id, email_type, receiver_email, subject, sender, json.dumps(list(recipients)),
+                message, json.dumps(list(mail_options)), json.dumps(list(rcpt_options)),
+                deadline[0] if deadline else None, now, now
+            ))
+        if not rows:
+            return
+
+        commit = _Commit()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Outbox is closed")
+            for params in rows[:-1]:
+                self._pending.append((_INSERT_SQL, params, None))
+            self._pending.append((_INSERT_SQL, rows[-1], commit))
+            self._cond.notify()
+        commit.event.wait()
+        if commit.error is not None:
+            raise commit.error
+
+    def mark_delivered(self, entry_id):
+        """Record a successful delivery (committed with the next group)"""
+        self._submit(_MARK_SQL, (DELIVERED, None, time.time(), entry_id))
+
+    def mark_failed(self, entry_id, error):
+        """Record a permanent delivery failure (committed with the next group)"""
+        self._submit(_MARK_SQL, (FAILED, error, time.time(), entry_id))
+
+    def _submit(self, sql, params, commit=None):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Outbox is closed")
+            self._pending.append((sql, params, commit))
+            self._cond.notify()
+
+    def _write_loop(self):
+        """Commit everything submitted since the previous commit in one transaction"""
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait(timeout=self.purge_interval)
+                    if not self._pending:
+                        self._maybe_purge()
+                batch = self._pending
+                self._pending = []
+                if not batch and self._closed:
+                    return
+
+            error = None
+            try:
+                self._connection.execute('BEGIN')
+                for sql, params, _ in batch:
+                    self._connection.execute(sql, params)
+                self._connection.execute('COMMIT')
+            except Exception as e:
+                error = e
+                try:
+                    self._connection.execute('ROLLBACK')
+                except Exception:
+                    pass
+
+            for sql, _, commit in batch:
+                if sql is _INSERT_SQL:
+                    self._appends += 1
+                if commit is not None:
+                    commit.error = error
+                    commit.event.set()
+            self._commits += 1
+
+    def _maybe_purge(self):
+        """Drop delivered entries older than the retention period"""
+        if time.monotonic() - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = time.monotonic()
+        try:
+            self._connection.execute(_PURGE_SQL, (time.time() - self.retention,))
+        except Exception as e:
+            print(f"⚠️ Outbox purge failed: {e}")
+
+    def claim_pending(self, grace_seconds=60):
+        """Claim undelivered entries for replay.
+
+        Entries touched within grace_seconds may still be in flight in another
+        process sharing this outbox and are left alone. Claimed entries are
+        touched so that a concurrently starting process does not replay them too.
+        """
+        cutoff = time.time() - grace_seconds
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute(
+                'SELECT id, email_type, receiver_email, subject, sender, recipients, message, '
+                'mail_options, rcpt_options, expires_at, created_at FROM outbox '
+                'WHERE status = ? AND updated_at < ? ORDER BY created_at',
+                (PENDING, cutoff)
+            ).fetchall()
+            now = time.time()
+            connection.executemany(_TOUCH_SQL, [(now, row[0]) for row in rows])
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+        return [
+            OutboxEntry(
+                row[0], row[1], row[2], row[3],
+                (row[4], json.loads(row[5]), bytes(row[6]), json.loads(row[7]), json.loads(row[8])),
+                row[9], row[10]
+            )
+            for row in rows
+        ]
+
+    def counts(self):
+        """Number of entries in each state"""
+        connection = self._connect()
+        try:
+            rows = connection.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall()
+        finally:
+            connection.close()
+        return dict(rows)
+
+    def stats(self):
+        """Write statistics: appends and the commits (fsyncs) they were grouped into"""
+        return {
+            'appends': self._appends,
+            'commits': self._commits
+        }
+
+    def close(self):
+        """Flush outstanding writes and stop the writer thread"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._writer.join()
+        self._connection.close()
@@ -0,0 +1,374 @@
+"""
+Two-tier rate limit storage: local counters reconciled with Redis in batches.
+
+Registered with the limits library under the ``hybrid+redis://`` scheme, so
+Flask-Limiter uses it like any other storage. Each process counts hits for a
+limit window in memory and answers the limiter without touching Redis. A
+background thread pushes the hits counted since the last sync to Redis every
+sync_interval seconds (one pipeline for all active keys) and reads back the
+cluster-wide count, so every process sees the others' usage.
+
+Between syncs a process cannot see hits taken by other processes, so the
+cluster may briefly exceed a limit. Two settings bound that. sync_interval
+is how stale one process's view of the others can get. tolerance caps the
+hits a process takes without reporting them: with P live processes (tracked
+through a Redis heartbeat) it syncs a key inline once its unsynced hits
+reach limit * tolerance / (P - 1), so unreported hits across the cluster
+never exceed limit * tolerance. With one process the local count is exact
+and Redis is never on the request path; tolerance=0 syncs every hit.
+
+If Redis is unreachable each process keeps enforcing the limit on its own
+counts and reconciles again once Redis is back.
+
+FailoverRedisStorage (``failover+redis://``) is the exact mode: every hit
+is a Redis call. It connects in the background and falls back to in-memory
+counters while Redis is down.
+
+Neither storage touches Redis while it is being created, and redis is only
+imported once a connection is made, so the server starts without waiting
+for Redis.
+"""
+
+import math
+import os
+import threading
+import time
+import uuid
+
+from limits.storage import MemoryStorage, Storage, storage_from_string
+
+SCHEME = 'hybrid+redis'
+FAILOVER_SCHEME = 'failover+redis'
+
+
+class _Window:
+    __slots__ = ('expires_at', 'cluster', 'unsynced', 'limit')
+
+    def __init__(self, expires_at, limit):
+        self.expires_at = expires_at
+        # Cluster-wide hits as of the last sync (including this process's synced hits)
+        self.cluster = 0
+        # Hits taken by this process since the last sync
+        self.unsynced = 0
+        self.limit = limit
+
+
+def _limit_from_key(key):
+    """Limit amount from a limits key (namespace/identifiers.../amount/multiples/granularity)"""
+    try:
+        return int(key.rsplit('/', 3)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+class HybridRedisStorage(Storage):
+    STORAGE_SCHEME = [SCHEME]
+
+    def __init__(self, uri=None, wrap_exceptions=False, sync_interval=0.1, tolerance=0.1,
+                 client=None, key_prefix='email:ratelimit:', **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.redis_uri = uri.replace(f'{SCHEME}://', 'redis://', 1) if uri else None
+        # Created by the first sync, off the request path
+        self.redis = client
+        self.sync_interval = float(sync_interval)
+        self.tolerance = float(tolerance)
+        self.key_prefix = key_prefix
+        self.process_id = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.processes = 1
+        self.syncs = 0
+        self.inline_syncs = 0
+        self.sync_errors = 0
+        self.last_sync_error = None
+
+    @property
+    def base_exceptions(self):
+        import redis
+        return redis.RedisError
+
+    @property
+    def backend(self):
+        """Where the counts are reconciled: 'redis', 'memory' while Redis is unreachable, or 'connecting'"""
+        if self.last_sync_error is not None:
+            return 'memory'
+        return 'redis' if self.syncs else 'connecting'
+
+    def _client(self):
+        if self.redis is None:
+            import redis
+            self.redis = redis.Redis.from_url(self.redis_uri, socket_connect_timeout=2, socket_timeout=2)
+        return self.redis
+
+    def _ensure_syncer(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._sync_loop, name='rate-limit-sync', daemon=True)
+                    self._thread.start()
+
+    def _inline_threshold(self, window):
+        """Unsynced hits this process may take on a key before it must sync inline"""
+        # While Redis is unreachable an inline sync would only stall the request
+        if window.limit is None or self.processes <= 1 or self.last_sync_error is not None:
+            return math.inf
+        return max(1, math.floor(window.limit * self.tolerance / (self.processes - 1)))
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        self._ensure_syncer()
+        now = time.time()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or window.expires_at <= now:
+                window = self._windows[key] = _Window(now + expiry, _limit_from_key(key))
+            window.unsynced += amount
+            count = window.cluster + window.unsynced
+            # Hits already over the limit are rejected whatever the others did; no need to sync them inline
+            sync_now = window.unsynced >= self._inline_threshold(window) and count <= window.limit
+            if sync_now:
+                self.inline_syncs += 1
+        if sync_now:
+            self._sync([key])
+            with self._lock:
+                count = window.cluster + window.unsynced
+        return count
+
+    def get(self, key):
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or window.expires_at <= time.time():
+                return 0
+            return window.cluster + window.unsynced
+
+    def get_expiry(self, key):
+        with self._lock:
+            window = self._windows.get(key)
+            return window.expires_at if window is not None else time.time()
+
+    def check(self):
+        try:
+            return bool(self._client().ping())
+        except Exception:
+            return False
+
+    def reset(self):
+        with self._lock:
+            count = len(self._windows)
+            self._windows.clear()
+        return count
+
+    def clear(self, key):
+        with self._lock:
+            self._windows.pop(key, None)
+        try:
+            self._client().delete(self.key_prefix + key)
+        except Exception:
+            pass
+
+    def _sync_loop(self):
+        while not self._stop.wait(self.sync_interval):
+            self._sync()
+
+    def _sync(self, keys=None):
+        """Push unsynced hits for keys (default: every live window) and read back cluster counts"""
+        periodic = keys is None
+        with self._sync_lock:
+            now = time.time()
+            with self._lock:
+                if periodic:
+                    for expired in [k for k, w in self._windows.items() if w.expires_at <= now]:
+                        del self._windows[expired]
+                    keys = list(self._windows)
+                batch = [(key, self._windows[key], self._windows[key].unsynced)
+                         for key in keys if key in self._windows]
+
+            try:
+                pipe = self._client().pipeline(transaction=False)
+                for key, _, delta in batch:
+                    pipe.incrby(self.key_prefix + key, delta)
+                    pipe.pttl(self.key_prefix + key)
+                if periodic:
+                    # Heartbeat; inline syncs reuse the last process count
+                    members = self.key_prefix + 'processes'
+                    pipe.zadd(members, {self.process_id: now})
+                    pipe.zremrangebyscore(members, 0, now - max(3 * self.sync_interval, 5))
+                    pipe.zcard(members)
+                results = pipe.execute()
+                if periodic:
+                    self.processes = max(1, results[-1])
+
+                new_keys = []
+                with self._lock:
+                    for index, (key, window, delta) in enumerate(batch):
+                        total, ttl = results[2 * index], results[2 * index + 1]
+                        window.unsynced -= delta
+                        window.cluster = total
+                        if ttl is None or ttl < 0:
+                            new_keys.append((key, window))
+                        else:
+                            window.expires_at = now + ttl / 1000
+                if new_keys:
+                    pipe = self.redis.pipeline(transaction=False)
+                    for key, window in new_keys:
+                        pipe.pexpireat(self.key_prefix + key, int(window.expires_at * 1000))
+                    pipe.execute()
+                self.syncs += 1
+            except Exception as e:
+                self.sync_errors += 1
+                if self.last_sync_error is None:
+                    print(f"⚠️ Rate limit sync with Redis failed, enforcing limits locally: {e}")
+                self.last_sync_error = str(e)
+                return
+            if self.last_sync_error is not None:
+                print("✅ Rate limit sync with Redis restored")
+                self.last_sync_error = None
+
+    def close(self):
+        """Stop the background sync after pushing any remaining hits"""
+        self._stop.set()
+        self._sync()
+
+    def stats(self):
+        """Sync state for the health endpoint"""
+        with self._lock:
+            windows = len(self._windows)
+        return {
+            'backend': self.backend,
+            'sync_interval': self.sync_interval,
+            'tolerance': self.tolerance,
+            'processes': self.processes,
+            'windows': windows,
+            'syncs': self.syncs,
+            'inline_syncs': self.inline_syncs,
+            'sync_errors': self.sync_errors,
+            'last_sync_error': self.last_sync_error
+        }
+
+
+class FailoverRedisStorage(Storage):
+    """Exact Redis storage that never waits on Redis being reachable.
+
+    A background thread connects to Redis, retrying with exponential backoff
+    up to max_reconnect_interval. Until it succeeds, and again after any
+    Redis error, hits are counted in memory per process. Counts taken in
+    memory are not carried over when Redis comes back.
+    """
+
+    STORAGE_SCHEME = [FAILOVER_SCHEME]
+
+    def __init__(self, uri=None, wrap_exceptions=False, reconnect_interval=1.0, max_reconnect_interval=30.0,
+                 **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.redis_uri = uri.replace(f'{FAILOVER_SCHEME}://', 'redis://', 1)
+        self.options = dict({'socket_connect_timeout': 2, 'socket_timeout': 2}, **options)
+        self.reconnect_interval = float(reconnect_interval)
+        self.max_reconnect_interval = float(max_reconnect_interval)
+        self.memory = MemoryStorage()
+        self.primary = None
+        self.failovers = 0
+        self.promotions = 0
+        self.last_error = None
+
+        self._lock = threading.Lock()
+        self._connector = None
+        self._stop = threading.Event()
+        self._connect()
+
+    @property
+    def base_exceptions(self):
+        import redis
+        return redis.RedisError
+
+    @property
+    def backend(self):
+        """'redis' when hits go to Redis, otherwise 'memory'"""
+        return 'redis' if self.primary is not None else 'memory'
+
+    def _connect(self):
+        """Start the background connector unless it is already running"""
+        with self._lock:
+            if self._connector is not None and self._connector.is_alive():
+                return
+            self._connector = threading.Thread(target=self._connect_loop, name='rate-limit-connect', daemon=True)
+            self._connector.start()
+
+    def _connect_loop(self):
+        delay = self.reconnect_interval
+        storage = None
+        while not self._stop.is_set():
+            try:
+                if storage is None:
+                    storage = storage_from_string(self.redis_uri, **self.options)
+                # Ping the client directly so a failure reports why
+                storage.storage.ping()
+                break
+            except Exception as e:
+                error = str(e)
+            if error != self.last_error:
+                print(f"⚠️ Redis unavailable for rate limiting, using in-memory storage: {error}")
+                self.last_error = error
+            self._stop.wait(delay)
+            delay = min(delay * 2, self.max_reconnect_interval)
+        else:
+            return
+        self.primary = storage
+        self.promotions += 1
+        self.last_error = None
+        self.memory.reset()
+        print("✅ Redis connected successfully for rate limiting")
+
+    def _failed(self, primary, error):
+        """Drop back to memory after a Redis error and reconnect in the background"""
+        with self._lock:
+            if self.primary is not primary:
+                return
+            self.primary = None
+            self.failovers += 1
+        self.last_error = str(error)
+        print(f"⚠️ Rate limit storage lost Redis, using in-memory storage: {error}")
+        self._connect()
+
+    def _call(self, method, *args, **kwargs):
+        primary = self.primary
+        if primary is not None:
+            try:
+                return getattr(primary, method)(*args, **kwargs)
+            except Exception as e:
+                self._failed(primary, e)
+        return getattr(self.memory, method)(*args, **kwargs)
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        return self._call('incr', key, expiry, amount=amount)
+
+    def get(self, key):
+        return self._call('get', key)
+
+    def get_expiry(self, key):
+        return self._call('get_expiry', key)
+
+    def check(self):
+        return self.primary is not None and self.primary.check()
+
+    def reset(self):
+        return self._call('reset')
+
+    def clear(self, key):
+        return self._call('clear', key)
+
+    def close(self):
+        """Stop reconnecting"""
+        self._stop.set()
+
+    def stats(self):
+        """Connection state for the health endpoint"""
+        return {
+            'backend': self.backend,
+            'failovers': self.failovers,
+            'promotions': self.promotions,
+            'last_error': self.last_error
+        }
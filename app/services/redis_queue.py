@@ -0,0 +1,401 @@
+"""
+Distributed delivery queue on Redis Streams.
+
+API processes XADD prepared messages to a stream; any number of worker
+processes (python -m app.worker) consume it through one consumer group.
+An entry is acknowledged only after the SMTP exchange finishes, and entries
+left pending by a crashed worker are reclaimed with XAUTOCLAIM, giving
+at-least-once delivery. Job status lives in a per-job hash with a TTL so
+GET /jobs/<job_id> works from any API process.
+
+An entry that fails transiently is acknowledged and parked in a sorted set
+scored by its next attempt time (its message in a hash beside it). Workers
+move due entries back onto the stream. Emails with a future send_at wait
+the same way in a second sorted set, scored by send time, until workers
+release them at no more than SCHEDULE_RELEASE_RATE per second each.
+
+Entries carry the job's deadline, if any. Workers expire an entry whose
+deadline has passed instead of sending it.
+
+Each priority lane has its own stream (the catch-all lane keeps the base
+stream name). Workers read from the lane picked by weighted round-robin,
+falling back to the others when it is empty.
+"""
+
+import json
+import time
+import uuid
+from .delivery_queue import DeliveryJob, SCHEDULED, QUEUED, SENDING, RETRYING, SENT, FAILED, EXPIRED
+from .lanes import Lane, LaneRouter
+from .metrics import DELIVERY_QUEUE_WAIT_SECONDS
+
+
+def _entry_time(entry_id):
+    """Seconds since the epoch at which a stream entry was added (from its id)"""
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    return int(entry_id.split('-')[0]) / 1000
+
+
+class RedisStreamQueue:
+    def __init__(self, redis_client, stream='email:deliveries', group='email-workers',
+                 maxlen=100000, job_ttl=86400, outbox=None, lanes=None):
+        self.redis = redis_client
+        self.outbox = outbox
+        self.stream = stream
+        self.group = group
+        self.maxlen = maxlen
+        self.job_ttl = job_ttl
+        self.delayed_key = f"{stream}:delayed"
+        self.scheduled_key = f"{stream}:scheduled"
+        self.router = lanes or LaneRouter([Lane('default')])
+        self._streams = {
+            lane.name: stream if lane is self.router.default else f"{stream}:lane:{lane.name}"
+            for lane in self.router.lanes
+        }
+        self._lanes_by_stream = {name: lane for lane, name in self._streams.items()}
+        self._group_ready = False
+
+    @classmethod
+    def from_config(cls, redis_client, config, outbox=None):
+        """Create a queue from the Flask application config"""
+        return cls(
+            redis_client,
+            stream=config['REDIS_QUEUE_STREAM'],
+            group=config['REDIS_QUEUE_GROUP'],
+            maxlen=config['REDIS_QUEUE_MAXLEN'],
+            job_ttl=config['REDIS_QUEUE_JOB_TTL'],
+            outbox=outbox,
+            lanes=LaneRouter.from_config(config)
+        )
+
+    def _job_key(self, job_id):
+        return f"{self.stream}:job:{job_id}"
+
+    def _payload_key(self, job_id):
+        return f"{self.delayed_key}:{job_id}"
+
+    def _stream(self, lane):
+        """Stream of a lane (the catch-all lane's for unknown or missing names)"""
+        return self._streams.get(lane, self.stream)
+
+    @staticmethod
+    def _entry_fields(job_id, envelope, lane, expires_at=None):
+        """Stream entry fields for a prepared message"""
+        sender, recipients, message, mail_options, rcpt_options = envelope
+        return {
+            'job_id': job_id,
+            'lane': lane,
+            'expires_at': expires_at if expires_at is not None else '',
+            'sender': sender,
+            'recipients': json.dumps(list(recipients)),
+            'message': message,
+            'mail_options': json.dumps(list(mail_options)),
+            'rcpt_options': json.dumps(list(rcpt_options))
+        }
+
+    def ensure_group(self):
+        """Create the stream and consumer group if they do not exist yet"""
+        if self._group_ready:
+            return
+        import redis
+        for stream in self._streams.values():
+            try:
+                self.redis.xgroup_create(stream, self.group, id='0', mkstream=True)
+            except redis.ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+        self._group_ready = True
+
+    def enqueue(self, envelope, email_type, receiver_email, subject, expires_at=None):
+        """Add a prepared message to the stream and return its job"""
+        return self.enqueue_many([(envelope, email_type, receiver_email, subject, expires_at)])[0]
+
+    def enqueue_many(self, messages):
+        """Add (envelope, email_type, receiver_email, subject[, expires_at]) tuples in one round trip"""
+        jobs = [DeliveryJob(*message) for message in messages]
+        pipe = self.redis.pipeline(transaction=False)
+        for job in jobs:
+            job.lane = self.router.lane_for(job.email_type).name
+            key = self._job_key(job.id)
+            pipe.hset(key, mapping={
+                'status': QUEUED,
+                'lane': job.lane,
+                'email_type': job.email_type or '',
+                'receiver_email': job.receiver_email or '',
+                'subject': job.subject or '',
+                'expires_at': job.expires_at if job.expires_at is not None else '',
+                'created_at': job.created_at,
+                'attempts': 0
+            })
+            pipe.expire(key, self.job_ttl)
+            pipe.xadd(self._stream(job.lane), self._entry_fields(job.id, job.envelope, job.lane, job.expires_at),
+                      maxlen=self.maxlen, approximate=True)
+        pipe.execute()
+        for job in jobs:
+            job.envelope = None
+        return jobs
+
+    def schedule(self, envelope, email_type, receiver_email, subject, send_at, expires_at=None):
+        """Hold a prepared message until send_at and return its job"""
+        return self.schedule_many([(envelope, email_type, receiver_email, subject, expires_at)], send_at)[0]
+
+    def schedule_many(self, messages, send_at):
+        """Park (envelope, email_type, receiver_email, subject[, expires_at]) tuples until the time.time() value send_at"""
+        if send_at <= time.time():
+            return self.enqueue_many(messages)
+        jobs = [DeliveryJob(*message) for message in messages]
+        # Keep the job and its message until send_at, and the job for job_ttl after that
+        ttl = int(send_at - time.time()) + self.job_ttl
+        pipe = self.redis.pipeline(transaction=False)
+        for job in jobs:
+            job.lane = self.router.lane_for(job.email_type).name
+            job.status = SCHEDULED
+            job.send_at = send_at
+            key = self._job_key(job.id)
+            pipe.hset(key, mapping={
+                'status': SCHEDULED,
+                'lane': job.lane,
+                'email_type': job.email_type or '',
+                'receiver_email': job.receiver_email or '',
+                'subject': job.subject or '',
+                'send_at': send_at,
+                'expires_at': job.expires_at if job.expires_at is not None else '',
+                'created_at': job.created_at,
+                'attempts': 0
+            })
+            pipe.expire(key, ttl)
+            pipe.hset(self._payload_key(job.id),
+                      mapping=self._entry_fields(job.id, job.envelope, job.lane, job.expires_at))
+            pipe.expire(self._payload_key(job.id), ttl)
+            pipe.zadd(self.scheduled_key, {job.id: send_at})
+        pipe.execute()
+        for job in jobs:
+            job.envelope = None
+        return jobs
+
+    def replay(self, entries):
+        """Hand outbox entries left undelivered by a previous process over to the stream"""
+        if not entries:
+            return 0
+        self.enqueue_many([
+            (entry.envelope, entry.email_type, entry.receiver_email, entry.subject, entry.expires_at)
+            for entry in entries
+        ])
+        # The stream now owns these messages
+        if self.outbox is not None:
+            for entry in entries:
+                self.outbox.mark_delivered(entry.id)
+        return len(entries)
+
+    def get_job(self, job_id):
+        """Look up a job's status from any process"""
+        data = self.redis.hgetall(self._job_key(job_id))
+        if not data:
+            return None
+        data = {key.decode(): value.decode() for key, value in data.items()}
+        job = DeliveryJob(None, data.get('email_type'), data.get('receiver_email'), data.get('subject'), job_id=job_id)
+        job.lane = data.get('lane') or None
+        job.status = data.get('status', QUEUED)
+        job.error = data.get('error') or None
+        job.attempts = int(data.get('attempts', 0))
+        job.send_at = float(data['send_at']) if data.get('send_at') else None
+        job.expires_at = float(data['expires_at']) if data.get('expires_at') else None
+        job.next_attempt_at = float(data['next_attempt_at']) if data.get('next_attempt_at') else None
+        job.created_at = float(data.get('created_at', 0))
+        job.finished_at = float(data['finished_at']) if data.get('finished_at') else None
+        return job
+
+    def _group_info(self, stream):
+        for group in self.redis.xinfo_groups(stream):
+            name = group['name']
+            if (name.decode() if isinstance(name, bytes) else name) == self.group:
+                return group
+        return None
+
+    def lanes(self):
+        """Per lane: entries waiting or unacknowledged, and how long the oldest undelivered one has waited"""
+        now = time.time()
+        stats = {}
+        for lane in self.router.lanes:
+            stream = self._streams[lane.name]
+            depth, oldest_wait = 0, 0
+            try:
+                group = self._group_info(stream)
+                if group is not None:
+                    lag = int(group.get('lag') or 0)
+                    depth = lag + int(group.get('pending') or 0)
+                    if lag:
+                        last_id = group['last-delivered-id']
+                        last_id = last_id.decode() if isinstance(last_id, bytes) else last_id
+                        entries = self.redis.xrange(stream, min=f"({last_id}", count=1)
+                        if entries:
+                            oldest_wait = round(max(0, now - _entry_time(entries[0][0])), 3)
+            except Exception:
+                pass
+            stats[lane.name] = {'weight': lane.weight, 'depth': depth, 'oldest_wait': oldest_wait}
+        return stats
+
+    def depth(self):
+        """Entries not yet delivered to any consumer, plus entries delivered but unacknowledged"""
+        return sum(lane['depth'] for lane in self.lanes().values())
+
+    @staticmethod
+    def _decode_entry(fields):
+        """Turn raw stream fields into (job_id, envelope)"""
+        envelope = (
+            fields[b'sender'].decode(),
+            json.loads(fields[b'recipients']),
+            fields[b'message'],
+            json.loads(fields[b'mail_options']),
+            json.loads(fields[b'rcpt_options'])
+        )
+        return fields[b'job_id'].decode(), envelope
+
+    @staticmethod
+    def _deadline(fields):
+        """An entry's expires_at, or None (also for entries added before deadlines existed)"""
+        value = fields.get(b'expires_at')
+        return float(value) if value else None
+
+    def consume(self, consumer, count=10, block_ms=5000):
+        """Read new entries for this consumer as (entry_id, job_id, envelope, lane, expires_at) tuples.
+
+        Entries come from the lane picked by weight, or the next lane by
+        weight when that one is empty. With every lane empty, it waits for
+        an entry in any of them.
+        """
+        self.ensure_group()
+        lanes = self.router.lanes
+        if len(lanes) > 1:
+            first = self.router.select(lanes)
+            for lane in [first] + sorted((lane for lane in lanes if lane is not first), key=lambda l: -l.weight):
+                response = self.redis.xreadgroup(self.group, consumer, {self._streams[lane.name]: '>'}, count=count)
+                if response:
+                    return self._read(response)
+        streams = {stream: '>' for stream in self._streams.values()}
+        return self._read(self.redis.xreadgroup(self.group, consumer, streams, count=count, block=block_ms))
+
+    def _read(self, response):
+        now = time.time()
+        entries = []
+        for stream, messages in response or []:
+            lane = self._lanes_by_stream[stream.decode() if isinstance(stream, bytes) else stream]
+            for entry_id, fields in messages:
+                DELIVERY_QUEUE_WAIT_SECONDS.observe(max(0, now - _entry_time(entry_id)), lane)
+                entries.append((entry_id, *self._decode_entry(fields), lane, self._deadline(fields)))
+        return entries
+
+    def reclaim(self, consumer, min_idle_ms, count=100):
+        """Take over entries another consumer read but never acknowledged"""
+        self.ensure_group()
+        entries = []
+        for lane, stream in self._streams.items():
+            response = self.redis.xautoclaim(stream, self.group, consumer, min_idle_ms, start_id='0-0', count=count)
+            for entry_id, fields in response[1]:
+                if not fields:
+                    # Trimmed from the stream while pending; nothing left to deliver
+                    self.redis.xack(stream, self.group, entry_id)
+                    continue
+                entries.append((entry_id, *self._decode_entry(fields), lane, self._deadline(fields)))
+        return entries
+
+    def mark_sending(self, job_id):
+        """Record a delivery attempt, returning the attempt number"""
+        key = self._job_key(job_id)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(key, 'status', SENDING)
+        pipe.hincrby(key, 'attempts', 1)
+        # The job hash may have expired while the entry waited; writing to it
+        # again recreates it, so it gets a fresh TTL instead of living forever
+        pipe.expire(key, self.job_ttl)
+        return pipe.execute()[1]
+
+    def complete(self, entry_id, job_id, error=None, lane=None, status=None):
+        """Acknowledge an entry and record its final status (sent, failed with error, or the given status)"""
+        stream = self._stream(lane)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(self._job_key(job_id), mapping={
+            'status': status or (FAILED if error else SENT),
+            'error': error or '',
+            'finished_at': time.time()
+        })
+        pipe.expire(self._job_key(job_id), self.job_ttl)
+        pipe.xack(stream, self.group, entry_id)
+        pipe.xdel(stream, entry_id)
+        pipe.execute()
+
+    def expire(self, entry_id, job_id, lane=None):
+        """Acknowledge an entry whose deadline passed before it could be delivered"""
+        self.complete(entry_id, job_id, "Deadline passed before delivery", lane, EXPIRED)
+
+    def defer(self, entry_id, job_id, envelope, delay, error, lane=None, expires_at=None):
+        """Acknowledge a failed entry and park it until its next attempt, delay seconds from now"""
+        stream = self._stream(lane)
+        due = time.time() + delay
+        pipe = self.redis.pipeline(transaction=True)
+        fields = self._entry_fields(job_id, envelope, self._lanes_by_stream[stream], expires_at)
+        pipe.hset(self._payload_key(job_id), mapping=fields)
+        pipe.expire(self._payload_key(job_id), self.job_ttl)
+        pipe.zadd(self.delayed_key, {job_id: due})
+        pipe.hset(self._job_key(job_id), mapping={'status': RETRYING, 'error': error, 'next_attempt_at': due})
+        pipe.expire(self._job_key(job_id), self.job_ttl)
+        pipe.xack(stream, self.group, entry_id)
+        pipe.xdel(stream, entry_id)
+        pipe.execute()
+
+    def promote_due(self, count=100):
+        """Move parked entries whose next attempt is due back onto the stream; returns how many"""
+        return self._promote(self.delayed_key, count)
+
+    def release_scheduled(self, count=100):
+        """Move up to count scheduled emails whose send time has come onto the stream; returns how many"""
+        return self._promote(self.scheduled_key, count)
+
+    def _promote(self, key, count):
+        job_ids = self.redis.zrangebyscore(key, 0, time.time(), start=0, num=count)
+        promoted = 0
+        for job_id in job_ids:
+            job_id = job_id.decode()
+            fields = self.redis.hgetall(self._payload_key(job_id))
+            if not fields:
+                # Promoted by another worker, or expired
+                self.redis.zrem(key, job_id)
+                continue
+            fields = {name.decode(): value for name, value in fields.items()}
+            stream = self._stream(fields['lane'].decode() if 'lane' in fields else None)
+            # Add first and claim second, so a crash in between delivers twice rather than never
+            entry_id = self.redis.xadd(stream, fields, maxlen=self.maxlen, approximate=True)
+            if not self.redis.zrem(key, job_id):
+                self.redis.xdel(stream, entry_id)
+                continue
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.delete(self._payload_key(job_id))
+            pipe.hset(self._job_key(job_id), mapping={'status': QUEUED, 'next_attempt_at': ''})
+            pipe.expire(self._job_key(job_id), self.job_ttl)
+            pipe.execute()
+            promoted += 1
+        return promoted
+
+    def retrying(self):
+        """Number of entries waiting for their next attempt"""
+        try:
+            return self.redis.zcard(self.delayed_key)
+        except Exception:
+            return 0
+
+    def scheduled(self):
+        """Scheduled emails waiting for their send time"""
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.zcard(self.scheduled_key)
+            pipe.zrange(self.scheduled_key, 0, 0, withscores=True)
+            pending, first = pipe.execute()
+        except Exception:
+            return None
+        return {'pending': pending, 'next_due': first[0][1] if first else None}
+
+    @staticmethod
+    def new_consumer_name():
+        """Unique consumer name for a worker thread"""
+        return f"worker-{uuid.uuid4().hex[:12]}"
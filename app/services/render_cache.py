@@ -0,0 +1,186 @@
+"""
+Cache of rendered email content.
+
+Many sends render the same template with the same variables (one
+announcement to thousands of recipients, the same welcome email to many
+addresses). Rendered (subject, body) pairs are kept in a bounded in-process
+LRU keyed by email type plus a stable hash of the variables, with both an
+entry limit and a byte budget. An optional Redis tier lets every API process
+reuse renders made by the others.
+
+Keys also include a digest of the compiled template, so a deploy that
+changes a template never serves renders of the old version from Redis.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+# Redis value layout: kind byte, 4-byte subject length, subject, body
+_STR_BODY = b's'
+_BYTES_BODY = b'b'
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _size(value):
+    """Encoded size in bytes of a (subject, body) render; body is text or message bytes"""
+    subject, body = value
+    return len(subject.encode('utf-8')) + len(body.encode('utf-8') if isinstance(body, str) else body)
+
+
+class RenderCache:
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024,
+                 redis_client=None, redis_ttl=3600, redis_prefix='email:render:'):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.redis = redis_client
+        self.redis_ttl = redis_ttl
+        self.redis_prefix = redis_prefix
+
+        # key -> ((subject, body), size in bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._versions = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.redis_hits = 0
+        self.redis_errors = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, config, redis_client=None):
+        """Create a cache from the Flask application config"""
+        return cls(
+            max_entries=config['RENDER_CACHE_SIZE'],
+            max_bytes=config['RENDER_CACHE_MAX_BYTES'],
+            redis_client=redis_client,
+            redis_ttl=config['RENDER_CACHE_REDIS_TTL']
+        )
+
+    def key(self, email_type, template, variables, kind='html'):
+        """Stable cache key for a render, or None if the variables cannot be hashed.
+
+        kind distinguishes different renderings of the same template (for
+        example HTML text versus pre-encoded message bytes).
+        """
+        try:
+            encoded = json.dumps(variables, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        except (TypeError, ValueError):
+            return None
+        version = self._versions.get(email_type)
+        if version is None:
+            body = template['body']
+            source = '\0'.join([template['subject'].source, body.source] + body.literals)
+            version = self._versions[email_type] = _digest(source.encode('utf-8'))[:12]
+        return f"{kind}:{email_type}:{version}:{_digest(encoded.encode('utf-8'))}"
+
+    def get(self, key):
+        """Return the cached (subject, body) for a key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        if self.redis is not None:
+            try:
+                data = self.redis.get(self.redis_prefix + key)
+            except Exception:
+                self.redis_errors += 1
+                data = None
+            if data is not None:
+                value = self._loads(data)
+                self._store(key, value)
+                with self._lock:
+                    self.hits += 1
+                    self.redis_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, subject, body):
+        """Cache a render locally and, if configured, in Redis"""
+        value = (subject, body)
+        self._store(key, value)
+        if self.redis is not None:
+            try:
+                self.redis.set(self.redis_prefix + key, self._dumps(value), ex=self.redis_ttl)
+            except Exception:
+                self.redis_errors += 1
+
+    def get_or_render(self, key, render):
+        """Return the cached render for key, calling render() -> (subject, body) on a miss"""
+        if key is None:
+            return render()
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.set(key, *value)
+        return value
+
+    def _store(self, key, value):
+        size = _size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    @staticmethod
+    def _dumps(value):
+        subject, body = value
+        subject = subject.encode('utf-8')
+        if isinstance(body, str):
+            kind, body = _STR_BODY, body.encode('utf-8')
+        else:
+            kind = _BYTES_BODY
+        return kind + len(subject).to_bytes(4, 'big') + subject + body
+
+    @staticmethod
+    def _loads(data):
+        length = int.from_bytes(data[1:5], 'big')
+        subject = data[5:5 + length].decode('utf-8')
+        body = data[5 + length:]
+        if data[:1] == _STR_BODY:
+            body = body.decode('utf-8')
+        return subject, body
+
+    def clear(self):
+        """Drop every locally cached render"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Counters for the health endpoint"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'redis': self.redis is not None,
+                'redis_hits': self.redis_hits,
+                'redis_errors': self.redis_errors
+            }
@@ -0,0 +1,128 @@
+"""
+Retries for transient delivery failures.
+
+SMTP 4xx replies and connection errors are transient: the same message is
+likely to go through a little later. They are retried with full-jitter
+exponential backoff (a random delay between 0 and base_delay * 2**attempt,
+capped at max_delay), so clients retrying after an outage do not all come
+back in the same instant. 5xx replies and any other error are permanent.
+
+A retry budget caps retries at a fraction of first attempts, plus a small
+per-second allowance. During a long SMTP outage most failures then go
+straight to the dead-letter store instead of multiplying the load on a
+struggling server. A send failed by an open circuit breaker never reached the
+server, so its retry costs no budget; it waits at least until the breaker
+probes again.
+"""
+
+import random
+import smtplib
+import threading
+import time
+
+from .circuit_breaker import CircuitOpenError
+from .smtp_accounts import SMTPAccountsUnavailable
+from .smtp_pool import SMTPPoolExhausted, is_connection_error
+
+
+def is_transient(error):
+    """Whether a delivery error is worth retrying later"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (SMTPPoolExhausted, SMTPAccountsUnavailable, CircuitOpenError)) or is_connection_error(error)
+
+
+def failure_reason(error):
+    """Why a failed delivery is given up: 'exhausted' retries of a transient error, or 'permanent'"""
+    return 'exhausted' if is_transient(error) else 'permanent'
+
+
+class RetryBudget:
+    """Token bucket of retries: each first attempt adds ratio tokens, each retry spends one.
+
+    Tokens also accrue at min_per_second so a quiet server can still retry,
+    and never exceed capacity.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, capacity=100):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self._tokens = min(capacity, 10 * min_per_second)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.spent = 0
+        self.denied = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a budget from the Flask application config"""
+        return cls(config['RETRY_BUDGET_RATIO'], config['RETRY_BUDGET_MIN_PER_SECOND'])
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        """Record a first delivery attempt"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self):
+        """Take a token for one retry; False once the budget is spent"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.spent += 1
+                return True
+            self.denied += 1
+            return False
+
+    def stats(self):
+        """Budget state for the health endpoint"""
+        with self._lock:
+            self._refill()
+            return {'tokens': round(self._tokens, 2), 'spent': self.spent, 'denied': self.denied}
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=300.0, budget=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    @classmethod
+    def from_config(cls, config, budget=None, sync=False):
+        """The policy for queued deliveries, or with sync=True for deliveries the client is waiting on"""
+        if sync:
+            return cls(config['RETRY_SYNC_ATTEMPTS'], config['RETRY_BASE_DELAY'],
+                       config['RETRY_SYNC_MAX_DELAY'], budget)
+        return cls(config['RETRY_MAX_ATTEMPTS'], config['RETRY_BASE_DELAY'], config['RETRY_MAX_DELAY'], budget)
+
+    def backoff(self, attempt):
+        """Jittered delay before the attempt after the given one (1-based)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def begin(self):
+        """Record a first delivery attempt with the budget"""
+        if self.budget is not None:
+            self.budget.deposit()
+
+    def next_delay(self, error, attempt):
+        """Seconds to wait before retrying after attempt failed with error, or None to give up"""
+        if not is_transient(error) or attempt >= self.max_attempts:
+            return None
+        if isinstance(error, CircuitOpenError):
+            delay = max(self.backoff(attempt), error.retry_after)
+            # A client waiting on an inline send is not held for the whole probe interval
+            return delay if delay <= self.max_delay else None
+        if self.budget is not None and not self.budget.withdraw():
+            return None
+        return self.backoff(attempt)
@@ -0,0 +1,267 @@
+"""
+Scheduled sends (send_at on /send-email and /send-email/batch).
+
+A scheduled email is validated and rendered when the request arrives, then
+kept until it is due. ScheduleStore keeps it in a SQLite table indexed by
+send time, which works as a priority queue on disk. Pending emails do not
+take memory in the API process, so a million of them is no problem, and
+they survive restarts. With QUEUE_BACKEND=redis, they go into a sorted set
+in Redis instead and the delivery workers release them.
+
+The Scheduler timer thread sleeps until the earliest send time. It then
+moves due emails into the delivery queue at no more than
+SCHEDULE_RELEASE_RATE per second. A thousand reminders scheduled for the
+same minute therefore go out over a few seconds rather than in one burst.
+Several processes can share one schedule file. Each release claims and
+deletes its rows in one write transaction, so an email is released only
+once. With an outbox, released emails are recorded in it before that
+transaction commits, so a crash right after a release loses nothing.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scheduled (
+    id TEXT PRIMARY KEY,
+    send_at REAL NOT NULL,
+    email_type TEXT,
+    receiver_email TEXT,
+    subject TEXT,
+    sender TEXT NOT NULL,
+    recipients TEXT NOT NULL,
+    message BLOB NOT NULL,
+    mail_options TEXT NOT NULL,
+    rcpt_options TEXT NOT NULL,
+    expires_at REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scheduled_send_at ON scheduled (send_at);
+'''
+
+_COLUMNS = ('id, send_at, email_type, receiver_email, subject, sender, recipients, message, '
+            'mail_options, rcpt_options, expires_at, created_at')
+
+
+class ScheduledEmail:
+    __slots__ = ('id', 'send_at', 'email_type', 'receiver_email', 'subject', 'envelope', 'expires_at', 'created_at')
+
+    def __init__(self, id, send_at, email_type, receiver_email, subject, envelope, expires_at, created_at):
+        self.id = id
+        self.send_at = send_at
+        self.email_type = email_type
+        self.receiver_email = receiver_email
+        self.subject = subject
+        self.envelope = envelope
+        self.expires_at = expires_at
+        self.created_at = created_at
+
+
+class ScheduleStore:
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+        self._count = None
+        self._counted_at = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['SCHEDULE_PATH'])
+
+    def _db(self):
+        # Opened on first use so a server that never schedules anything creates no file
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(_SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def add_many(self, entries):
+        """Store (job_id, send_at, email_type, receiver_email, subject, envelope, expires_at) tuples in one transaction"""
+        now = time.time()
+        rows = []
+        for job_id, send_at, email_type, receiver_email, subject, envelope, expires_at in entries:
+            sender, recipients, message, mail_options, rcpt_options = envelope
+            if isinstance(message, str):
+                message = message.encode('utf-8')
+            rows.append((job_id, send_at, email_type, receiver_email, subject, sender, json.dumps(list(recipients)),
+                         message, json.dumps(list(mail_options)), json.dumps(list(rcpt_options)), expires_at, now))
+        with self._lock:
+            db = self._db()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                db.executemany(f'INSERT INTO scheduled ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+            if self._count is not None:
+                self._count += len(rows)
+
+    @staticmethod
+    def _entry(row):
+        envelope = (row[5], json.loads(row[6]), bytes(row[7]), json.loads(row[8]), json.loads(row[9]))
+        return ScheduledEmail(row[0], row[1], row[2], row[3], row[4], envelope, row[10], row[11])
+
+    def claim_due(self, now, limit, record=None):
+        """Remove and return up to limit emails due by now, earliest first.
+
+        record(entries), if given, runs before the removal commits. If it
+        raises, the emails stay scheduled.
+        """
+        if self._connection is None and not os.path.exists(self.path):
+            return []
+        with self._lock:
+            db = self._db()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                rows = db.execute(
+                    f'SELECT {_COLUMNS} FROM scheduled WHERE send_at <= ? ORDER BY send_at LIMIT ?', (now, limit)
+                ).fetchall()
+                entries = [self._entry(row) for row in rows]
+                if entries and record is not None:
+                    record(entries)
+                db.executemany('DELETE FROM scheduled WHERE id = ?', [(entry.id,) for entry in entries])
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+            if self._count is not None:
+                self._count -= len(entries)
+        return entries
+
+    def next_due(self):
+        """Earliest send time, or None when nothing is scheduled"""
+        if self._connection is None and not os.path.exists(self.path):
+            return None
+        with self._lock:
+            return self._db().execute('SELECT MIN(send_at) FROM scheduled').fetchone()[0]
+
+    def get(self, job_id):
+        if self._connection is None and not os.path.exists(self.path):
+            return None
+        with self._lock:
+            row = self._db().execute(f'SELECT {_COLUMNS} FROM scheduled WHERE id = ?', (job_id,)).fetchone()
+        return self._entry(row) if row else None
+
+    def count(self, max_age=5):
+        """Number of scheduled emails; counting a large table takes a while, so the result is reused for max_age seconds"""
+        if self._connection is None and not os.path.exists(self.path):
+            return 0
+        now = time.monotonic()
+        if self._count is None or now - self._counted_at > max_age:
+            with self._lock:
+                self._count = self._db().execute('SELECT COUNT(*) FROM scheduled').fetchone()[0]
+            self._counted_at = now
+        return self._count
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class Scheduler:
+    """Timer thread releasing due emails from a store at a steady rate"""
+
+    def __init__(self, store, release, rate=100, record=None, poll_interval=5):
+        self.store = store
+        self.release = release
+        self.record = record
+        self.rate = rate
+        # Another process sharing the store may add earlier emails; look again at least this often
+        self.poll_interval = poll_interval
+        self.released = 0
+        self._tokens = rate
+        self._refilled = time.monotonic()
+        self._cond = threading.Condition()
+        self._wake_at = None
+        self._woken = False
+        self._thread = None
+        self._stopping = False
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._loop, name="delivery-timer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            self._cond.notify()
+        if thread is not None:
+            thread.join(timeout)
+
+    def wake(self, send_at):
+        """Tell the timer about a newly scheduled send time"""
+        with self._cond:
+            if self._wake_at is None or send_at < self._wake_at:
+                self._woken = True
+                self._cond.notify()
+
+    def _take_tokens(self):
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        return int(self._tokens)
+
+    def _next_delay(self):
+        """Seconds until the earliest scheduled email is due (capped at poll_interval)"""
+        try:
+            next_due = self.store.next_due()
+        except Exception:
+            return self.poll_interval
+        if next_due is None:
+            return self.poll_interval
+        delay = next_due - time.time()
+        return max(0, min(self.poll_interval, delay))
+
+    def _loop(self):
+        # Release in up to ten steps a second rather than one transaction per email
+        step = max(1, int(self.rate // 10))
+        while True:
+            tokens = self._take_tokens()
+            if tokens < step:
+                delay = (step - self._tokens) / self.rate
+            else:
+                try:
+                    entries = self.store.claim_due(time.time(), tokens, self.record)
+                except Exception as e:
+                    print(f"⚠️ Failed to release scheduled emails: {e}")
+                    entries = None
+                if entries:
+                    # May block while the delivery queue is full, which holds back further releases
+                    self.release(entries)
+                    self._tokens -= len(entries)
+                    self.released += len(entries)
+                if entries is None:
+                    delay = 1
+                elif len(entries) == tokens:
+                    delay = (step - self._tokens) / self.rate
+                else:
+                    delay = self._next_delay()
+            with self._cond:
+                if self._stopping:
+                    return
+                self._wake_at = time.time() + max(0, delay)
+                if delay > 0 and not self._woken:
+                    self._cond.wait(delay)
+                self._wake_at = None
+                self._woken = False
+                if self._stopping:
+                    return
+
+    def stats(self):
+        return {'pending': self.store.count(), 'next_due': self.store.next_due(),
+                'released': self.released, 'release_rate': self.rate}
@@ -0,0 +1,323 @@
+"""
+Outbound mail spread across several SMTP accounts or relays.
+
+Each account has its own credentials, connection pool, weight and optional
+daily message limit. Every message goes to the account picked by the
+selection strategy:
+
+    weighted      smooth weighted round-robin (an account with weight 2 gets
+                  twice the messages of one with weight 1)
+    least_loaded  the account with the fewest sends in flight per unit of weight
+
+An account that answers with a quota or throttling error (Gmail's 550 5.4.5
+daily limit, 421/454 4.7.0 "try again later"), fails to authenticate or
+cannot be reached is drained: it gets no traffic for SMTP_ACCOUNT_DRAIN_SECONDS,
+doubling on each consecutive drain up to a day, and the message is retried
+on the next account. Daily counts are kept per process. Each account's pool
+also has its own circuit breaker; an account whose breaker is open gets no
+traffic until the breaker probes it again.
+"""
+
+import base64
+import json
+import smtplib
+import threading
+import time
+
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .smtp_pool import SMTPConnectionPool, is_connection_error
+
+STRATEGIES = ('weighted', 'least_loaded')
+MAX_DRAIN_SECONDS = 86400
+
+# Reply text that marks a sending limit rather than a problem with the message
+QUOTA_MARKERS = ('quota', 'rate limit', 'too many', 'limit exceeded', 'sending limit', '5.4.5', '4.7.28')
+
+
+class SMTPAccountsUnavailable(Exception):
+    """Raised when every account is drained or has reached its daily limit"""
+
+
+def _reply_is_quota(code, message):
+    if isinstance(message, bytes):
+        message = message.decode('utf-8', 'replace')
+    text = str(message).lower()
+    return code in (421, 454) or any(marker in text for marker in QUOTA_MARKERS)
+
+
+def should_drain(error):
+    """Whether an error means the account (not the message) is unusable for now"""
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return bool(error.recipients) and all(
+            _reply_is_quota(code, message) for code, message in error.recipients.values()
+        )
+    if isinstance(error, smtplib.SMTPResponseException):
+        return _reply_is_quota(error.smtp_code, error.smtp_error)
+    return is_connection_error(error)
+
+
+class SMTPAccount:
+    """One account or relay: its connection pool plus selection and quota state"""
+
+    def __init__(self, name, pool, weight=1, daily_limit=0):
+        self.name = name
+        self.pool = pool
+        self.weight = weight
+        self.daily_limit = daily_limit
+
+        self.current = 0  # smooth weighted round-robin state
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.drains = 0
+        self.consecutive_drains = 0
+        self.drained_until = 0
+        self.last_error = None
+        self._day = None
+        self.sent_today = 0
+
+    def available(self, now):
+        if now < self.drained_until or not self.pool.available():
+            return False
+        if self.daily_limit:
+            day = int(now // 86400)
+            if day != self._day:
+                self._day, self.sent_today = day, 0
+            return self.sent_today < self.daily_limit
+        return True
+
+    def stats(self, now):
+        """Counters and pool state for the health endpoint.
+
+        /health needs no API key, so accounts appear by their configured name
+        only, and the last error by its class, not the server's reply text.
+        """
+        return {
+            'name': self.name,
+            'weight': self.weight,
+            'available': self.available(now),
+            'drained_for': max(0, round(self.drained_until - now)),
+            'sent': self.sent,
+            'failed': self.failed,
+            'drains': self.drains,
+            'sent_today': self.sent_today,
+            'daily_limit': self.daily_limit or None,
+            'last_error': type(self.last_error).__name__ if self.last_error is not None else None,
+            'pool': self.pool.stats()
+        }
+
+
+def parse_accounts(config):
+    """Account settings from SMTP_ACCOUNTS (a JSON list), with MAIL_* and SMTP_POOL_* as defaults.
+
+    Each entry takes name, username, password (base64 encoded, like
+    MAIL_PASSWORD), host, port, use_tls, use_ssl, pool_size, weight and
+    daily_limit; all but username and password are optional.
+    """
+    raw = config.get('SMTP_ACCOUNTS') or ''
+    if isinstance(raw, str):
+        if not raw.strip():
+            return []
+        try:
+            raw = json.loads(raw)
+        except ValueError as e:
+            raise ValueError(f"SMTP_ACCOUNTS is not valid JSON: {e}")
+    if not isinstance(raw, list):
+        raise ValueError("SMTP_ACCOUNTS must be a JSON list of accounts")
+
+    accounts = []
+    for index, entry in enumerate(raw):
+        if not isinstance(entry, dict):
+            raise ValueError(f"SMTP_ACCOUNTS[{index}] must be an object")
+        password = entry.get('password')
+        if password:
+            try:
+                password = base64.b64decode(password).decode('utf-8')
+            except Exception as e:
+                raise ValueError(f"SMTP_ACCOUNTS[{index}] password is not base64 encoded: {e}")
+        weight = int(entry.get('weight', 1))
+        if weight < 1:
+            raise ValueError(f"SMTP_ACCOUNTS[{index}] weight must be at least 1")
+        accounts.append({
+            # Not the username: account names are shown on /health
+            'name': entry.get('name') or f"account-{index}",
+            'host': entry.get('host', config['MAIL_SERVER']),
+            'port': int(entry.get('port', config['MAIL_PORT'])),
+            'username': entry.get('username'),
+            'password': password,
+            'use_tls': bool(entry.get('use_tls', config.get('MAIL_USE_TLS', True))),
+            'use_ssl': bool(entry.get('use_ssl', config.get('MAIL_USE_SSL', False))),
+            'pool_size': max(1, int(entry.get('pool_size', config['SMTP_POOL_SIZE']))),
+            'weight': weight,
+            'daily_limit': int(entry.get('daily_limit', 0))
+        })
+    return accounts
+
+
+class SMTPAccountPool:
+    """Transport that balances messages across SMTP accounts, with the SMTP pool's interface"""
+
+    def __init__(self, accounts, strategy='weighted', drain_seconds=300):
+        if not accounts:
+            raise ValueError("At least one SMTP account is required")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown SMTP_ACCOUNT_STRATEGY '{strategy}' (expected one of {', '.join(STRATEGIES)})")
+        self.accounts = accounts
+        self.strategy = strategy
+        self.drain_seconds = drain_seconds
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create one connection pool per SMTP_ACCOUNTS entry"""
+        accounts = []
+        for settings in parse_accounts(config):
+            pool = SMTPConnectionPool(
+                host=settings['host'],
+                port=settings['port'],
+                username=settings['username'],
+                password=settings['password'],
+                use_tls=settings['use_tls'],
+                use_ssl=settings['use_ssl'],
+                size=settings['pool_size'],
+                idle_timeout=config['SMTP_POOL_IDLE_TIMEOUT'],
+                health_check_interval=config['SMTP_POOL_HEALTH_CHECK_INTERVAL'],
+                timeout=config['SMTP_TIMEOUT'],
+                breaker=CircuitBreaker.from_config(config, settings['name'])
+            )
+            accounts.append(SMTPAccount(settings['name'], pool, settings['weight'], settings['daily_limit']))
+        return cls(accounts, config['SMTP_ACCOUNT_STRATEGY'], config['SMTP_ACCOUNT_DRAIN_SECONDS'])
+
+    def _select(self, exclude=()):
+        """Pick the next account and count a send in flight on it"""
+        now = time.time()
+        with self._lock:
+            candidates = [a for a in self.accounts if a not in exclude and a.available(now)]
+            if not candidates:
+                waits = [a.drained_until - now for a in self.accounts if a.drained_until > now]
+                hint = f"; next account available in {round(min(waits))}s" if waits else ""
+                raise SMTPAccountsUnavailable(f"No SMTP account available{hint}")
+            if self.strategy == 'least_loaded':
+                account = min(candidates, key=lambda a: (a.in_flight / a.weight, a.sent_today / a.weight))
+            else:
+                total = 0
+                for candidate in candidates:
+                    candidate.current += candidate.weight
+                    total += candidate.weight
+                account = max(candidates, key=lambda a: a.current)
+                account.current -= total
+            account.in_flight += 1
+            return account
+
+    def _finish(self, account, error=None):
+        """Record the outcome of a send; return whether to move on to another account (it was drained or its breaker is open)"""
+        drained = error is not None and should_drain(error)
+        with self._lock:
+            account.in_flight -= 1
+            if isinstance(error, CircuitOpenError):
+                # Another send took the breaker's probe after this account was selected; nothing was sent
+                return True
+            if error is None:
+                account.sent += 1
+                account.sent_today += 1
+                account.consecutive_drains = 0
+                return False
+            account.failed += 1
+            account.last_error = error
+            if drained:
+                seconds = min(self.drain_seconds * 2 ** account.consecutive_drains, MAX_DRAIN_SECONDS)
+                account.drained_until = time.time() + seconds
+                account.drains += 1
+                account.consecutive_drains += 1
+        if drained:
+            print(f"🚰 Draining SMTP account '{account.name}' for {round(seconds)}s: {error}")
+        return drained
+
+    def _send(self, send):
+        """Run send(account) on selected accounts until one succeeds or fails for a reason other than the account"""
+        tried = []
+        while True:
+            try:
+                account = self._select(tried)
+            except SMTPAccountsUnavailable:
+                if tried:
+                    raise SMTPAccountsUnavailable(f"Every SMTP account failed; last error: {tried[-1].last_error}")
+                raise
+            try:
+                result = send(account)
+            except Exception as e:
+                if not self._finish(account, e):
+                    raise
+                tried.append(account)
+                continue
+            self._finish(account)
+            return result
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        """Send a message over the next account's pool, moving on to another if the account is drained"""
+        return self._send(lambda account: account.pool.sendmail(from_addr, to_addrs, msg, mail_options, rcpt_options))
+
+    def session(self):
+        """Hold connections for sending several messages in a row, still balanced per message"""
+        return SMTPAccountSession(self)
+
+    def available(self):
+        """Whether any account can take a message now"""
+        now = time.time()
+        with self._lock:
+            return any(account.available(now) for account in self.accounts)
+
+    def close(self):
+        """Close every account's idle connections"""
+        for account in self.accounts:
+            account.pool.close()
+
+    def stats(self):
+        """Per-account state for the health endpoint"""
+        now = time.time()
+        with self._lock:
+            accounts = [account.stats(now) for account in self.accounts]
+        return {
+            'backend': 'smtp',
+            'strategy': self.strategy,
+            'available': sum(1 for account in accounts if account['available']),
+            'accounts': accounts
+        }
+
+
+class SMTPAccountSession:
+    """Keeps one pooled session open per account used, for the duration of a batch"""
+
+    def __init__(self, accounts):
+        self.accounts = accounts
+        self._sessions = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _session_send(self, account, envelope):
+        session = self._sessions.get(account)
+        if session is None:
+            session = self._sessions[account] = account.pool.session()
+        try:
+            return session.sendmail(*envelope)
+        except Exception as e:
+            if should_drain(e):
+                # Hand the connection back; the account gets no more messages for now
+                self._sessions.pop(account).close()
+            raise
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        envelope = (from_addr, to_addrs, msg, mail_options, rcpt_options)
+        return self.accounts._send(lambda account: self._session_send(account, envelope))
+
+    def close(self):
+        """Return every held connection to its pool"""
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
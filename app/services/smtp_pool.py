@@ -0,0 +1,276 @@
+"""
+Thread-safe pool of authenticated SMTP connections.
+
+Opening a session to the SMTP server costs a TCP connect, STARTTLS and a
+login round trip. The pool keeps authenticated sessions open between sends,
+health-checks them with NOOP after they have been idle, and transparently
+reconnects when the server has dropped a connection. An optional circuit
+breaker fails sends at once while the server is down (see circuit_breaker.py).
+"""
+
+import smtplib
+import threading
+import time
+from collections import deque
+
+from .circuit_breaker import CircuitBreaker
+from .metrics import SMTP_CONNECT_SECONDS, SMTP_SEND_SECONDS
+
+
+def is_connection_error(error):
+    """Whether an error means the connection itself is unusable (as opposed to a rejected message)"""
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    # SMTPException subclasses OSError, so only plain socket errors count here
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def is_endpoint_failure(error):
+    """Whether an error means the server is unusable (unreachable, refusing the login, shutting down), not the message"""
+    if isinstance(error, (smtplib.SMTPAuthenticationError, smtplib.SMTPConnectError, smtplib.SMTPHeloError)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException) and error.smtp_code == 421:
+        return True
+    return is_connection_error(error)
+
+
+class SMTPPoolExhausted(Exception):
+    """Raised when no connection becomes available within the checkout timeout"""
+
+
+class SMTPConnectionPool:
+    def __init__(self, host, port, username=None, password=None, use_tls=True, use_ssl=False,
+                 size=4, idle_timeout=60, health_check_interval=10, timeout=30, checkout_timeout=30, breaker=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self.checkout_timeout = checkout_timeout
+        self.breaker = breaker
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        # (connection, last_used) pairs, most recently used on the right
+        self._idle = deque()
+        self._in_use = 0
+        self._created = 0
+        self._reconnects = 0
+        self._closed = False
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a pool from the Flask application config"""
+        return cls(
+            host=config['MAIL_SERVER'],
+            port=config['MAIL_PORT'],
+            username=config.get('MAIL_USERNAME'),
+            password=config.get('MAIL_PASSWORD'),
+            use_tls=config.get('MAIL_USE_TLS', True),
+            use_ssl=config.get('MAIL_USE_SSL', False),
+            size=config['SMTP_POOL_SIZE'],
+            idle_timeout=config['SMTP_POOL_IDLE_TIMEOUT'],
+            health_check_interval=config['SMTP_POOL_HEALTH_CHECK_INTERVAL'],
+            timeout=config['SMTP_TIMEOUT'],
+            breaker=CircuitBreaker.from_config(config, f"{config['MAIL_SERVER']}:{config['MAIL_PORT']}")
+        )
+
+    def _connect(self):
+        """Open and authenticate a new SMTP session"""
+        with SMTP_CONNECT_SECONDS.time():
+            if self.use_ssl:
+                connection = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+            else:
+                connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+
+            try:
+                if self.use_tls and not self.use_ssl:
+                    connection.starttls()
+                if self.username and self.password:
+                    connection.login(self.username, self.password)
+            except Exception:
+                self._close(connection)
+                raise
+
+        with self._lock:
+            self._created += 1
+        return connection
+
+    @staticmethod
+    def _close(connection):
+        """Close a connection, ignoring errors from an already dead socket"""
+        try:
+            connection.quit()
+        except Exception:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _is_alive(connection):
+        """Check a connection with NOOP"""
+        try:
+            return connection.noop()[0] == 250
+        except Exception:
+            return False
+
+    def acquire(self, fresh=False):
+        """Check out a healthy connection, opening a new one if none is idle (or if fresh is set)"""
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise SMTPPoolExhausted(f"No SMTP connection available after {self.checkout_timeout}s")
+
+        try:
+            while not fresh:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    connection, last_used = self._idle.pop()
+
+                idle_for = time.monotonic() - last_used
+                if idle_for > self.idle_timeout:
+                    self._close(connection)
+                    continue
+                if idle_for > self.health_check_interval and not self._is_alive(connection):
+                    self._close(connection)
+                    continue
+
+                with self._lock:
+                    self._in_use += 1
+                return connection, True
+
+            connection = self._connect()
+            with self._lock:
+                self._in_use += 1
+            return connection, False
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, connection, discard=False):
+        """Return a connection to the pool, or close it if it is no longer usable"""
+        with self._lock:
+            self._in_use -= 1
+            # Connections checked out when the pool was closed are not pooled again
+            discard = discard or self._closed
+            if not discard:
+                self._idle.append((connection, time.monotonic()))
+        if discard:
+            self._close(connection)
+        self._slots.release()
+
+    def session(self):
+        """Check out one connection for sending several messages in a row"""
+        return SMTPSession(self)
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        """Send a message over a pooled connection, reconnecting once if a reused session was dropped"""
+        with self.session() as session:
+            return session.sendmail(from_addr, to_addrs, msg, mail_options, rcpt_options)
+
+    def available(self):
+        """False while the circuit breaker is failing sends"""
+        return self.breaker is None or self.breaker.available()
+
+    def close(self):
+        """Close every idle connection; connections still checked out are closed when they are returned"""
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        for connection, _ in idle:
+            self._close(connection)
+
+    def stats(self):
+        """Current pool state"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'created': self._created,
+                'reconnects': self._reconnects,
+                'breaker': self.breaker.stats() if self.breaker is not None else None
+            }
+
+
+class SMTPSession:
+    """A pooled connection held for a sequence of sends, returned to the pool on exit"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._connection = None
+        self._reused = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        """Send a message, reconnecting once if the server dropped a previously used connection.
+
+        Raises CircuitOpenError without sending while the pool's breaker is open.
+        """
+        breaker = self.pool.breaker
+        if breaker is None:
+            return self._sendmail(from_addr, to_addrs, msg, mail_options, rcpt_options)
+        breaker.allow()
+        try:
+            result = self._sendmail(from_addr, to_addrs, msg, mail_options, rcpt_options)
+        except SMTPPoolExhausted:
+            breaker.release()
+            raise
+        except Exception as e:
+            if is_endpoint_failure(e):
+                breaker.failure(e)
+            else:
+                breaker.success()
+            raise
+        breaker.success()
+        return result
+
+    def _sendmail(self, from_addr, to_addrs, msg, mail_options, rcpt_options):
+        if self._connection is None:
+            self._connection, self._reused = self.pool.acquire()
+        try:
+            result = self._send(from_addr, to_addrs, msg, mail_options, rcpt_options)
+        except Exception as e:
+            if not is_connection_error(e):
+                raise
+            self._discard()
+            if not self._reused:
+                raise
+            # The server closed the session under us; retry once on a fresh one
+            with self.pool._lock:
+                self.pool._reconnects += 1
+            self._connection, _ = self.pool.acquire(fresh=True)
+            try:
+                result = self._send(from_addr, to_addrs, msg, mail_options, rcpt_options)
+            except Exception as retry_error:
+                if is_connection_error(retry_error):
+                    self._discard()
+                raise
+        # Any later failure on this connection happened after a successful exchange
+        self._reused = True
+        return result
+
+    def _send(self, *envelope):
+        with SMTP_SEND_SECONDS.time():
+            return self._connection.sendmail(*envelope)
+
+    def _discard(self):
+        self.pool.release(self._connection, discard=True)
+        self._connection = None
+
+    def close(self):
+        """Return the connection to the pool"""
+        if self._connection is not None:
+            self.pool.release(self._connection)
+            self._connection = None
@@ -0,0 +1,181 @@
+"""
+Mail transport backends, selected with MAIL_BACKEND.
+
+    smtp    deliver over the SMTP connection pool (or Flask-Mail when pooling is disabled),
+            or across several accounts when SMTP_ACCOUNTS is set
+    memory  keep the most recent messages in a bounded in-process ring buffer
+    file    write each message to a Maildir or a directory of .eml files
+    null    accept and discard every message
+
+Every backend has the SMTP pool's interface: sendmail(*envelope), session()
+for sending several messages in a row, available(), close() and stats(). The non-SMTP
+backends let load tests and staging exercise the HTTP, render and queue
+layers without a mail server or Gmail quotas.
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import nullcontext
+
+from .smtp_accounts import SMTPAccountPool, parse_accounts
+from .smtp_pool import SMTPConnectionPool
+
+BACKENDS = ('smtp', 'memory', 'file', 'null')
+FILE_FORMATS = ('maildir', 'eml')
+
+
+class _CountingTransport:
+    """Shared session handling and counters for the non-SMTP backends"""
+
+    name = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.bytes = 0
+
+    def _count(self, msg):
+        with self._lock:
+            self.sent += 1
+            self.bytes += len(msg)
+
+    def session(self):
+        """Sessions need no connection; messages go straight to the backend"""
+        return nullcontext(self)
+
+    def available(self):
+        return True
+
+    def close(self):
+        pass
+
+    def stats(self):
+        """Counters for the health endpoint"""
+        with self._lock:
+            return {'backend': self.name, 'sent': self.sent, 'bytes': self.bytes}
+
+
+class NullTransport(_CountingTransport):
+    """Accept and discard every message"""
+
+    name = 'null'
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        self._count(msg)
+        return {}
+
+
+class MemoryTransport(_CountingTransport):
+    """Keep the last max_messages sent messages in memory"""
+
+    name = 'memory'
+
+    def __init__(self, max_messages=1000):
+        super().__init__()
+        self.max_messages = max_messages
+        self._messages = deque(maxlen=max_messages)
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        self._messages.append({
+            'sender': from_addr,
+            'recipients': list(to_addrs),
+            'message': msg,
+            'sent_at': time.time()
+        })
+        self._count(msg)
+        return {}
+
+    def messages(self):
+        """Buffered messages, oldest first"""
+        return list(self._messages)
+
+    def clear(self):
+        """Empty the buffer"""
+        self._messages.clear()
+
+    def stats(self):
+        stats = super().stats()
+        stats['buffered'] = len(self._messages)
+        stats['max_messages'] = self.max_messages
+        return stats
+
+
+class FileTransport(_CountingTransport):
+    """Write each message to a Maildir (tmp/new/cur) or as .eml files in one directory.
+
+    Files are written under a temporary name and renamed into place, so a
+    reader never sees a partial message. Return-Path and Delivered-To headers
+    record the envelope, as a local delivery agent would.
+    """
+
+    name = 'file'
+
+    def __init__(self, path, file_format='maildir'):
+        super().__init__()
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"Unknown MAIL_FILE_FORMAT '{file_format}' (expected one of {', '.join(FILE_FORMATS)})")
+        self.path = path
+        self.file_format = file_format
+        self._hostname = socket.gethostname().replace('/', '\\057').replace(':', '\\072')
+        if file_format == 'maildir':
+            self._tmp = os.path.join(path, 'tmp')
+            self._new = os.path.join(path, 'new')
+            for directory in (self._tmp, self._new, os.path.join(path, 'cur')):
+                os.makedirs(directory, exist_ok=True)
+        else:
+            self._tmp = self._new = path
+            os.makedirs(path, exist_ok=True)
+
+    def _filename(self):
+        if self.file_format == 'maildir':
+            return f"{time.time():.6f}.P{os.getpid()}Q{uuid.uuid4().hex}.{self._hostname}"
+        return f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex}.eml"
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        if isinstance(msg, str):
+            msg = msg.encode('utf-8')
+        headers = f"Return-Path: <{from_addr}>\r\n"
+        headers += ''.join(f"Delivered-To: {recipient}\r\n" for recipient in to_addrs)
+        filename = self._filename()
+        temporary = os.path.join(self._tmp, filename + ('.tmp' if self.file_format == 'eml' else ''))
+        with open(temporary, 'wb') as f:
+            f.write(headers.encode('utf-8'))
+            f.write(msg)
+        os.replace(temporary, os.path.join(self._new, filename))
+        self._count(msg)
+        return {}
+
+    def stats(self):
+        stats = super().stats()
+        stats['path'] = self.path
+        stats['format'] = self.file_format
+        return stats
+
+
+def create_transport(config, mail=None):
+    """Create the transport selected by MAIL_BACKEND.
+
+    Returns None for the smtp backend when pooling is disabled (and no
+    SMTP_ACCOUNTS are configured) or Flask-Mail is suppressing sends, in which
+    case EmailService delivers through Flask-Mail.
+    """
+    backend = config['MAIL_BACKEND']
+    if backend == 'smtp':
+        if mail is not None and mail.suppress:
+            return None
+        if parse_accounts(config):
+            return SMTPAccountPool.from_config(config)
+        if config['SMTP_POOL_SIZE'] <= 0:
+            return None
+        return SMTPConnectionPool.from_config(config)
+    if backend == 'memory':
+        return MemoryTransport(config['MAIL_MEMORY_SIZE'])
+    if backend == 'file':
+        return FileTransport(config['MAIL_FILE_PATH'], config['MAIL_FILE_FORMAT'])
+    if backend == 'null':
+        return NullTransport()
+    raise ValueError(f"Unknown MAIL_BACKEND '{backend}' (expected one of {', '.join(BACKENDS)})")
@@ -0,0 +1,853 @@
+"""
+Precompiled template engine for email templates.
+
+Each template string is parsed once into a flat list of literal chunks and
+slots, so rendering is a single pass followed by one ''.join instead of one
+full str.replace scan per variable.
+
+Supported syntax:
+
+    {{name}}  {{item.price}}  {{name|title}}  {{notes|default("None")}}
+    {% if a %}...{% elif b %}...{% else %}...{% endif %}
+    {% for item in items %}...{% else %}...{% endfor %}
+    {# comment #}
+
+Expressions and filters are compiled to Python closures, and loop and
+conditional bodies write into one shared output list, so rendering a
+1,000-line invoice is linear in its size. Inside a loop `loop.index`,
+`loop.index0`, `loop.first`, `loop.last` and `loop.length` are available.
+The indentation before a {% ... %} tag and the newline after it are dropped,
+so block tags on their own line leave no blank lines behind.
+
+A placeholder whose value is missing, or is not a string or number, is left
+in the output exactly as written.
+
+With TEMPLATE_MINIFY enabled the literal chunks of the built-in template
+bodies are also minified at compile time, so production sends carry no
+indentation or CSS formatting.
+"""
+
+import ast
+import html
+import re
+from collections import deque
+from itertools import islice
+from config.config import Config
+from .templates import TEMPLATE_MAP
+
+# A {% ... %} tag also takes the indentation before it and the newline after it
+_TOKEN_RE = re.compile(r'\{\{([^{}]+?)\}\}|(?:^[ \t]*)?\{%(.+?)%\}\n?|\{#.*?#\}', re.DOTALL | re.MULTILINE)
+
+_EXPRESSION_TOKEN_RE = re.compile(r'''
+    \s*(?:
+        (?P<number>\d+(?:\.\d+)?)
+      | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<name>[A-Za-z_]\w*(?:\.\w+)*)
+      | (?P<op>==|!=|<=|>=|<|>|\||\(|\)|,)
+    )''', re.VERBOSE)
+
+_STYLE_RE = re.compile(r'(<style[^>]*>)(.*?)(</style>)', re.DOTALL | re.IGNORECASE)
+_CSS_PUNCTUATION_RE = re.compile(r'\s*([{};:,])\s*')
+_BETWEEN_TAGS_RE = re.compile(r'>\s*\n\s*<')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Slot kinds
+_VARIABLE = 0
+_NODE = 1
+
+
+class TemplateSyntaxError(ValueError):
+    """Raised when a template cannot be compiled"""
+
+
+class _Undefined:
+    """Marker for a name or attribute that does not resolve"""
+
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __iter__(self):
+        return iter(())
+
+    def __repr__(self):
+        return 'Undefined'
+
+
+UNDEFINED = _Undefined()
+
+
+def _format_value(value):
+    """Return the rendered form of a variable value, or None if it is not substituted"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return str(value)
+    return None
+
+
+def _lookup(value, attribute):
+    """Resolve one step of dotted attribute access"""
+    if isinstance(value, dict):
+        return value.get(attribute, UNDEFINED)
+    if isinstance(value, (list, tuple)) and attribute.isdigit():
+        index = int(attribute)
+        return value[index] if index < len(value) else UNDEFINED
+    if value is UNDEFINED or attribute.startswith('_'):
+        return UNDEFINED
+    return getattr(value, attribute, UNDEFINED)
+
+
+def _truncate(value, length=255, end='...'):
+    value = str(value)
+    return value if len(value) <= length else value[:max(0, length - len(end))] + end
+
+
+# Filters receive the value followed by any arguments. A filter that raises
+# TypeError or ValueError makes the expression undefined.
+FILTERS = {
+    'upper': lambda value: str(value).upper(),
+    'lower': lambda value: str(value).lower(),
+    'title': lambda value: str(value).title(),
+    'capitalize': lambda value: str(value).capitalize(),
+    'trim': lambda value: str(value).strip(),
+    'escape': lambda value: html.escape(str(value)),
+    'e': lambda value: html.escape(str(value)),
+    'length': len,
+    'count': len,
+    'int': lambda value: int(float(value)),
+    'float': float,
+    'round': lambda value, precision=0: round(float(value), int(precision)),
+    'format': lambda value, *args: str(value) % args,
+    'join': lambda value, separator='': separator.join(str(item) for item in value),
+    'replace': lambda value, old, new: str(value).replace(old, new),
+    'truncate': _truncate,
+}
+
+
+def _default(value, fallback='', boolean=False):
+    """Jinja-style default: replaces undefined (and falsy values when boolean is set)"""
+    if value is UNDEFINED or value is None or (boolean and not value):
+        return fallback
+    return value
+
+
+def _compare(operator):
+    def compare(left, right):
+        try:
+            return operator(left, right)
+        except TypeError:
+            return False
+    return compare
+
+
+_COMPARISONS = {
+    '==': _compare(lambda a, b: a == b),
+    '!=': _compare(lambda a, b: a != b),
+    '<': _compare(lambda a, b: a < b),
+    '>': _compare(lambda a, b: a > b),
+    '<=': _compare(lambda a, b: a <= b),
+    '>=': _compare(lambda a, b: a >= b),
+    'in': _compare(lambda a, b: a in b),
+}
+
+
+class _ExpressionParser:
+    """Compile an expression into a function of the render context.
+
+    Grammar, loosest binding first:
+        or  := and ('or' and)*
+        and := not ('and' not)*
+        not := 'not' not | cmp
+        cmp := filtered (('==' | '!=' | '<' | '>' | '<=' | '>=' | 'in' | 'not' 'in') filtered)?
+        filtered := primary ('|' name ('(' arguments ')')?)*
+        primary := number | string | true | false | none | name('.' name)* | '(' or ')'
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.tokens = self._tokenize(source)
+        self.position = 0
+
+    def _tokenize(self, source):
+        tokens = []
+        position = 0
+        source = source.rstrip()
+        while position < len(source):
+            match = _EXPRESSION_TOKEN_RE.match(source, position)
+            if match is None:
+                raise TemplateSyntaxError(f"Unexpected character in expression '{source.strip()}'")
+            tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            position = match.end()
+        return tokens
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def _next(self):
+        token = self._peek()
+        self.position += 1
+        return token
+
+    def _accept(self, value):
+        if self._peek()[1] == value:
+            self.position += 1
+            return True
+        return False
+
+    def _expect(self, value):
+        if not self._accept(value):
+            raise TemplateSyntaxError(f"Expected '{value}' in expression '{self.source.strip()}'")
+
+    def parse(self):
+        if not self.tokens:
+            raise TemplateSyntaxError("Empty expression")
+        function = self._or()
+        if self.position != len(self.tokens):
+            raise TemplateSyntaxError(f"Unexpected '{self._peek()[1]}' in expression '{self.source.strip()}'")
+        return function
+
+    def _or(self):
+        left = self._and()
+        while self._accept('or'):
+            right = self._and()
+            left = (lambda a, b: lambda context: a(context) or b(context))(left, right)
+        return left
+
+    def _and(self):
+        left = self._not()
+        while self._accept('and'):
+            right = self._not()
+            left = (lambda a, b: lambda context: a(context) and b(context))(left, right)
+        return left
+
+    def _not(self):
+        if self._accept('not'):
+            operand = self._not()
+            return lambda context: not operand(context)
+        return self._comparison()
+
+    def _comparison(self):
+        left = self._filtered()
+        kind, value = self._peek()
+        negate = False
+        if value == 'not' and self.position + 1 < len(self.tokens) and self.tokens[self.position + 1][1] == 'in':
+            self.position += 1
+            kind, value = self._peek()
+            negate = True
+        if kind not in ('op', 'name') or value not in _COMPARISONS:
+            return left
+        self.position += 1
+        compare = _COMPARISONS[value]
+        right = self._filtered()
+        if negate:
+            return lambda context: not compare(left(context), right(context))
+        return lambda context: compare(left(context), right(context))
+
+    def _filtered(self):
+        function = self._primary()
+        while self._accept('|'):
+            kind, name = self._next()
+            if kind != 'name':
+                raise TemplateSyntaxError(f"Expected a filter name in expression '{self.source.strip()}'")
+            arguments = []
+            if self._accept('('):
+                if not self._accept(')'):
+                    arguments.append(self._or())
+                    while self._accept(','):
+                        arguments.append(self._or())
+                    self._expect(')')
+            function = self._apply_filter(function, name, arguments)
+        return function
+
+    def _apply_filter(self, function, name, arguments):
+        # Literal arguments (the common case) are evaluated once, here
+        constant = all(hasattr(argument, 'constant') for argument in arguments)
+        values = tuple(argument.constant for argument in arguments) if constant else None
+
+        if name == 'default' or name == 'd':
+            if constant:
+                return lambda context: _default(function(context), *values)
+            return lambda context: _default(function(context), *[argument(context) for argument in arguments])
+        if name not in FILTERS:
+            raise TemplateSyntaxError(f"Unknown filter '{name}'")
+        apply = FILTERS[name]
+
+        if constant:
+            def filtered_constant(context):
+                value = function(context)
+                if value is UNDEFINED:
+                    return UNDEFINED
+                try:
+                    return apply(value, *values)
+                except (TypeError, ValueError, OverflowError):
+                    return UNDEFINED
+            return filtered_constant
+
+        def filtered(context):
+            value = function(context)
+            if value is UNDEFINED:
+                return UNDEFINED
+            # An argument that does not resolve is passed as '' rather than as the marker
+            values = ['' if result is UNDEFINED else result for result in (argument(context) for argument in arguments)]
+            try:
+                return apply(value, *values)
+            except (TypeError, ValueError, OverflowError):
+                return UNDEFINED
+        return filtered
+
+    def _primary(self):
+        kind, value = self._next()
+        if kind == 'number':
+            return _constant(float(value) if '.' in value else int(value))
+        if kind == 'string':
+            return _constant(ast.literal_eval(value))
+        if kind == 'name':
+            if value in ('true', 'True', 'false', 'False', 'none', 'None'):
+                return _constant({'true': True, 'false': False, 'none': None}[value.lower()])
+            return compile_name(value)
+        if value == '(':
+            function = self._or()
+            self._expect(')')
+            return function
+        raise TemplateSyntaxError(f"Unexpected '{value}' in expression '{self.source.strip()}'")
+
+
+def _constant(value):
+    """Expression function for a literal; .constant exposes the value to the compiler"""
+    def constant(context):
+        return value
+    constant.constant = value
+    return constant
+
+
+def compile_name(path):
+    """Compile a dotted name such as item.price into a context lookup"""
+    root, *attributes = path.split('.')
+    if not attributes:
+        return lambda context: context.get(root, UNDEFINED)
+    if len(attributes) == 1:
+        attribute = attributes[0]
+
+        # item.name inside a loop is by far the most common case
+        def lookup_attribute(context):
+            value = context.get(root, UNDEFINED)
+            if value.__class__ is dict:
+                return value.get(attribute, UNDEFINED)
+            return _lookup(value, attribute)
+        return lookup_attribute
+
+    def lookup(context):
+        value = context.get(root, UNDEFINED)
+        for attribute in attributes:
+            if value is UNDEFINED:
+                break
+            value = _lookup(value, attribute)
+        return value
+    return lookup
+
+
+def compile_expression(source):
+    """Compile an expression string into a function of the render context"""
+    return _ExpressionParser(source).parse()
+
+
+class _Loop:
+    """The `loop` variable inside a for block"""
+
+    __slots__ = ('index0', 'length')
+
+    def __init__(self, length):
+        self.index0 = 0
+        self.length = length
+
+    @property
+    def index(self):
+        return self.index0 + 1
+
+    @property
+    def first(self):
+        return self.index0 == 0
+
+    @property
+    def last(self):
+        return self.index0 == self.length - 1
+
+
+def _output(value, raw):
+    """Rendered form of an output value, or the placeholder as written"""
+    rendered = None if value is UNDEFINED else _format_value(value)
+    return raw if rendered is None else rendered
+
+
+def _iterate(value):
+    """Items of a for loop; anything that is not iterable loops zero times"""
+    if isinstance(value, (list, tuple)):
+        return value
+    try:
+        return list(value)
+    except TypeError:
+        return ()
+
+
+_SIMPLE_NAME_RE = re.compile(r'[A-Za-z_]\w*(?:\.\w+)*$')
+_LOOP_NAME_RE = re.compile(r'\bloop\b')
+_CONSTANT_NAMES = ('true', 'True', 'false', 'False', 'none', 'None', 'not')
+
+
+def _is_simple(source):
+    """Whether an expression is a plain (dotted) name that can be inlined"""
+    return _SIMPLE_NAME_RE.match(source) is not None and source.split('.')[0] not in _CONSTANT_NAMES
+
+
+def _expressions(nodes):
+    """Every expression source used in a node list, including nested blocks"""
+    for node in nodes:
+        kind = node[0]
+        if kind == 'output':
+            yield node[1]
+        elif kind == 'if':
+            for test, _, body in node[1]:
+                yield test
+                yield from _expressions(body)
+            yield from _expressions(node[2])
+        elif kind == 'for':
+            yield node[2]
+            yield from _expressions(node[4])
+            yield from _expressions(node[5])
+
+
+class _CodeGenerator:
+    """Generate a Python function for one top-level block or expression.
+
+    Loop variables become Python locals and plain dotted names are inlined,
+    so a loop body runs as straight-line code; runs of text and outputs are
+    concatenated into a single append. Other expressions call their
+    compiled closure with a dict scope, which is only built for loops that
+    need it.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.namespace = {
+            'UNDEFINED': UNDEFINED,
+            '_lookup': _lookup,
+            '_output': _output,
+            '_iterate': _iterate,
+            '_Loop': _Loop,
+        }
+        self.counter = 0
+
+    def generate(self, node):
+        """Return a function (context, append) rendering node"""
+        self._write(0, 'def render(context, append):')
+        self._body([node], 1, {}, 'context')
+        exec(compile('\n'.join(self.lines), '<template>', 'exec'), self.namespace)
+        return self.namespace['render']
+
+    def generate_template(self, literals, slots):
+        """Return a function (variables) rendering a whole template with one join"""
+        self._write(0, 'def render(context):')
+        parts = [self._constant(literals[0])] if literals[0] else []
+        for (kind, target, raw), literal in zip(slots, literals[1:]):
+            value = self._name('v')
+            if kind == _VARIABLE:
+                self._write(1, f'{value} = context.get({target!r})')
+                self._write(1, f'if {value}.__class__ is not str: '
+                               f'{value} = str({value}) if {value}.__class__ is int else _output({value}, {raw!r})')
+            else:
+                output = self._name('p')
+                self._write(1, f'{output} = []')
+                self._write(1, f'{self._constant(target)}(context, {output}.append)')
+                self._write(1, f"{value} = ''.join({output})")
+            parts.append(value)
+            if literal:
+                parts.append(self._constant(literal))
+        self._write(1, f"return ''.join(({', '.join(parts)},))" if parts else "return ''")
+        exec(compile('\n'.join(self.lines), '<template>', 'exec'), self.namespace)
+        return self.namespace['render']
+
+    def _write(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def _name(self, prefix):
+        self.counter += 1
+        return f'{prefix}{self.counter}'
+
+    def _constant(self, value):
+        name = self._name('c')
+        self.namespace[name] = value
+        return name
+
+    def _value(self, source, function, indent, local_names, scope):
+        """Write code evaluating an expression and return the variable holding it"""
+        target = self._name('v')
+        if not _is_simple(source):
+            self._write(indent, f'{target} = {self._constant(function)}({scope})')
+            return target
+        root, *attributes = source.split('.')
+        if root in local_names:
+            self._write(indent, f'{target} = {local_names[root]}')
+        else:
+            self._write(indent, f'{target} = context.get({root!r}, UNDEFINED)')
+        for attribute in attributes:
+            self._write(indent, f'{target} = {target}.get({attribute!r}, UNDEFINED) '
+                                f'if {target}.__class__ is dict else _lookup({target}, {attribute!r})')
+        return target
+
+    def _body(self, nodes, indent, local_names, scope):
+        pending = []
+        start = len(self.lines)
+        for node in nodes:
+            kind = node[0]
+            if kind == 'text':
+                pending.append(repr(node[1]))
+            elif kind == 'output':
+                _, source, raw, function = node
+                value = self._value(source, function, indent, local_names, scope)
+                self._write(indent, f'if {value}.__class__ is not str: '
+                                    f'{value} = str({value}) if {value}.__class__ is int else _output({value}, {raw!r})')
+                pending.append(value)
+            else:
+                self._flush(pending, indent)
+                if kind == 'if':
+                    self._if(node[1], node[2], indent, local_names, scope)
+                else:
+                    self._for(node, indent, local_names, scope)
+        self._flush(pending, indent)
+        if len(self.lines) == start:
+            self._write(indent, 'pass')
+
+    def _flush(self, pending, indent):
+        if pending:
+            self._write(indent, f"append({' + '.join(pending)})")
+            pending.clear()
+
+    def _if(self, branches, else_body, indent, local_names, scope):
+        (test, function, body), *rest = branches
+        value = self._value(test, function, indent, local_names, scope)
+        self._write(indent, f'if {value}:')
+        self._body(body, indent + 1, local_names, scope)
+        if rest or else_body:
+            self._write(indent, 'else:')
+            if rest:
+                self._if(rest, else_body, indent + 1, local_names, scope)
+            else:
+                self._body(else_body, indent + 1, local_names, scope)
+
+    def _for(self, node, indent, local_names, scope):
+        _, target, source, function, body, else_body = node
+        items = self._value(source, function, indent, local_names, scope)
+        self._write(indent, f'{items} = _iterate({items})')
+        self._write(indent, f'if {items}:')
+        indent += 1
+
+        expressions = list(_expressions(body))
+        uses_loop = any(_LOOP_NAME_RE.search(expression) for expression in expressions)
+        needs_scope = not all(_is_simple(expression) for expression in expressions)
+
+        local_names = dict(local_names)
+        item = local_names[target] = self._name(f'l_{target}_')
+        loop = None
+        if uses_loop:
+            loop = local_names['loop'] = self._name('loop')
+            self._write(indent, f'{loop} = _Loop(len({items}))')
+        if needs_scope:
+            inner_scope = self._name('scope')
+            self._write(indent, f'{inner_scope} = dict({scope})')
+            if loop:
+                self._write(indent, f"{inner_scope}['loop'] = {loop}")
+            scope = inner_scope
+
+        if loop:
+            index = self._name('i')
+            self._write(indent, f'for {index}, {item} in enumerate({items}):')
+            self._write(indent + 1, f'{loop}.index0 = {index}')
+        else:
+            self._write(indent, f'for {item} in {items}:')
+        if needs_scope:
+            self._write(indent + 1, f'{scope}[{target!r}] = {item}')
+        self._body(body, indent + 1, local_names, scope)
+
+        if else_body:
+            self._write(indent - 1, 'else:')
+            self._body(else_body, indent, local_names, scope)
+
+
+class _TemplateParser:
+    """Parse the template token stream into a node tree.
+
+    Nodes are ('text', text), ('output', source, raw, function),
+    ('if', [(test, function, body), ...], else_body) and
+    ('for', target, source, function, body, else_body).
+    """
+
+    def __init__(self, source, minify=False):
+        self.source = source
+        self.minify = minify
+        self.tokens = list(self._tokenize(source))
+        self.position = 0
+        self.names = []
+        self.loop_targets = {'loop'}
+
+    def _tokenize(self, source):
+        position = 0
+        for match in _TOKEN_RE.finditer(source):
+            if match.start() > position:
+                yield 'text', source[position:match.start()], None
+            if match.group(1) is not None:
+                yield 'output', match.group(1).strip(), (match.group(0), match.start())
+            elif match.group(2) is not None:
+                yield 'tag', match.group(2).strip(), match.start()
+            position = match.end()
+        if position < len(source):
+            yield 'text', source[position:], None
+
+    def _error(self, message, offset):
+        line = self.source.count('\n', 0, offset) + 1
+        return TemplateSyntaxError(f"{message} (line {line})")
+
+    def parse(self):
+        """Return the top-level nodes"""
+        nodes, _ = self._parse_body(())
+        return nodes
+
+    def _parse_body(self, end_tags):
+        nodes = []
+        while self.position < len(self.tokens):
+            kind, value, extra = self.tokens[self.position]
+            self.position += 1
+            if kind == 'text':
+                nodes.append(('text', minify_html(value) if self.minify else value))
+            elif kind == 'output':
+                raw, offset = extra
+                self.names.append(re.match(r'\w*', value).group(0))
+                nodes.append(('output', value, raw, self._expression(value, offset)))
+            else:
+                keyword = value.split(None, 1)[0]
+                if keyword in end_tags:
+                    return nodes, (keyword, value, extra)
+                if keyword == 'if':
+                    nodes.append(self._if(value, extra))
+                elif keyword == 'for':
+                    nodes.append(self._for(value, extra))
+                else:
+                    raise self._error(f"Unexpected tag '{{% {value} %}}'", extra)
+        if end_tags:
+            raise self._error(f"Missing '{{% {end_tags[-1]} %}}'", len(self.source))
+        return nodes, None
+
+    def _expression(self, source, offset):
+        try:
+            return compile_expression(source)
+        except TemplateSyntaxError as e:
+            raise self._error(str(e), offset)
+
+    def _if(self, tag, offset):
+        branches = []
+        else_body = []
+        test = tag[2:].strip()
+        function = self._expression(test, offset)
+        while True:
+            body, (keyword, value, next_offset) = self._parse_body(('elif', 'else', 'endif'))
+            branches.append((test, function, body))
+            if keyword == 'endif':
+                break
+            if keyword == 'else':
+                else_body, _ = self._parse_body(('endif',))
+                break
+            test = value[4:].strip()
+            function = self._expression(test, next_offset)
+        return ('if', branches, else_body)
+
+    def _for(self, tag, offset):
+        match = re.match(r'for\s+([A-Za-z_]\w*)\s+in\s+(.+)$', tag, re.DOTALL)
+        if match is None:
+            raise self._error(f"Invalid for tag '{{% {tag} %}}'", offset)
+        target, source = match.group(1), match.group(2).strip()
+        function = self._expression(source, offset)
+        self.loop_targets.add(target)
+        body, (keyword, _, _) = self._parse_body(('else', 'endfor'))
+        else_body = []
+        if keyword == 'else':
+            else_body, _ = self._parse_body(('endfor',))
+        return ('for', target, source, function, body, else_body)
+
+
+def _minify_css(match):
+    css = _WHITESPACE_RE.sub(' ', match.group(2))
+    css = _CSS_PUNCTUATION_RE.sub(r'\1', css).replace(';}', '}')
+    return match.group(1) + css.strip() + match.group(3)
+
+
+def minify_html(text):
+    """Strip formatting whitespace from an HTML fragment.
+
+    Whitespace containing a newline between two tags is dropped and any
+    other run of whitespace collapses to a single space, so inline text
+    keeps its word spacing.
+    """
+    text = _STYLE_RE.sub(_minify_css, text)
+    text = _BETWEEN_TAGS_RE.sub('><', text)
+    return _WHITESPACE_RE.sub(' ', text)
+
+
+class CompiledTemplate:
+    """A template parsed into literal chunks and slots"""
+
+    __slots__ = ('source', 'literals', 'slots', 'names', '_render')
+
+    def __init__(self, source, minify=False):
+        self.source = source
+        # literals has exactly one more entry than slots: lit, slot, lit, slot, ..., lit.
+        # A slot is (_VARIABLE, name, raw) for a plain {{name}}, or (_NODE, render, raw)
+        # with a generated render(variables, append) for any other expression or block.
+        self.literals = []
+        self.slots = []
+
+        parser = _TemplateParser(source, minify)
+        literal = []
+        for node in parser.parse():
+            if node[0] == 'text':
+                literal.append(node[1])
+                continue
+            self.literals.append(''.join(literal))
+            literal = []
+            if node[0] == 'output' and node[1].isidentifier():
+                self.slots.append((_VARIABLE, node[1], node[2]))
+            else:
+                raw = node[2] if node[0] == 'output' else None
+                self.slots.append((_NODE, _CodeGenerator().generate(node), raw))
+        self.literals.append(''.join(literal))
+        self.names = list(dict.fromkeys(
+            name for name in parser.names if name and name not in parser.loop_targets
+        ))
+
+        if minify:
+            self.literals[0] = self.literals[0].lstrip()
+            self.literals[-1] = self.literals[-1].rstrip()
+
+        self._render = _CodeGenerator().generate_template(self.literals, self.slots)
+
+    @property
+    def variable_names(self):
+        """Names of the top-level variables this template outputs"""
+        return self.names
+
+    def render_slots(self, variables):
+        """Render only the slots; literals[i] precedes the i-th returned value"""
+        values = []
+        append = values.append
+        for kind, target, raw in self.slots:
+            if kind == _VARIABLE:
+                rendered = _format_value(variables.get(target))
+                # Unknown or unsupported variables leave the placeholder untouched
+                append(raw if rendered is None else rendered)
+            else:
+                parts = []
+                target(variables, parts.append)
+                append(''.join(parts))
+        return values
+
+    def render(self, variables):
+        """Render the template with the given variables in a single pass"""
+        return self._render(variables)
+
+
+def compile_template(source, minify=False):
+    """Compile a template string into a CompiledTemplate"""
+    return CompiledTemplate(source, minify)
+
+
+def _compile_template_map(minify=False):
+    """Compile the subject and body of every entry in TEMPLATE_MAP"""
+    compiled = {}
+    for email_type, template in TEMPLATE_MAP.items():
+        compiled[email_type] = {
+            'subject': compile_template(template['subject']),
+            'body': compile_template(template['body'], minify)
+        }
+    return compiled
+
+
+# Compiled once at import time
+COMPILED_TEMPLATES = _compile_template_map(Config.TEMPLATE_MINIFY)
+
+# Upper bound on ad-hoc template strings kept compiled
+SOURCE_CACHE_SIZE = 256
+
+# Compiled template cache keyed by source string; the built-in bodies map to
+# their (possibly minified) compiled form
+_source_cache = {
+    source.source: source
+    for compiled in COMPILED_TEMPLATES.values()
+    for source in compiled.values()
+}
+
+
+def get_compiled_template(email_type):
+    """Get the compiled subject and body for an email type"""
+    return COMPILED_TEMPLATES.get(email_type)
+
+
+def get_compiled_source(source):
+    """Get the compiled form of an arbitrary template string, compiling it on first use"""
+    compiled = _source_cache.get(source)
+    if compiled is None:
+        compiled = compile_template(source)
+        if len(_source_cache) < SOURCE_CACHE_SIZE:
+            _source_cache[source] = compiled
+    return compiled
+
+
+def render_many(email_type, variables_iterable, processes=None, chunk_size=1000):
+    """Render one email type for many recipients, yielding (subject, body) in order.
+
+    The compiled template is looked up once and each message costs one
+    generated render call per part. Results are produced lazily, so memory
+    stays flat however many variable dicts are supplied.
+
+    With processes > 1, chunks of chunk_size variable dicts are rendered in a
+    process pool with at most two chunks per process in flight. Variables and
+    results are pickled between processes, so this only pays off for heavy
+    templates such as invoices with long item loops.
+    """
+    template = get_compiled_template(email_type)
+    if template is None:
+        raise KeyError(f"Template not found for email type '{email_type}'")
+    if processes and processes > 1:
+        return _render_parallel(email_type, variables_iterable, processes, chunk_size)
+    return _render_serial(template, variables_iterable)
+
+
+def _render_serial(template, variables_iterable):
+    render_subject = template['subject']._render
+    render_body = template['body']._render
+    for variables in variables_iterable:
+        yield render_subject(variables), render_body(variables)
+
+
+def _render_chunk(email_type, chunk):
+    """Process pool task: render a list of variable dicts"""
+    return list(_render_serial(COMPILED_TEMPLATES[email_type], chunk))
+
+
+def _render_parallel(email_type, variables_iterable, processes, chunk_size):
+    from concurrent.futures import ProcessPoolExecutor
+
+    iterator = iter(variables_iterable)
+    pending = deque()
+    executor = ProcessPoolExecutor(max_workers=processes)
+    try:
+        while True:
+            while len(pending) < processes * 2:
+                chunk = list(islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(_render_chunk, email_type, chunk))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,160 @@
+"""
+Shared email layouts and partials.
+
+Templates extend a layout and override its blocks:
+
+    body = extend_layout(BASE_LAYOUT_KEY, {
+        'title': 'Welcome',
+        'styles': '{% include "button_styles" %}',
+        'content': '<h2>Welcome {{name}}!</h2>'
+    })
+
+`{% block name %}default{% endblock %}` marks an overridable region of a
+layout and `{% include "name" %}` inserts a partial. Composition happens
+once at import time, so the engine only ever sees flat template strings.
+"""
+
+import re
+
+BASE_LAYOUT_KEY = "base"
+
+# Style partials
+BASE_STYLES = '''
+            body {
+                font-family: Arial, sans-serif;
+                line-height: 1.6;
+                color: #333;
+                max-width: 600px;
+                margin: 0 auto;
+                padding: 20px;
+            }
+            .header {
+                background: linear-gradient(135deg, #E4405F 0%, #833AB4 100%);
+                color: white;
+                padding: 30px;
+                text-align: center;
+                border-radius: 10px 10px 0 0;
+            }
+            .content {
+                background: #f9f9f9;
+                padding: 30px;
+                border-radius: 0 0 10px 10px;
+            }'''
+
+FOOTER_STYLES = '''
+            .footer {
+                margin-top: 30px;
+                padding-top: 20px;
+                border-top: 1px solid #ddd;
+                font-size: 12px;
+                color: #666;
+            }'''
+
+BUTTON_STYLES = '''
+            .button {
+                display: inline-block;
+                background: linear-gradient(135deg, #E4405F 0%, #833AB4 100%);
+                color: white;
+                padding: 15px 30px;
+                text-decoration: none;
+                border-radius: 5px;
+                font-weight: bold;
+                margin: 20px 0;
+            }'''
+
+WARNING_STYLES = '''
+            .warning {
+                background: #fff3cd;
+                border: 1px solid #ffeaa7;
+                color: #856404;
+                padding: 15px;
+                border-radius: 5px;
+                margin: 20px 0;
+            }'''
+
+# Markup partials
+DEFAULT_FOOTER = '''
+            <p>This email was sent by Our Service. Please do not reply to this email.</p>
+            <p>If you have any questions, please contact our support team.</p>'''
+
+BASE_LAYOUT = '''
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <title>{% block title %}{% endblock %}</title>
+        <style>{% include "base_styles" %}{% block styles %}{% endblock %}{% include "footer_styles" %}
+        </style>
+    </head>
+    <body>
+        <div class="header">
+            <h1>{% block heading %}{% endblock %}</h1>
+            <p>{% block subheading %}{% endblock %}</p>
+        </div>
+        <div class="content">{% block content %}{% endblock %}
+        </div>
+        <div class="footer">{% block footer %}{% include "default_footer" %}{% endblock %}
+        </div>
+    </body>
+    </html>
+    '''
+
+PARTIALS = {
+    "base_styles": BASE_STYLES,
+    "button_styles": BUTTON_STYLES,
+    "warning_styles": WARNING_STYLES,
+    "footer_styles": FOOTER_STYLES,
+    "default_footer": DEFAULT_FOOTER
+}
+
+LAYOUTS = {
+    BASE_LAYOUT_KEY: BASE_LAYOUT
+}
+
+_BLOCK_RE = re.compile(r'\{%\s*block\s+(\w+)\s*%\}(.*?)\{%\s*endblock\s*%\}', re.DOTALL)
+_INCLUDE_RE = re.compile(r'\{%\s*include\s+["\'](\w+)["\']\s*%\}')
+
+
+def include_partials(source, depth=0):
+    """Expand {% include "name" %} tags, including those inside partials"""
+    if depth > 10:
+        raise ValueError("Partials are nested too deeply (recursive include?)")
+
+    def replace(match):
+        name = match.group(1)
+        if name not in PARTIALS:
+            raise KeyError(f"Unknown partial '{name}'")
+        return include_partials(PARTIALS[name], depth + 1)
+
+    return _INCLUDE_RE.sub(replace, source)
+
+
+def extend_layout(layout_name, blocks):
+    """Flatten a layout with the given block overrides into a single template string"""
+    layout = LAYOUTS[layout_name]
+    unknown = set(blocks) - {name for name, _ in _BLOCK_RE.findall(layout)}
+    if unknown:
+        raise KeyError(f"Layout '{layout_name}' has no blocks named {sorted(unknown)}")
+
+    def replace(match):
+        name, default = match.group(1), match.group(2)
+        return blocks.get(name, default)
+
+    return include_partials(_BLOCK_RE.sub(replace, layout))
+
+
+def button(url, text):
+    """Centered call-to-action button markup"""
+    return f'''
+            <div style="text-align: center;">
+                <a href="{url}" class="button">{text}</a>
+            </div>'''
+
+
+def link_fallback(url):
+    """Copy-and-paste fallback for a button link"""
+    return f'''
+            <p>If the button doesn't work, you can copy and paste this link into your browser:</p>
+            <p style="word-break: break-all; background: #f0f0f0; padding: 10px; border-radius: 5px;">
+                {url}
+            </p>'''
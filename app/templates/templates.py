@@ -1,3 +1,5 @@
+from .layouts import BASE_LAYOUT_KEY, extend_layout, button, link_fallback
+
 # Email template type keys
 WELCOME_EMAIL_KEY = "welcome_email"
 ACCOUNT_CONFIRMATION_KEY = "account_confirmation_email"
@@ -5,278 +7,70 @@ PASSWORD_RESET_KEY = "password_reset_email"
 ACCESS_KEY_KEY = "access_key_email"
 INVOICE_KEY = "invoice_email"
 
-# Individual email templates
+# Individual email templates (each extends the shared base layout in layouts.py)
 welcome_email = {
     'subject': 'Welcome to Our Service!',
-    'body': '''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <title>Welcome to Our Service</title>
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                line-height: 1.6;
-                color: #333;
-                max-width: 600px;
-                margin: 0 auto;
-                padding: 20px;
-            }
-            .header {
-                background: linear-gradient(135deg, #E4405F 0%, #833AB4 100%);
-                color: white;
-                padding: 30px;
-                text-align: center;
-                border-radius: 10px 10px 0 0;
-            }
-            .content {
-                background: #f9f9f9;
-                padding: 30px;
-                border-radius: 0 0 10px 10px;
-            }
-            .button {
-                display: inline-block;
-                background: linear-gradient(135deg, #E4405F 0%, #833AB4 100%);
-                color: white;
-                padding: 15px 30px;
-                text-decoration: none;
-                border-radius: 5px;
-                font-weight: bold;
-                margin: 20px 0;
-            }
-            .footer {
-                margin-top: 30px;
-                padding-top: 20px;
-                border-top: 1px solid #ddd;
-                font-size: 12px;
-                color: #666;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h1>Welcome to Our Service</h1>
-            <p>Your Account Has Been Created</p>
-        </div>
-        <div class="content">
+    'body': extend_layout(BASE_LAYOUT_KEY, {
+        'title': 'Welcome to Our Service',
+        'styles': '{% include "button_styles" %}',
+        'heading': 'Welcome to Our Service',
+        'subheading': 'Your Account Has Been Created',
+        'content': '''
             <h2>Welcome {{name}}!</h2>
             <p>Thank you for joining our service. We're excited to have you on board!</p>
             
             <p>Your account has been successfully created with email: <strong>{{email}}</strong></p>
-            
-            <div style="text-align: center;">
-                <a href="{{login_url}}" class="button">Get Started</a>
-            </div>
+            ''' + button('{{login_url}}', 'Get Started') + '''
             
             <p>If you have any questions, feel free to reach out to our support team.</p>
             
-            <p>We look forward to helping you succeed!</p>
-        </div>
-        <div class="footer">
-            <p>This email was sent by Our Service. Please do not reply to this email.</p>
-            <p>If you have any questions, please contact our support team.</p>
-        </div>
-    </body>
-    </html>
-    '''
+            <p>We look forward to helping you succeed!</p>'''
+    })
 }
 
 account_confirmation_email = {
     'subject': 'Confirm Your Email Address',
-    'body': '''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <title>Confirm Your Email</title>
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                line-height: 1.6;
-                color: #333;
-                max-width: 600px;
-                margin: 0 auto;
-                padding: 20px;
-            }
-            .header {
-                background: linear-gradient(135deg, #E4405F 0%, #833AB4 100%);
-                color: white;
-                padding: 30px;
-                text-align: center;
-                border-radius: 10px 10px 0 0;
-            }
-            .content {
-                background: #f9f9f9;
-                padding: 30px;
-                border-radius: 0 0 10px 10px;
-            }
-            .button {
-                display: inline-block;
-                background: linear-gradient(135deg, #E4405F 0%, #833AB4 100%);
-                color: white;
-                padding: 15px 30px;
-                text-decoration: none;
-                border-radius: 5px;
-                font-weight: bold;
-                margin: 20px 0;
-            }
-            .footer {
-                margin-top: 30px;
-                padding-top: 20px;
-                border-top: 1px solid #ddd;
-                font-size: 12px;
-                color: #666;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h1>Confirm Your Email</h1>
-            <p>Complete Your Registration</p>
-        </div>
-        <div class="content">
+    'body': extend_layout(BASE_LAYOUT_KEY, {
+        'title': 'Confirm Your Email',
+        'styles': '{% include "button_styles" %}',
+        'heading': 'Confirm Your Email',
+        'subheading': 'Complete Your Registration',
+        'content': '''
             <h2>Welcome {{name}}!</h2>
             <p>Thank you for registering with our service. To complete your registration and start using our platform, please confirm your email address by clicking the button below:</p>
-            
-            <div style="text-align: center;">
-                <a href="{{verification_url}}" class="button">Confirm Email Address</a>
-            </div>
-            
-            <p>If the button doesn't work, you can copy and paste this link into your browser:</p>
-            <p style="word-break: break-all; background: #f0f0f0; padding: 10px; border-radius: 5px;">
-                {{verification_url}}
-            </p>
+            ''' + button('{{verification_url}}', 'Confirm Email Address') + '''
+            ''' + link_fallback('{{verification_url}}') + '''
             
             <p><strong>Important:</strong> This link will expire in {{expiry_hours}} hour(s) for security reasons.</p>
             
-            <p>If you didn't create an account with us, you can safely ignore this email.</p>
-        </div>
-        <div class="footer">
-            <p>This email was sent by Our Service. Please do not reply to this email.</p>
-            <p>If you have any questions, please contact our support team.</p>
-        </div>
-    </body>
-    </html>
-    '''
+            <p>If you didn't create an account with us, you can safely ignore this email.</p>'''
+    })
 }
 
 password_reset_email = {
     'subject': 'Password Reset Request',
-    'body': '''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <title>Password Reset Request</title>
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                line-height: 1.6;
-                color: #333;
-                max-width: 600px;
-                margin: 0 auto;
-                padding: 20px;
-            }
-            .header {
-                background: linear-gradient(135deg, #E4405F 0%, #833AB4 100%);
-                color: white;
-                padding: 30px;
-                text-align: center;
-                border-radius: 10px 10px 0 0;
-            }
-            .content {
-                background: #f9f9f9;
-                padding: 30px;
-                border-radius: 0 0 10px 10px;
-            }
-            .button {
-                display: inline-block;
-                background: linear-gradient(135deg, #E4405F 0%, #833AB4 100%);
-                color: white;
-                padding: 15px 30px;
-                text-decoration: none;
-                border-radius: 5px;
-                font-weight: bold;
-                margin: 20px 0;
-            }
-            .warning {
-                background: #fff3cd;
-                border: 1px solid #ffeaa7;
-                color: #856404;
-                padding: 15px;
-                border-radius: 5px;
-                margin: 20px 0;
-            }
-            .footer {
-                margin-top: 30px;
-                padding-top: 20px;
-                border-top: 1px solid #ddd;
-                font-size: 12px;
-                color: #666;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h1>Password Reset Request</h1>
-            <p>Secure Your Account</p>
-        </div>
-        <div class="content">
+    'body': extend_layout(BASE_LAYOUT_KEY, {
+        'title': 'Password Reset Request',
+        'styles': '{% include "button_styles" %}{% include "warning_styles" %}',
+        'heading': 'Password Reset Request',
+        'subheading': 'Secure Your Account',
+        'content': '''
             <h2>Hello {{name}},</h2>
             <p>We received a request to reset your password. Click the button below to proceed:</p>
-            
-            <div style="text-align: center;">
-                <a href="{{reset_link}}" class="button">Reset Password</a>
-            </div>
-            
-            <p>If the button doesn't work, you can copy and paste this link into your browser:</p>
-            <p style="word-break: break-all; background: #f0f0f0; padding: 10px; border-radius: 5px;">
-                {{reset_link}}
-            </p>
+            ''' + button('{{reset_link}}', 'Reset Password') + '''
+            ''' + link_fallback('{{reset_link}}') + '''
             
             <div class="warning">
                 <strong>Security Notice:</strong> This link will expire in {{expiry_hours}} hour(s). If you didn't request this password reset, please ignore this email and ensure your account is secure.
-            </div>
-        </div>
-        <div class="footer">
-            <p>This email was sent by Our Service. Please do not reply to this email.</p>
-            <p>If you have any questions, please contact our support team.</p>
-        </div>
-    </body>
-    </html>
-    '''
+            </div>'''
+    })
 }
 
 access_key_email = {
     'subject': 'Your Access Key - {{service_name}}',
-    'body': '''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <title>Access Key Generated</title>
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                line-height: 1.6;
-                color: #333;
-                max-width: 600px;
-                margin: 0 auto;
-                padding: 20px;
-            }
-            .header {
-                background: linear-gradient(135deg, #E4405F 0%, #833AB4 100%);
-                color: white;
-                padding: 30px;
-                text-align: center;
-                border-radius: 10px 10px 0 0;
-            }
-            .content {
-                background: #f9f9f9;
-                padding: 30px;
-                border-radius: 0 0 10px 10px;
-            }
+    'body': extend_layout(BASE_LAYOUT_KEY, {
+        'title': 'Access Key Generated',
+        'styles': '''
             .key-box {
                 background: #f8f9fa;
                 border: 2px solid #dee2e6;
@@ -288,30 +82,10 @@ access_key_email = {
                 font-size: 18px;
                 font-weight: bold;
                 color: #495057;
-            }
-            .warning {
-                background: #fff3cd;
-                border: 1px solid #ffeaa7;
-                color: #856404;
-                padding: 15px;
-                border-radius: 5px;
-                margin: 20px 0;
-            }
-            .footer {
-                margin-top: 30px;
-                padding-top: 20px;
-                border-top: 1px solid #ddd;
-                font-size: 12px;
-                color: #666;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h1>Access Key Generated</h1>
-            <p>{{service_name}}</p>
-        </div>
-        <div class="content">
+            }{% include "warning_styles" %}''',
+        'heading': 'Access Key Generated',
+        'subheading': '{{service_name}}',
+        'content': '''
             <h2>Hello {{name}},</h2>
             <p>Your access key for <strong>{{service_name}}</strong> has been generated successfully.</p>
             
@@ -330,46 +104,15 @@ access_key_email = {
                 <strong>Important:</strong> Keep this access key secure and do not share it with anyone. This key will expire in {{expiry_hours}} hour(s).
             </div>
             
-            <p>Use this key to authenticate with our API or access the service.</p>
-        </div>
-        <div class="footer">
-            <p>This email was sent by Our Service. Please do not reply to this email.</p>
-            <p>If you have any questions, please contact our support team.</p>
-        </div>
-    </body>
-    </html>
-    '''
+            <p>Use this key to authenticate with our API or access the service.</p>'''
+    })
 }
 
 invoice_email = {
     'subject': 'Invoice #{{invoice_number}} - {{company_name}}',
-    'body': '''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <title>Invoice #{{invoice_number}}</title>
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                line-height: 1.6;
-                color: #333;
-                max-width: 600px;
-                margin: 0 auto;
-                padding: 20px;
-            }
-            .header {
-                background: linear-gradient(135deg, #E4405F 0%, #833AB4 100%);
-                color: white;
-                padding: 30px;
-                text-align: center;
-                border-radius: 10px 10px 0 0;
-            }
-            .content {
-                background: #f9f9f9;
-                padding: 30px;
-                border-radius: 0 0 10px 10px;
-            }
+    'body': extend_layout(BASE_LAYOUT_KEY, {
+        'title': 'Invoice #{{invoice_number}}',
+        'styles': '''
             .invoice-details {
                 background: white;
                 border: 1px solid #ddd;
@@ -385,31 +128,19 @@ invoice_email = {
                 margin: 20px 0;
                 text-align: center;
             }
-            .button {
-                display: inline-block;
-                background: linear-gradient(135deg, #E4405F 0%, #833AB4 100%);
-                color: white;
-                padding: 15px 30px;
-                text-decoration: none;
-                border-radius: 5px;
-                font-weight: bold;
+            .line-items {
+                width: 100%;
+                border-collapse: collapse;
                 margin: 20px 0;
             }
-            .footer {
-                margin-top: 30px;
-                padding-top: 20px;
-                border-top: 1px solid #ddd;
-                font-size: 12px;
-                color: #666;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h1>Invoice</h1>
-            <p>{{company_name}}</p>
-        </div>
-        <div class="content">
+            .line-items th, .line-items td {
+                border-bottom: 1px solid #ddd;
+                padding: 8px;
+                text-align: left;
+            }{% include "button_styles" %}''',
+        'heading': 'Invoice',
+        'subheading': '{{company_name}}',
+        'content': '''
             <h2>Invoice #{{invoice_number}}</h2>
             <p>Hello {{customer_name}},</p>
             <p>Thank you for your business. Please find your invoice attached below.</p>
@@ -422,25 +153,27 @@ invoice_email = {
                 <p><strong>Email:</strong> {{customer_email}}</p>
             </div>
             
+            {% if items %}
+            <table class="line-items">
+                <tr><th>Item</th><th>Qty</th><th>Price</th></tr>
+                {% for item in items %}
+                <tr><td>{{item.name}}</td><td>{{item.quantity|default(1)}}</td><td>${{item.price}}</td></tr>
+                {% endfor %}
+            </table>
+            {% endif %}
+            
             <div class="total-box">
                 <h3>Total Amount Due</h3>
                 <h2 style="color: #2196f3; margin: 10px 0;">${{total_amount}}</h2>
             </div>
-            
-            <div style="text-align: center;">
-                <a href="{{payment_link}}" class="button">Pay Now</a>
-            </div>
+            ''' + button('{{payment_link}}', 'Pay Now') + '''
             
             <p><strong>Payment Terms:</strong> {{payment_terms}}</p>
-            <p><strong>Notes:</strong> {{notes}}</p>
-        </div>
-        <div class="footer">
+            <p><strong>Notes:</strong> {{notes}}</p>''',
+        'footer': '''
             <p>This email was sent by {{company_name}}. Please do not reply to this email.</p>
-            <p>If you have any questions, please contact our billing team.</p>
-        </div>
-    </body>
-    </html>
-    '''
+            <p>If you have any questions, please contact our billing team.</p>'''
+    })
 }
 
 # Main template mapping
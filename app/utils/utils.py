@@ -1,5 +1,9 @@
+import math
+import time
+from datetime import datetime, timezone
 from flask import jsonify
-from ..templates.templates import TEMPLATE_MAP, TEMPLATE_VARIABLES, VALID_EMAIL_TYPES, is_valid_email_type
+from ..templates.templates import TEMPLATE_VARIABLES, VALID_EMAIL_TYPES, is_valid_email_type
+from ..templates.engine import get_compiled_source
 
 def validate_email_request(data):
     """Validate email request data and return errors if any"""
@@ -8,6 +12,9 @@ def validate_email_request(data):
     if not data:
         errors.append("No data provided")
         return errors
+    if not isinstance(data, dict):
+        errors.append("Request body must be a JSON object")
+        return errors
     
     receiver_email = data.get('receiver_email')
     email_type = data.get('email_type')
@@ -25,7 +32,9 @@ def validate_email_request(data):
     elif not is_valid_email_type(email_type):
         errors.append(f"Email type '{email_type}' is not valid. Valid types: {VALID_EMAIL_TYPES}")
     
-    if email_type in TEMPLATE_VARIABLES:
+    if not isinstance(variables, dict):
+        errors.append("Variables must be an object")
+    elif isinstance(email_type, str) and email_type in TEMPLATE_VARIABLES:
         required_vars = TEMPLATE_VARIABLES[email_type]
         missing_vars = []
         for var in required_vars:
@@ -35,25 +44,84 @@ def validate_email_request(data):
         if missing_vars:
             errors.append(f"Missing required variables for email type '{email_type}': {missing_vars}")
     
+    time_errors = [validate_timestamp(data.get(field), field) for field in ('send_at', 'expires_at')]
+    errors.extend(error for error in time_errors if error)
+    if not any(time_errors):
+        deadline_error = validate_deadline(data)
+        if deadline_error:
+            errors.append(deadline_error)
+    
     return errors
 
+def parse_timestamp(value, field='send_at'):
+    """Unix timestamp for a time field (send_at, expires_at): an ISO 8601 string (UTC unless it has an offset) or seconds since the epoch"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{field} must be an ISO 8601 time or a Unix timestamp")
+    if not isinstance(value, (int, float, str)):
+        raise ValueError(f"{field} must be an ISO 8601 time or a Unix timestamp")
+    try:
+        timestamp = float(value)
+    except ValueError:
+        pass
+    else:
+        if not math.isfinite(timestamp):
+            raise ValueError(f"{field} must be a finite timestamp")
+        return timestamp
+    text = value.strip()
+    if text.endswith(('Z', 'z')):
+        text = text[:-1] + '+00:00'
+    try:
+        moment = datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"{field} '{value}' is not an ISO 8601 time or a Unix timestamp")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def validate_timestamp(value, field='send_at'):
+    """Error message for an unusable time field value, or None"""
+    try:
+        parse_timestamp(value, field)
+    except (ValueError, OverflowError) as e:
+        return str(e)
+    return None
+
+def validate_deadline(data):
+    """Error message for an expires_at that has already passed or is not after send_at, or None"""
+    expires_at = parse_timestamp(data.get('expires_at'), 'expires_at')
+    if expires_at is None:
+        return None
+    if expires_at <= time.time():
+        return "expires_at is in the past"
+    send_at = parse_timestamp(data.get('send_at'))
+    if send_at is not None and expires_at <= send_at:
+        return "expires_at must be after send_at"
+    return None
+
+def delivery_deadline(email_type, variables, expires_at=None, send_at=None):
+    """Time after which an email is no longer worth sending, or None.
+    
+    An explicit expires_at wins. Otherwise templates with an expiry_hours
+    variable (confirmation, password reset and access key emails) expire that
+    many hours after the email is due: now, or send_at when scheduled.
+    """
+    if expires_at is not None:
+        return expires_at
+    if 'expiry_hours' not in TEMPLATE_VARIABLES.get(email_type, ()):
+        return None
+    try:
+        hours = float((variables or {}).get('expiry_hours'))
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(hours) or hours <= 0:
+        return None
+    return max(time.time(), send_at or 0) + hours * 3600
+
 def render_template(template_body, variables):
     """Render email template with placeholder variables"""
-    rendered = template_body
-    
-    for key, value in variables.items():
-        if isinstance(value, str):
-            rendered = rendered.replace(f'{{{{{key}}}}}', value)
-        elif isinstance(value, (int, float)):
-            rendered = rendered.replace(f'{{{{{key}}}}}', str(value))
-        elif isinstance(value, list):
-            if key == 'items':
-                items_html = ''
-                for item in value:
-                    items_html += f'<li>{item.get("name", "")} - ${item.get("price", "")}</li>'
-                rendered = rendered.replace('{% for item in items %}\n                <li>{{item.name}} - ${{item.price}}</li>\n                {% endfor %}', items_html)
-    
-    return rendered
+    return get_compiled_source(template_body).render(variables)
 
 def create_success_response(message, email_type, subject):
     """Create standardized success response"""
@@ -64,6 +132,59 @@ def create_success_response(message, email_type, subject):
         'subject': subject
     }), 200
 
+def create_accepted_response(message, email_type, subject, job_id, send_at=None):
+    """Create standardized response for an email queued (or with send_at, scheduled) for delivery"""
+    response = {
+        'success': True,
+        'message': message,
+        'email_type': email_type,
+        'subject': subject,
+        'job_id': job_id,
+        'status': 'scheduled' if send_at is not None else 'queued'
+    }
+    if send_at is not None:
+        response['send_at'] = send_at
+    return jsonify(response), 202
+
+def create_batch_response(results, succeeded, queued=False):
+    """Create standardized response for a batch send with per-item results"""
+    return jsonify({
+        'success': succeeded == len(results),
+        'total': len(results),
+        'queued' if queued else 'sent': succeeded,
+        'failed': len(results) - succeeded,
+        'results': results
+    }), 200
+
+def validate_batch_request(data, max_size):
+    """Validate the envelope of a batch request and return errors if any"""
+    errors = []
+    
+    if not data:
+        errors.append("No data provided")
+        return errors
+    if not isinstance(data, dict):
+        errors.append("Request body must be a JSON object")
+        return errors
+    
+    items = data.get('items')
+    if not data.get('sender_email'):
+        errors.append("Sender email is required")
+    
+    if not isinstance(items, list) or not items:
+        errors.append("Items must be a non-empty list")
+    elif len(items) > max_size:
+        errors.append(f"Batch contains {len(items)} items; the maximum is {max_size}")
+    
+    time_errors = [validate_timestamp(data.get(field), field) for field in ('send_at', 'expires_at')]
+    errors.extend(error for error in time_errors if error)
+    if not any(time_errors):
+        deadline_error = validate_deadline(data)
+        if deadline_error:
+            errors.append(deadline_error)
+    
+    return errors
+
 def create_error_response(message, status_code=400):
     """Create standardized error response"""
     return jsonify({'error': message}), status_code
@@ -84,3 +205,14 @@ def validate_api_key(request):
         return False, "Invalid API key"
     
     return True, None
+
+def get_redis_client(config, **kwargs):
+    """Create a Redis client from the application config (redis is imported lazily)"""
+    import redis
+    return redis.Redis(
+        host=config['REDIS_HOST'],
+        port=config['REDIS_PORT'],
+        db=config['REDIS_DB'],
+        password=config['REDIS_PASSWORD'],
+        **kwargs
+    )
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Delivery worker process for the Redis Streams queue.
+
+Usage:
+    python -m app.worker [--concurrency N]
+
+Each worker process joins the consumer group, delivers entries through its
+own EmailService (and SMTP pool or other MAIL_BACKEND transport), and
+periodically reclaims entries that a crashed worker left unacknowledged.
+Transient failures are retried with backoff; entries that cannot be
+delivered go to the dead-letter store, and entries past their deadline are
+expired without being sent. Scheduled emails are released onto the stream
+once their send time comes. Scale delivery by starting more workers.
+"""
+
+import argparse
+import signal
+import threading
+import time
+from flask import Flask
+from flask_mail import Mail
+from config.config import Config
+from .services.email_service import EmailService
+from .services.transports import create_transport
+from .services.redis_queue import RedisStreamQueue
+from .services.retry import RetryBudget, RetryPolicy
+from .services.dead_letters import create_dead_letter_store
+from .services.metrics import DELIVERY_RETRIES_TOTAL
+from .utils.utils import get_redis_client
+
+
+class Worker:
+    def __init__(self, delivery_queue, email_service, concurrency=4, claim_idle=60, batch_size=10,
+                 release_rate=100):
+        self.queue = delivery_queue
+        self.email_service = email_service
+        self.concurrency = concurrency
+        self.claim_idle_ms = claim_idle * 1000
+        self.reclaim_interval = max(1, claim_idle // 2)
+        self.batch_size = batch_size
+        self.release_rate = release_rate
+        self._stop = threading.Event()
+
+    def stop(self, *args):
+        """Finish in-flight entries and exit"""
+        self._stop.set()
+
+    def run(self):
+        """Run consumer threads and the reclaim loop until stopped"""
+        self.queue.ensure_group()
+        threads = [
+            threading.Thread(target=self._consume_loop, name=f"consumer-{index}")
+            for index in range(self.concurrency)
+        ]
+        threads.append(threading.Thread(target=self._reclaim_loop, name="reclaimer"))
+        threads.append(threading.Thread(target=self._promote_loop, name="delivery-timer"))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.email_service.close()
+
+    def _consume_loop(self):
+        consumer = RedisStreamQueue.new_consumer_name()
+        while not self._stop.is_set():
+            try:
+                entries = self.queue.consume(consumer, count=self.batch_size, block_ms=1000)
+            except Exception as e:
+                print(f"⚠️ Failed to read from the delivery stream: {e}")
+                self._stop.wait(1)
+                continue
+            for entry in entries:
+                self._process(*entry)
+
+    def _reclaim_loop(self):
+        consumer = RedisStreamQueue.new_consumer_name()
+        while not self._stop.wait(self.reclaim_interval):
+            try:
+                entries = self.queue.reclaim(consumer, self.claim_idle_ms)
+            except Exception as e:
+                print(f"⚠️ Failed to reclaim pending deliveries: {e}")
+                continue
+            if entries:
+                print(f"♻️ Reclaimed {len(entries)} unacknowledged deliveries")
+            for entry in entries:
+                if self._stop.is_set():
+                    break
+                self._process(*entry)
+
+    def _promote_loop(self):
+        # Scheduled emails are released ten times a second, a tenth of release_rate each time,
+        # so a large batch scheduled for the same time goes out smoothly
+        step = max(1, int(self.release_rate // 10))
+        tick = 0
+        while not self._stop.wait(0.1):
+            tick += 1
+            if tick % 10 == 0:
+                try:
+                    self.queue.promote_due()
+                except Exception as e:
+                    print(f"⚠️ Failed to requeue deliveries due for a retry: {e}")
+            try:
+                self.queue.release_scheduled(step)
+            except Exception as e:
+                print(f"⚠️ Failed to release scheduled deliveries: {e}")
+
+    def _process(self, entry_id, job_id, envelope, lane=None, expires_at=None):
+        """Deliver one entry, deferring it for a retry or dead-lettering it when delivery fails"""
+        if expires_at is not None and time.time() >= expires_at:
+            self._expire(entry_id, job_id, envelope, lane)
+            return
+        try:
+            attempts = self.queue.mark_sending(job_id)
+        except Exception as e:
+            # Left pending; another pass will reclaim it once Redis is reachable
+            print(f"⚠️ Failed to update job {job_id}: {e}")
+            return
+        policy = self.email_service.retry_policy
+        if policy is not None and attempts == 1:
+            policy.begin()
+        error = None
+        try:
+            self.email_service.deliver_envelope(envelope)
+        except Exception as e:
+            error = e
+        try:
+            if error is None:
+                self.queue.complete(entry_id, job_id, lane=lane)
+                return
+            delay = policy.next_delay(error, attempts) if policy is not None else None
+            if delay is not None and expires_at is not None and time.time() + delay >= expires_at:
+                # The retry would come after the deadline
+                self._expire(entry_id, job_id, envelope, lane, attempts)
+                return
+            if delay is not None:
+                self.queue.defer(entry_id, job_id, envelope, delay, str(error), lane, expires_at)
+                DELIVERY_RETRIES_TOTAL.inc('queued')
+                return
+            self.queue.complete(entry_id, job_id, error=str(error), lane=lane)
+        except Exception as e:
+            # Not acknowledged: it will be reclaimed (and possibly delivered again)
+            print(f"⚠️ Failed to acknowledge job {job_id}: {e}")
+            return
+        job = self.queue.get_job(job_id)
+        self.email_service.record_failure(
+            job_id, envelope, error, attempts,
+            job.email_type if job else None, job.receiver_email if job else None, job.subject if job else None
+        )
+
+    def _expire(self, entry_id, job_id, envelope, lane, attempts=0):
+        try:
+            self.queue.expire(entry_id, job_id, lane)
+        except Exception as e:
+            print(f"⚠️ Failed to acknowledge job {job_id}: {e}")
+            return
+        job = self.queue.get_job(job_id)
+        self.email_service.record_expired(
+            job_id, envelope, attempts,
+            job.email_type if job else None, job.receiver_email if job else None, job.subject if job else None
+        )
+
+
+def create_worker(concurrency=None):
+    """Build a worker with its own Flask-Mail state, mail transport and Redis client"""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+
+    mail = Mail(app)
+    redis_client = get_redis_client(app.config)
+    email_service = EmailService(
+        mail,
+        create_transport(app.config, mail),
+        retry_policy=RetryPolicy.from_config(app.config, RetryBudget.from_config(app.config)),
+        dead_letters=create_dead_letter_store(app.config, redis_client),
+        expired_action=app.config['EXPIRED_EMAIL_ACTION']
+    )
+    delivery_queue = RedisStreamQueue.from_config(redis_client, app.config)
+
+    return Worker(
+        delivery_queue,
+        email_service,
+        concurrency=concurrency or app.config['WORKER_CONCURRENCY'],
+        claim_idle=app.config['REDIS_QUEUE_CLAIM_IDLE'],
+        # With several lanes, read one entry at a time so every pick follows lane priority
+        batch_size=1 if len(delivery_queue.router.lanes) > 1 else 10,
+        release_rate=app.config['SCHEDULE_RELEASE_RATE']
+    )
+
+
+def main():
+    """Worker entry point"""
+    parser = argparse.ArgumentParser(description="Email delivery worker for the Redis Streams queue")
+    parser.add_argument('--concurrency', type=int, help='delivery threads (default: WORKER_CONCURRENCY)')
+    args = parser.parse_args()
+
+    worker = create_worker(args.concurrency)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+
+    print(f"🚚 Delivery worker consuming '{worker.queue.stream}' as group '{worker.queue.group}' "
+          f"with {worker.concurrency} threads")
+    worker.run()
+    print("👋 Delivery worker stopped")
+
+
+if __name__ == '__main__':
+    main()
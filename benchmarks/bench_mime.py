@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark message construction: Flask-Mail's MIME tree against the pre-encoded builder
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_mail import Mail, Message
+from app.templates.engine import get_compiled_template
+from app.services.mime_builder import MessageBuilder
+from bench_render import SAMPLE_VARIABLES
+
+ITERATIONS = 5000
+SENDER = 'Example Services <billing@example.com>'
+RECEIVER = 'customer@example.com'
+
+
+def cpu_per_message(build):
+    """CPU microseconds per call of build()"""
+    build()
+    start = time.process_time()
+    for _ in range(ITERATIONS):
+        build()
+    return (time.process_time() - start) / ITERATIONS * 1e6
+
+
+def bench(app, builder, email_type, variables):
+    """Compare building one message (render + encode) both ways"""
+    compiled = get_compiled_template(email_type)
+
+    def flask_mail():
+        msg = Message(
+            subject=compiled['subject'].render(variables),
+            recipients=[RECEIVER],
+            html=compiled['body'].render(variables),
+            sender=SENDER
+        )
+        return msg.as_bytes()
+
+    def fast():
+        subject = compiled['subject'].render(variables)
+        return builder.build(email_type, variables, subject, SENDER, RECEIVER)[2]
+
+    with app.app_context():
+        flask_us = cpu_per_message(flask_mail)
+        flask_size = len(flask_mail())
+    fast_us = cpu_per_message(fast)
+    fast_size = len(fast())
+
+    print(f"{email_type:<16} flask_mail={flask_us:8.1f}us ({flask_size}B)  "
+          f"builder={fast_us:7.1f}us ({fast_size}B)  speedup={flask_us / fast_us:5.1f}x")
+
+
+def main():
+    """Run the message construction benchmark"""
+    app = Flask(__name__)
+    Mail(app)
+    builder = MessageBuilder()
+
+    print("=" * 60)
+    print(f"MESSAGE CONSTRUCTION BENCHMARK (CPU per message, {ITERATIONS} messages)")
+    print("=" * 60)
+    for email_type, variables in SAMPLE_VARIABLES.items():
+        bench(app, builder, email_type, variables)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark the precompiled template engine against the original str.replace renderer
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.templates.templates import TEMPLATE_MAP
+from app.templates.engine import compile_template, get_compiled_template
+
+ITERATIONS = 20000
+
+SAMPLE_VARIABLES = {
+    'welcome_email': {
+        'name': 'Alice Smith',
+        'email': 'alice@example.com',
+        'login_url': 'https://example.com/login'
+    },
+    'invoice_email': {
+        'customer_name': 'Acme Corp',
+        'customer_email': 'billing@acme.com',
+        'invoice_number': 'INV-2024-001',
+        'invoice_date': '2024-01-15',
+        'due_date': '2024-02-15',
+        'total_amount': '1,250.00',
+        'company_name': 'Example Services Inc.',
+        'payment_link': 'https://example.com/pay/INV-2024-001',
+        'payment_terms': 'Net 30',
+        'notes': 'Thank you for your business!'
+    }
+}
+
+
+def legacy_render_template(template_body, variables):
+    """The original per-variable str.replace renderer, kept as the baseline"""
+    rendered = template_body
+
+    for key, value in variables.items():
+        if isinstance(value, str):
+            rendered = rendered.replace(f'{{{{{key}}}}}', value)
+        elif isinstance(value, (int, float)):
+            rendered = rendered.replace(f'{{{{{key}}}}}', str(value))
+        elif isinstance(value, list):
+            if key == 'items':
+                items_html = ''
+                for item in value:
+                    items_html += f'<li>{item.get("name", "")} - ${item.get("price", "")}</li>'
+                rendered = rendered.replace(LEGACY_ITEMS_BLOCK, items_html)
+
+    return rendered
+
+
+def bench(email_type, variables):
+    """Time subject + body rendering with both implementations"""
+    template = TEMPLATE_MAP[email_type]
+    compiled = get_compiled_template(email_type)
+
+    def legacy():
+        legacy_render_template(template['subject'], variables)
+        legacy_render_template(template['body'], variables)
+
+    def engine():
+        compiled['subject'].render(variables)
+        compiled['body'].render(variables)
+
+    if '{%' not in template['body']:
+        # The legacy renderer leaves {% if %} blocks untouched, so only compare plain templates
+        assert legacy_render_template(template['body'], variables) == compiled['body'].render(variables)
+
+    legacy_time = min(timeit.repeat(legacy, number=ITERATIONS, repeat=3))
+    engine_time = min(timeit.repeat(engine, number=ITERATIONS, repeat=3))
+
+    legacy_us = legacy_time / ITERATIONS * 1e6
+    engine_us = engine_time / ITERATIONS * 1e6
+    print(f"{email_type:<16} body={len(template['body']):>5}B vars={len(variables):>2}  "
+          f"legacy={legacy_us:7.2f}us  engine={engine_us:7.2f}us  speedup={legacy_us / engine_us:5.2f}x")
+
+
+LEGACY_ITEMS_BLOCK = '{% for item in items %}\n                <li>{{item.name}} - ${{item.price}}</li>\n                {% endfor %}'
+
+LINE_ITEM_COUNTS = (10, 100, 1000)
+
+
+def bench_line_items(count):
+    """Time an invoice-style items loop of the given length"""
+    source = '<ul>' + LEGACY_ITEMS_BLOCK + '</ul>'
+    compiled = compile_template(source)
+    variables = {'items': [{'name': f'Item {index}', 'price': f'{index}.00'} for index in range(count)]}
+    number = max(10, ITERATIONS // count // 10)
+
+    legacy_time = min(timeit.repeat(lambda: legacy_render_template(source, variables), number=number, repeat=3))
+    engine_time = min(timeit.repeat(lambda: compiled.render(variables), number=number, repeat=3))
+
+    legacy_us = legacy_time / number * 1e6
+    engine_us = engine_time / number * 1e6
+    print(f"items loop x{count:<5}  legacy={legacy_us:9.1f}us  engine={engine_us:9.1f}us  "
+          f"engine/item={engine_us / count:5.2f}us")
+
+
+def main():
+    """Run the render benchmark"""
+    print("=" * 60)
+    print(f"TEMPLATE RENDER BENCHMARK ({ITERATIONS} renders per run)")
+    print("=" * 60)
+    for email_type, variables in SAMPLE_VARIABLES.items():
+        bench(email_type, variables)
+    for count in LINE_ITEM_COUNTS:
+        bench_line_items(count)
+
+
+if __name__ == '__main__':
+    main()
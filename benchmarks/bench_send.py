@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+End-to-end send benchmark against a local SMTP sink.
+
+Usage:
+    python benchmarks/bench_send.py [--messages 2000] [--concurrency 1 8 32]
+                                    [--stages build send batch http http_async]
+                                    [--smtp-latency-ms 0] [--mail-backend smtp]
+                                    [--output results.json]
+                                    [--compare previous.json]
+
+Starts benchmarks/smtp_sink.py in-process, points the server's SMTP
+settings at it and drives each stage at every concurrency level:
+
+    build        EmailService.build_envelope (render + MIME, no network)
+    send         EmailService.send_email over the SMTP pool
+    batch        EmailService.send_batch, --batch-size emails per call
+    http         POST /send-email over HTTP, delivered inline
+    http_async   POST /send-email with ASYNC_SEND; timed until the sink has every message
+
+With --mail-backend memory or null the SMTP leg is replaced by an
+in-process transport, isolating the service's own overhead.
+
+Each stage reports throughput, p50/p95/p99 latency per call and CPU per
+message. The sink's own CPU is measured separately and subtracted; the
+HTTP stages include the client's CPU, since it runs in the same process. Results
+are written as JSON (benchmarks/results/ by default) so runs can be compared
+across releases with --compare.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smtp_sink import SMTPSink
+from bench_render import SAMPLE_VARIABLES
+
+STAGES = ('build', 'send', 'batch', 'http', 'http_async')
+SENDER_NAME = 'Benchmark'
+SENDER_EMAIL = 'bench@example.com'
+API_KEY = 'bench-api-key'
+
+
+def configure(sink, args):
+    """Point the application config at the sink before the app is imported"""
+    from config.config import Config
+    Config.MAIL_SERVER = sink.host
+    Config.MAIL_PORT = sink.port
+    Config.MAIL_USE_TLS = False
+    Config.MAIL_USE_SSL = False
+    Config.MAIL_USERNAME = None
+    Config.MAIL_PASSWORD = None
+    # validate_api_key reads the key from the environment
+    os.environ['API_KEY'] = Config.API_KEY = API_KEY
+    Config.RATE_LIMIT = 10 ** 9
+    Config.ASYNC_SEND = False
+    Config.QUEUE_BACKEND = 'memory'
+    Config.MAIL_BACKEND = args.mail_backend
+    Config.SMTP_POOL_SIZE = args.pool_size
+    Config.DELIVERY_WORKERS = args.pool_size
+    Config.DELIVERY_QUEUE_SIZE = max(Config.DELIVERY_QUEUE_SIZE, args.messages)
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def status_of(response):
+    """HTTP status of a Flask view return value"""
+    if isinstance(response, tuple):
+        return response[1]
+    return response.status_code
+
+
+class Stage:
+    """Drive one operation from several threads and collect per-call latencies"""
+
+    def __init__(self, name, calls, concurrency, per_call=1):
+        self.name = name
+        self.calls = calls
+        self.concurrency = concurrency
+        self.per_call = per_call
+        self.latencies = []
+        self.errors = 0
+        self.first_error = None
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def _claim(self):
+        with self._lock:
+            if self._next >= self.calls:
+                return None
+            self._next += 1
+            return self._next - 1
+
+    def _worker(self, operation, setup):
+        state = setup() if setup else None
+        latencies = []
+        errors = 0
+        first_error = None
+        while True:
+            index = self._claim()
+            if index is None:
+                break
+            start = time.perf_counter()
+            try:
+                error = operation(index, state)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            latencies.append(time.perf_counter() - start)
+            if error:
+                errors += 1
+                first_error = first_error or error
+        with self._lock:
+            self.latencies.extend(latencies)
+            self.errors += errors
+            self.first_error = self.first_error or first_error
+
+    def run(self, operation, sink, setup=None, delivered=None):
+        """Run every call and return the result dict for this stage.
+
+        With delivered (a callable returning the number of messages delivered
+        so far), timing continues until every accepted message has arrived.
+        """
+        threads = [threading.Thread(target=self._worker, args=(operation, setup))
+                   for _ in range(self.concurrency)]
+        messages = self.calls * self.per_call
+        received = sink.stats()
+        delivered_before = delivered() if delivered else 0
+        cpu = time.process_time()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        complete = True
+        if delivered:
+            expected = delivered_before + messages - self.errors * self.per_call
+            deadline = time.monotonic() + 60
+            while delivered() < expected and time.monotonic() < deadline:
+                time.sleep(0.001)
+            complete = delivered() >= expected
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu - (sink.stats()['cpu_seconds'] - received['cpu_seconds'])
+
+        ordered = sorted(self.latencies)
+        result = {
+            'stage': self.name,
+            'concurrency': self.concurrency,
+            'calls': self.calls,
+            'messages': messages,
+            'errors': self.errors,
+            'seconds': round(elapsed, 4),
+            'messages_per_second': round(messages / elapsed, 1),
+            'latency_ms': {
+                'p50': round(percentile(ordered, 0.50) * 1000, 3),
+                'p95': round(percentile(ordered, 0.95) * 1000, 3),
+                'p99': round(percentile(ordered, 0.99) * 1000, 3),
+                'max': round(ordered[-1] * 1000, 3) if ordered else 0.0
+            },
+            'cpu_ms_per_message': round(cpu * 1000 / messages, 4)
+        }
+        if self.first_error:
+            result['first_error'] = self.first_error
+        if not complete:
+            result['first_error'] = result.get('first_error') or 'not every message was delivered in time'
+        return result
+
+
+def variables_for(email_type, index):
+    """Sample variables made unique per message so every render is a cache miss"""
+    variables = dict(SAMPLE_VARIABLES[email_type])
+    for key in ('name', 'customer_name'):
+        if key in variables:
+            variables[key] = f'Recipient {index}'
+    return variables
+
+
+def start_http_server(app):
+    """Serve the app over HTTP on a free local port in a background thread"""
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-http', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def run_stages(args, sink):
+    """Run every selected stage at every concurrency level"""
+    import requests
+    from app.app import app, email_service, transport
+
+    email_type = args.email_type
+    results = []
+    server = base_url = None
+    if {'http', 'http_async'} & set(args.stages):
+        server, base_url = start_http_server(app)
+
+    def with_context():
+        context = app.app_context()
+        context.push()
+        return context
+
+    def build(index, _):
+        envelope, _, error = email_service.build_envelope(
+            f'user{index}@example.com', email_type, variables_for(email_type, index), SENDER_NAME, SENDER_EMAIL)
+        return error
+
+    def send(index, _):
+        response = email_service.send_email(
+            f'user{index}@example.com', email_type, variables_for(email_type, index), SENDER_NAME, SENDER_EMAIL)
+        return None if status_of(response) == 200 else response[0].get_json().get('error')
+
+    def batch(index, _):
+        first = index * args.batch_size
+        items = [{'receiver_email': f'user{n}@example.com', 'email_type': email_type,
+                  'variables': variables_for(email_type, n)} for n in range(first, first + args.batch_size)]
+        response, status = email_service.send_batch(items, SENDER_NAME, SENDER_EMAIL)
+        body = response.get_json()
+        return None if status == 200 and body.get('failed') == 0 else str(body)[:200]
+
+    def http(index, session):
+        response = session.post(f'{base_url}/send-email', headers={'X-API-Key': API_KEY}, json={
+            'receiver_email': f'user{index}@example.com',
+            'email_type': email_type,
+            'variables': variables_for(email_type, index),
+            'sender_name': SENDER_NAME,
+            'sender_email': SENDER_EMAIL
+        })
+        return None if response.status_code in (200, 202) else f'{response.status_code} {response.text[:200]}'
+
+    def delivered():
+        if transport is None or args.mail_backend == 'smtp':
+            return sink.stats()['messages']
+        return transport.stats()['sent']
+
+    operations = {
+        'build': (build, with_context, args.messages, 1, None),
+        'send': (send, with_context, args.messages, 1, None),
+        'batch': (batch, with_context, max(1, args.messages // args.batch_size), args.batch_size, None),
+        'http': (http, requests.Session, args.messages, 1, None),
+        'http_async': (http, requests.Session, args.messages, 1, delivered),
+    }
+
+    try:
+        for name in args.stages:
+            operation, setup, calls, per_call, delivered_count = operations[name]
+            app.config['ASYNC_SEND'] = name == 'http_async'
+            for concurrency in args.concurrency:
+                # Warm up connections, caches and lazily started workers
+                Stage(name, min(calls, concurrency * 2), concurrency, per_call).run(operation, sink, setup, delivered_count)
+                result = Stage(name, calls, concurrency, per_call).run(operation, sink, setup, delivered_count)
+                results.append(result)
+                print_result(result)
+    finally:
+        app.config['ASYNC_SEND'] = False
+        if server is not None:
+            server.shutdown()
+    return results
+
+
+def print_result(result):
+    """One line per stage and concurrency level"""
+    latency = result['latency_ms']
+    line = (f"  {result['stage']:<11} c={result['concurrency']:<4} {result['messages_per_second']:>9.1f} msg/s  "
+            f"p50={latency['p50']:>8.3f}ms  p95={latency['p95']:>8.3f}ms  p99={latency['p99']:>8.3f}ms  "
+            f"cpu={result['cpu_ms_per_message']:.3f}ms/msg")
+    if result['errors'] or 'first_error' in result:
+        line += f"  errors={result['errors']} ({result.get('first_error')})"
+    print(line)
+
+
+def git_revision():
+    """Current commit of the checkout, if available"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(results, path):
+    """Print throughput and p99 changes against a previous results file"""
+    with open(path) as f:
+        previous = json.load(f)
+    baseline = {(r['stage'], r['concurrency']): r for r in previous['results']}
+    print(f"\nCompared with {path} ({previous['meta'].get('revision') or 'unknown revision'}):")
+    compared = 0
+    for result in results:
+        old = baseline.get((result['stage'], result['concurrency']))
+        if old is None:
+            continue
+        compared += 1
+        throughput = (result['messages_per_second'] / old['messages_per_second'] - 1) * 100
+        p99 = result['latency_ms']['p99'] - old['latency_ms']['p99']
+        print(f"  {result['stage']:<11} c={result['concurrency']:<4} throughput {throughput:+6.1f}%  p99 {p99:+8.3f}ms")
+    if not compared:
+        print("  no runs with the same stage and concurrency")
+
+
+def main():
+    """Run the send benchmark"""
+    parser = argparse.ArgumentParser(description="End-to-end send benchmark against a local SMTP sink")
+    parser.add_argument('--messages', type=int, default=2000, help='messages per stage and concurrency level')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=STAGES)
+    parser.add_argument('--email-type', default='welcome_email', choices=sorted(SAMPLE_VARIABLES))
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--pool-size', type=int, default=8, help='SMTP pool size and delivery workers')
+    parser.add_argument('--mail-backend', default='smtp', choices=('smtp', 'memory', 'null'),
+                        help='transport the server delivers through (smtp = the local sink)')
+    parser.add_argument('--smtp-latency-ms', type=float, default=0, help='sink delay before acknowledging a message')
+    parser.add_argument('--output', help='results file (default: benchmarks/results/send-<timestamp>.json)')
+    parser.add_argument('--compare', help='previous results file to compare against')
+    args = parser.parse_args()
+
+    sink = SMTPSink(latency_ms=args.smtp_latency_ms).start()
+    configure(sink, args)
+
+    print("=" * 60)
+    print(f"SEND BENCHMARK (sink {sink.host}:{sink.port}, {args.messages} messages per run)")
+    print("=" * 60)
+    try:
+        results = run_stages(args, sink)
+    finally:
+        sink.stop()
+
+    started = datetime.now(timezone.utc)
+    report = {
+        'meta': {
+            'timestamp': started.isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args)
+        },
+        'results': results
+    }
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                         f"send-{started.strftime('%Y%m%dT%H%M%SZ')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📄 Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Benchmark server cold start: importing app.app and answering the first request
+
+Each run is a fresh interpreter. Point REDIS_HOST at an unreachable address
+(the default is a non-routable one) to check that startup does not wait on Redis.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+from app.app import app
+imported = time.perf_counter()
+status = app.test_client().get('/health').status_code
+answered = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'first_request': answered - start,
+    'status': status,
+    'redis_imported': 'redis' in sys.modules
+}))
+'''
+
+
+def run_once(env):
+    """Start a fresh interpreter and return its timings"""
+    result = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    """Run the cold start benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--redis-host', default='10.255.255.1', help='Redis host the server is configured with')
+    parser.add_argument('--rate-limit-mode', choices=['hybrid', 'redis', 'memory'], default='hybrid')
+    args = parser.parse_args()
+
+    env = dict(os.environ, REDIS_HOST=args.redis_host, RATE_LIMIT_MODE=args.rate_limit_mode)
+    print("=" * 60)
+    print(f"COLD START BENCHMARK (RATE_LIMIT_MODE={args.rate_limit_mode}, REDIS_HOST={args.redis_host})")
+    print("=" * 60)
+
+    runs = [run_once(env) for _ in range(args.runs)]
+    for name in ('import', 'first_request'):
+        values = sorted(run[name] * 1000 for run in runs)
+        print(f"{name:<15} median {statistics.median(values):7.1f} ms   min {values[0]:7.1f} ms   max {values[-1]:7.1f} ms")
+    print(f"first /health status: {runs[-1]['status']}")
+    print(f"redis imported during startup: {any(run['redis_imported'] for run in runs)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Local SMTP sink for benchmarks and tests.
+
+Accepts every message and throws it away, counting messages and bytes. It
+speaks just enough SMTP (HELO/EHLO, MAIL, RCPT, DATA, RSET, NOOP, QUIT) for
+smtplib, without STARTTLS or AUTH, so point the server at it with
+MAIL_USE_TLS=False and no MAIL_USERNAME/MAIL_PASSWORD.
+
+Usage:
+    sink = SMTPSink().start()
+    ... send to sink.host:sink.port ...
+    sink.stop()
+
+Or standalone:
+    python benchmarks/smtp_sink.py [--port 1025] [--latency-ms 0]
+"""
+
+import argparse
+import socketserver
+import threading
+import time
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    """One SMTP connection"""
+
+    def handle(self):
+        sink = self.server.sink
+        self._reply(220, 'sink ESMTP ready')
+        recipients = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'DATA':
+                if not recipients:
+                    self._reply(503, 'Need RCPT')
+                    continue
+                self._reply(354, 'End data with <CR><LF>.<CR><LF>')
+                started = time.thread_time()
+                size = 0
+                for data in self.rfile:
+                    if data in (b'.\r\n', b'.\n'):
+                        break
+                    size += len(data)
+                else:
+                    return
+                if sink.latency:
+                    time.sleep(sink.latency)
+                recipients = 0
+                if sink.reject is not None:
+                    sink._record_rejected()
+                    self._reply(*sink.reject)
+                    continue
+                sink._record(size, time.thread_time() - started)
+                self._reply(250, 'OK queued')
+            elif command == b'EHLO':
+                self.wfile.write(b'250-sink\r\n250-8BITMIME\r\n250-SMTPUTF8\r\n250 SIZE 0\r\n')
+            elif command == b'HELO':
+                self._reply(250, 'sink')
+            elif command == b'MAIL':
+                recipients = 0
+                self._reply(250, 'OK')
+            elif command == b'RCPT':
+                recipients += 1
+                self._reply(250, 'OK')
+            elif command == b'RSET':
+                recipients = 0
+                self._reply(250, 'OK')
+            elif command == b'NOOP':
+                self._reply(250, 'OK')
+            elif command == b'QUIT':
+                self._reply(221, 'Bye')
+                return
+            else:
+                self._reply(502, 'Command not implemented')
+
+    def _reply(self, code, text):
+        self.wfile.write(f'{code} {text}\r\n'.encode('ascii'))
+
+
+class _SinkServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0):
+        self.latency = latency_ms / 1000
+        # (code, text) to answer DATA with instead of accepting, e.g. to simulate a quota error
+        self.reject = None
+        self._server = _SinkServer((host, port), _SinkHandler)
+        self._server.sink = self
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+        self._lock = threading.Lock()
+        self._delivered = threading.Condition(self._lock)
+        self.messages = 0
+        self.bytes = 0
+        self.cpu_seconds = 0.0
+        self.rejected = 0
+
+    def _record(self, size, cpu):
+        with self._lock:
+            self.messages += 1
+            self.bytes += size
+            self.cpu_seconds += cpu
+            self._delivered.notify_all()
+
+    def _record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def start(self):
+        """Serve in a background thread and return self"""
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), name='smtp-sink', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop accepting connections"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def wait_for(self, count, timeout=30):
+        """Block until count messages have been received in total; return whether they were"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self.messages < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._delivered.wait(remaining)
+            return True
+
+    def stats(self):
+        """Messages, bytes, rejections and handler CPU time received so far"""
+        with self._lock:
+            return {'messages': self.messages, 'bytes': self.bytes, 'rejected': self.rejected,
+                    'cpu_seconds': self.cpu_seconds}
+
+
+def main():
+    """Run a sink until interrupted"""
+    parser = argparse.ArgumentParser(description="Local SMTP sink that discards every message")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1025)
+    parser.add_argument('--latency-ms', type=float, default=0, help='delay before acknowledging each message')
+    args = parser.parse_args()
+
+    sink = SMTPSink(args.host, args.port, args.latency_ms).start()
+    print(f"📭 SMTP sink listening on {sink.host}:{sink.port} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(5)
+            stats = sink.stats()
+            print(f"  {stats['messages']} messages, {stats['bytes']} bytes")
+    except KeyboardInterrupt:
+        sink.stop()
+
+
+if __name__ == '__main__':
+    main()
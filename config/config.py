@@ -21,12 +21,130 @@ class Config:
         except Exception as e:
             print(f"Warning: Failed to decode MAIL_PASSWORD from base64: {e}")
     
+    # Mail Transport: 'smtp', 'memory' (ring buffer), 'file' (Maildir/.eml spool) or 'null' (discard)
+    MAIL_BACKEND = os.getenv('MAIL_BACKEND', 'smtp').lower()
+    MAIL_MEMORY_SIZE = int(os.getenv('MAIL_MEMORY_SIZE', '1000'))  # messages kept by the memory backend
+    MAIL_FILE_PATH = os.getenv('MAIL_FILE_PATH', 'data/mail')
+    MAIL_FILE_FORMAT = os.getenv('MAIL_FILE_FORMAT', 'maildir').lower()  # 'maildir' or 'eml'
+    
+    # SMTP Connection Pool (SMTP_POOL_SIZE=0 disables pooling)
+    SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', '4'))
+    SMTP_POOL_IDLE_TIMEOUT = int(os.getenv('SMTP_POOL_IDLE_TIMEOUT', '60'))  # seconds
+    SMTP_POOL_HEALTH_CHECK_INTERVAL = int(os.getenv('SMTP_POOL_HEALTH_CHECK_INTERVAL', '10'))  # seconds idle before NOOP
+    SMTP_TIMEOUT = int(os.getenv('SMTP_TIMEOUT', '30'))  # seconds
+    
+    # Multiple SMTP Accounts/Relays: JSON list of {"name", "username", "password" (base64), "host", "port",
+    # "pool_size", "weight", "daily_limit"}; empty sends through MAIL_USERNAME only
+    SMTP_ACCOUNTS = os.getenv('SMTP_ACCOUNTS', '')
+    SMTP_ACCOUNT_STRATEGY = os.getenv('SMTP_ACCOUNT_STRATEGY', 'weighted').lower()  # 'weighted' or 'least_loaded'
+    SMTP_ACCOUNT_DRAIN_SECONDS = int(os.getenv('SMTP_ACCOUNT_DRAIN_SECONDS', '300'))  # first drain after a quota error
+    
+    # Circuit breaker per SMTP server/account: fail sends at once while it is unreachable or refusing logins
+    SMTP_BREAKER_ENABLED = os.getenv('SMTP_BREAKER_ENABLED', 'True').lower() in ('true', '1', 'yes')
+    SMTP_BREAKER_FAILURE_THRESHOLD = int(os.getenv('SMTP_BREAKER_FAILURE_THRESHOLD', '5'))  # failures in a row to open
+    SMTP_BREAKER_PROBE_INTERVAL = float(os.getenv('SMTP_BREAKER_PROBE_INTERVAL', '30'))  # seconds open before a probe
+    SMTP_BREAKER_OPEN_ACTION = os.getenv('SMTP_BREAKER_OPEN_ACTION', 'queue').lower()  # sync sends: 'queue' or 'fail'
+    
+    # Build messages directly from pre-encoded template segments instead of Flask-Mail's MIME tree
+    FAST_MIME_BUILDER = os.getenv('FAST_MIME_BUILDER', 'True').lower() in ('true', '1', 'yes')
+    
+    # Minify template HTML/CSS once at startup (on by default when FLASK_ENV=production)
+    TEMPLATE_MINIFY = os.getenv(
+        'TEMPLATE_MINIFY', 'True' if os.getenv('FLASK_ENV') == 'production' else 'False'
+    ).lower() in ('true', '1', 'yes')
+    
+    # Rendered Output Cache (RENDER_CACHE_SIZE=0 disables; RENDER_CACHE_REDIS shares renders across processes)
+    RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', '1024'))  # entries
+    RENDER_CACHE_MAX_BYTES = int(os.getenv('RENDER_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))  # UTF-8 encoded bytes
+    RENDER_CACHE_REDIS = os.getenv('RENDER_CACHE_REDIS', 'False').lower() in ('true', '1', 'yes')
+    RENDER_CACHE_REDIS_TTL = int(os.getenv('RENDER_CACHE_REDIS_TTL', '3600'))  # seconds
+    
+    # Asynchronous Delivery (/send-email returns 202 and background workers send)
+    ASYNC_SEND = os.getenv('ASYNC_SEND', 'False').lower() in ('true', '1', 'yes')
+    DELIVERY_WORKERS = int(os.getenv('DELIVERY_WORKERS', '4'))
+    DELIVERY_QUEUE_SIZE = int(os.getenv('DELIVERY_QUEUE_SIZE', '10000'))  # per priority lane
+    DELIVERY_JOB_HISTORY = int(os.getenv('DELIVERY_JOB_HISTORY', '10000'))  # finished jobs kept for status lookups
+    # Priority lanes: JSON list of {"name", "weight", "email_types"}; empty uses transactional/default/bulk
+    DELIVERY_LANES = os.getenv('DELIVERY_LANES', '')
+    DELIVERY_LANE_MAX_WAIT = float(os.getenv('DELIVERY_LANE_MAX_WAIT', '30'))  # seconds before a job is served out of turn
+    # Scheduled sends (send_at): kept on disk until due, then released at most this many per second per process
+    SCHEDULE_PATH = os.getenv('SCHEDULE_PATH', 'data/schedule.db')
+    SCHEDULE_RELEASE_RATE = float(os.getenv('SCHEDULE_RELEASE_RATE', '100'))
+    # Queued emails past their deadline (expires_at, or expiry_hours for links): 'drop' or 'dead_letter'
+    EXPIRED_EMAIL_ACTION = os.getenv('EXPIRED_EMAIL_ACTION', 'drop').lower()
+    
+    # Queue Backend for async sends: 'memory' (in-process workers) or 'redis' (python -m app.worker)
+    QUEUE_BACKEND = os.getenv('QUEUE_BACKEND', 'memory').lower()
+    REDIS_QUEUE_STREAM = os.getenv('REDIS_QUEUE_STREAM', 'email:deliveries')
+    REDIS_QUEUE_GROUP = os.getenv('REDIS_QUEUE_GROUP', 'email-workers')
+    REDIS_QUEUE_MAXLEN = int(os.getenv('REDIS_QUEUE_MAXLEN', '100000'))
+    REDIS_QUEUE_JOB_TTL = int(os.getenv('REDIS_QUEUE_JOB_TTL', '86400'))  # seconds job status is kept
+    REDIS_QUEUE_CLAIM_IDLE = int(os.getenv('REDIS_QUEUE_CLAIM_IDLE', '60'))  # seconds before an unacked entry is reclaimed
+    WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '4'))  # delivery threads per worker process
+    
+    # Durable Outbox (SQLite WAL store written before a send is acknowledged)
+    OUTBOX_ENABLED = os.getenv('OUTBOX_ENABLED', 'False').lower() in ('true', '1', 'yes')
+    OUTBOX_PATH = os.getenv('OUTBOX_PATH', 'data/outbox.db')
+    OUTBOX_RETENTION_HOURS = int(os.getenv('OUTBOX_RETENTION_HOURS', '168'))  # delivered entries kept this long
+    OUTBOX_REPLAY_GRACE = int(os.getenv('OUTBOX_REPLAY_GRACE', '60'))  # seconds before a pending entry is replayed
+    
+    # Retries for transient SMTP failures (4xx replies, connection errors) with jittered exponential backoff
+    RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', os.getenv('REDIS_QUEUE_MAX_ATTEMPTS', '5')))  # queued sends
+    RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '1'))  # seconds; doubles with each attempt
+    RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '300'))  # seconds
+    RETRY_SYNC_ATTEMPTS = int(os.getenv('RETRY_SYNC_ATTEMPTS', '3'))  # inline attempts while the client waits
+    RETRY_SYNC_MAX_DELAY = float(os.getenv('RETRY_SYNC_MAX_DELAY', '2'))  # seconds
+    RETRY_BUDGET_RATIO = float(os.getenv('RETRY_BUDGET_RATIO', '0.2'))  # retries allowed per first attempt
+    RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv('RETRY_BUDGET_MIN_PER_SECOND', '1'))
+    
+    # Dead-Letter Store for permanent failures and exhausted retries (SQLite, or Redis with QUEUE_BACKEND=redis)
+    DEAD_LETTER_ENABLED = os.getenv('DEAD_LETTER_ENABLED', 'True').lower() in ('true', '1', 'yes')
+    DEAD_LETTER_PATH = os.getenv('DEAD_LETTER_PATH', 'data/dead_letters.db')
+    DEAD_LETTER_REDIS_KEY = os.getenv('DEAD_LETTER_REDIS_KEY', 'email:dead-letters')
+    
+    # Idempotency-Key header on /send-email and /send-email/batch ('memory' LRU per process, or 'redis' shared)
+    IDEMPOTENCY_ENABLED = os.getenv('IDEMPOTENCY_ENABLED', 'True').lower() in ('true', '1', 'yes')
+    IDEMPOTENCY_BACKEND = os.getenv('IDEMPOTENCY_BACKEND', 'memory').lower()
+    IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '86400'))  # seconds a response is kept for replays
+    IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', '10000'))  # keys kept by the memory backend
+    IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT', '30'))  # seconds a duplicate waits for the first
+    IDEMPOTENCY_LOCK_TTL = int(os.getenv('IDEMPOTENCY_LOCK_TTL', '120'))  # seconds a crashed request holds a Redis key
+    
+    # Admission control: shed send requests with 503 + Retry-After while this process is overloaded
+    ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'True').lower() in ('true', '1', 'yes')
+    ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', os.getenv('SERVER_THREADS', '8')))  # send requests
+    ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv('ADMISSION_MAX_QUEUE_DEPTH', '2000'))  # emails waiting for delivery
+    ADMISSION_MAX_LATENCY = float(os.getenv('ADMISSION_MAX_LATENCY', '5'))  # seconds per SMTP delivery
+    ADMISSION_MAX_RETRY_AFTER = int(os.getenv('ADMISSION_MAX_RETRY_AFTER', '60'))  # seconds
+    
+    # Batch Sending
+    BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '1000'))  # items per /send-email/batch request
+    
+    # Production Server (gunicorn -c config/gunicorn.conf.py app.app:app)
+    SERVER_BIND = os.getenv('SERVER_BIND', '0.0.0.0:5000')
+    SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', str(os.cpu_count() or 1)))  # processes
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', '8'))  # request threads per process
+    SERVER_TIMEOUT = int(os.getenv('SERVER_TIMEOUT', '60'))  # seconds before a stuck worker is restarted
+    SERVER_GRACEFUL_TIMEOUT = int(os.getenv('SERVER_GRACEFUL_TIMEOUT', '30'))  # seconds to finish work on reload/stop
+    SERVER_MAX_REQUESTS = int(os.getenv('SERVER_MAX_REQUESTS', '0'))  # recycle workers after N requests (0 = never)
+    
+    # Metrics (Prometheus text format at /metrics)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() in ('true', '1', 'yes')
+    
     # API Security
     API_KEY = os.getenv('API_KEY', 'default-api-key-change-in-production')
     
     # Rate Limiting Configuration
     RATE_LIMIT = int(os.getenv('RATE_LIMIT', '10'))  # requests per second
     
+    # 'hybrid' counts locally and syncs with Redis in batches; 'redis' makes a Redis call on every request;
+    # 'memory' counts per process without Redis
+    RATE_LIMIT_MODE = os.getenv('RATE_LIMIT_MODE', 'hybrid').lower()
+    RATE_LIMIT_SYNC_INTERVAL = float(os.getenv('RATE_LIMIT_SYNC_INTERVAL', '0.1'))  # seconds between batched syncs
+    RATE_LIMIT_TOLERANCE = float(os.getenv('RATE_LIMIT_TOLERANCE', '0.1'))  # fraction of the limit left unsynced cluster-wide
+    RATE_LIMIT_RECONNECT_INTERVAL = float(os.getenv('RATE_LIMIT_RECONNECT_INTERVAL', '1'))  # seconds before the first Redis retry (redis mode)
+    RATE_LIMIT_MAX_RECONNECT_INTERVAL = float(os.getenv('RATE_LIMIT_MAX_RECONNECT_INTERVAL', '30'))  # backoff cap
+    
     # Redis Configuration for Rate Limiting
     REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
     REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
@@ -0,0 +1,55 @@
+"""
+Gunicorn configuration for the production server.
+
+Usage:
+    gunicorn -c config/gunicorn.conf.py app.app:app
+
+The master pre-forks SERVER_WORKERS processes, each serving SERVER_THREADS
+requests concurrently. The application is not preloaded: every worker
+imports app.app after it has been forked, so each builds its own SMTP
+pool, outbox writer thread, delivery workers and Redis clients and no
+socket or thread is shared between processes.
+
+Send SIGHUP to the master for a graceful reload: new workers start with
+freshly imported code and configuration, and old workers finish their
+in-flight requests and drain their delivery queue within
+SERVER_GRACEFUL_TIMEOUT seconds.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.config import Config
+
+bind = Config.SERVER_BIND
+workers = Config.SERVER_WORKERS
+threads = Config.SERVER_THREADS
+worker_class = 'gthread'
+timeout = Config.SERVER_TIMEOUT
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+keepalive = 5
+
+# Recycle workers after this many requests (0 disables)
+max_requests = Config.SERVER_MAX_REQUESTS
+max_requests_jitter = max_requests // 10
+
+# Per-process state is created on import, which must happen after fork
+preload_app = False
+
+
+def when_ready(server):
+    print(f"🚀 Email Server listening on {bind} with {workers} workers x {threads} threads")
+    if workers > 1:
+        if Config.ASYNC_SEND and Config.QUEUE_BACKEND != 'redis':
+            print("⚠️ ASYNC_SEND with the memory queue keeps job status per worker; "
+                  "use QUEUE_BACKEND=redis so /jobs/<job_id> works from every worker")
+
+
+def post_fork(server, worker):
+    print(f"👷 Worker {worker.pid} started")
+
+
+def worker_exit(server, worker):
+    print(f"👋 Worker {worker.pid} stopped")
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 """
-Main entry point for the Python Email Server
+Main entry point for the Python Email Server (development server).
+
+In production run the pre-forking server instead:
+    gunicorn -c config/gunicorn.conf.py app.app:app
 """
 
 from app.app import app
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Tests for admission control and load shedding (no running server or SMTP server required)
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.admission import AdmissionController, LatencyTracker
+from app.services.email_service import EmailService
+from app.services.lanes import LaneRouter
+from app.services.transports import MemoryTransport
+from app.utils.utils import validate_email_request
+
+ROUTER = LaneRouter.from_config({'DELIVERY_LANES': ''})
+ENVELOPE = ('sender@example.com', ['alice@example.com'], b'Subject: Hi\r\n\r\nHi\r\n', [], [])
+
+
+def controller(**kwargs):
+    return AdmissionController(ROUTER, **kwargs)
+
+
+def test_thresholds_follow_lane_weights():
+    """Transactional mail is shed last, bulk mail first"""
+    assert controller().thresholds == {'transactional': 1.0, 'default': 0.75, 'bulk': 0.5625}
+
+
+def test_in_flight_sheds_bulk_first():
+    """With most request threads busy, bulk is rejected while transactional still gets in"""
+    admission = controller(max_in_flight=8)
+    for _ in range(5):
+        admission.enter()
+    admitted, retry_after, reason = admission.admit(['invoice_email'])
+    assert not admitted and reason == 'in_flight' and retry_after >= 1
+    assert admission.admit(['welcome_email'])[0]
+    assert admission.admit(['password_reset_email'])[0]
+    for _ in range(2):
+        admission.enter()
+    assert not admission.admit(['welcome_email'])[0]
+    assert admission.admit(['password_reset_email'])[0]
+    for _ in range(7):
+        admission.exit()
+    assert admission.admit(['invoice_email'])[0]
+    assert admission.stats()['rejected'] == 2
+
+
+def test_batch_is_judged_by_lowest_priority_item():
+    """A batch mixing resets and invoices is treated as bulk"""
+    admission = controller(max_in_flight=8)
+    for _ in range(5):
+        admission.enter()
+    assert admission.admit(['password_reset_email'])[0]
+    assert not admission.admit(['password_reset_email', 'invoice_email'])[0]
+
+
+def test_non_string_email_type():
+    """An email_type that is not a string (raw client JSON) gets the default lane and a 400, not a 500"""
+    admission = controller(max_in_flight=8)
+    for email_type in (['welcome_email'], {'type': 'invoice_email'}, None, 5):
+        assert admission.admit([email_type]) == (True, None, None)
+    for _ in range(7):
+        admission.enter()
+    admitted, _, reason = admission.admit([['password_reset_email']])
+    assert not admitted and reason == 'in_flight'
+    errors = validate_email_request({'receiver_email': 'alice@example.com', 'sender_email': 'sender@example.com',
+                                     'email_type': ['welcome_email']})
+    assert len(errors) == 1 and 'is not valid' in errors[0]
+
+
+def test_queue_depth_and_retry_after():
+    """A deep queue sheds requests; Retry-After is the time to drain it, capped"""
+    depth = [1500]
+    admission = controller(max_queue_depth=2000, depth=lambda: depth[0], concurrency=4, max_retry_after=60,
+                           depth_max_age=0)
+    admission.latency.observe(0.1)
+    admitted, retry_after, reason = admission.admit(['welcome_email'])
+    assert not admitted and reason == 'queue_depth'
+    # 1500 emails at about 0.1 s each over 4 workers
+    assert 37 <= retry_after <= 38
+    assert admission.admit(['access_key_email'])[0]
+    depth[0] = 100000
+    assert admission.admit(['access_key_email'])[1] == 60
+    depth[0] = 0
+    assert admission.admit(['invoice_email'])[0]
+
+
+def test_depth_is_cached():
+    """The queue depth is read at most once per depth_max_age"""
+    calls = []
+    admission = controller(depth=lambda: calls.append(1) or 0, depth_max_age=60)
+    for _ in range(10):
+        admission.admit(['welcome_email'])
+    assert len(calls) == 1
+
+
+def test_slow_smtp_sheds_and_recovers():
+    """Slow deliveries raise the load; it fades once nothing is being delivered"""
+    latency = LatencyTracker(half_life=0.05)
+    admission = controller(max_latency=5.0, latency=latency)
+    service = EmailService(None, MemoryTransport(), latency=latency)
+    service.deliver_envelope(ENVELOPE)
+    assert latency.value() < 1
+    latency.observe(30)
+    admitted, _, reason = admission.admit(['password_reset_email'])
+    assert not admitted and reason == 'latency'
+    time.sleep(0.4)
+    assert admission.admit(['password_reset_email'])[0]
+
+
+def main():
+    """Run all tests"""
+    test_thresholds_follow_lane_weights()
+    test_in_flight_sheds_bulk_first()
+    test_batch_is_judged_by_lowest_priority_item()
+    test_non_string_email_type()
+    test_queue_depth_and_retry_after()
+    test_depth_is_cached()
+    test_slow_smtp_sheds_and_recovers()
+    print("All admission control tests passed")
+
+
+if __name__ == "__main__":
+    main()
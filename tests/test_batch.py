@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests for batch sends (no running server or SMTP server required)
+"""
+
+import os
+import sys
+
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.email_service import EmailService
+from app.services.mime_builder import MessageBuilder
+from app.services.transports import MemoryTransport
+from app.utils.utils import validate_batch_request, validate_email_request
+
+VARIABLES = {'name': 'Alice', 'email': 'alice@example.com', 'login_url': 'https://example.com/login'}
+GOOD_ITEM = {'receiver_email': 'alice@example.com', 'email_type': 'welcome_email', 'variables': VARIABLES}
+
+
+def send_batch(items):
+    transport = MemoryTransport()
+    service = EmailService(None, transport, message_builder=MessageBuilder())
+    with Flask(__name__).app_context():
+        body, status = service.send_batch(items, sender_email='sender@example.com')
+    assert status == 200
+    return body.get_json(), transport
+
+
+def test_mixed_batch():
+    """Good items are sent; each bad item fails on its own with an error in its result"""
+    items = [
+        GOOD_ITEM,
+        {'receiver_email': 'bob@example.com', 'email_type': 'welcome_email', 'variables': None},
+        'not an object',
+        {'receiver_email': 'carol@example.com', 'email_type': 'welcome_email', 'variables': ['name']},
+        {'receiver_email': 'dave@example.com', 'email_type': 'no_such_email', 'variables': {}},
+        dict(GOOD_ITEM, receiver_email='erin@example.com')
+    ]
+    response, transport = send_batch(items)
+    assert (response['total'], response['sent'], response['failed']) == (6, 2, 4)
+    results = response['results']
+    assert [result['index'] for result in results] == list(range(6))
+    assert [result['success'] for result in results] == [True, False, False, False, False, True]
+    assert results[1]['error'] == "Variables must be an object"
+    assert results[2]['error'] == "Item must be an object"
+    assert results[3]['error'] == "Variables must be an object"
+    assert 'is not valid' in results[4]['error']
+    assert [message['recipients'] for message in transport.messages()] == [['alice@example.com'], ['erin@example.com']]
+
+
+def test_non_object_body():
+    """A body that is not a JSON object is a validation error, not a crash"""
+    for body in (['items'], 'items', 5):
+        assert validate_batch_request(body, 10) == ["Request body must be a JSON object"]
+        assert validate_email_request(body) == ["Request body must be a JSON object"]
+    assert validate_batch_request({'sender_email': 'sender@example.com', 'items': [GOOD_ITEM, 'x']}, 10) == []
+    assert validate_email_request(dict(GOOD_ITEM, sender_email='sender@example.com', variables=None)) == [
+        "Variables must be an object"]
+
+
+def main():
+    """Run all tests"""
+    test_mixed_batch()
+    test_non_object_body()
+    print("All batch tests passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Tests for the SMTP circuit breaker (local SMTP sinks, no Gmail account required)
+"""
+
+import os
+import smtplib
+import socket
+import sys
+import tempfile
+import time
+
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.smtp_sink import SMTPSink
+from app.services.circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from app.services.dead_letters import SQLiteDeadLetterStore
+from app.services.delivery_queue import DeliveryQueue, SENT
+from app.services.email_service import EmailService
+from app.services.mime_builder import MessageBuilder
+from app.services.outbox import Outbox, FAILED
+from app.services.retry import RetryBudget, RetryPolicy, is_transient
+from app.services.smtp_accounts import SMTPAccount, SMTPAccountPool
+from app.services.smtp_pool import SMTPConnectionPool, is_endpoint_failure
+from app.services.transports import MemoryTransport
+
+VARIABLES = {'name': 'Alice', 'email': 'alice@example.com', 'login_url': 'https://x'}
+MESSAGE = b'Subject: Hello\r\nContent-Type: text/html\r\n\r\n<p>Hello</p>\r\n'
+ENVELOPE = ('sender@example.com', ['alice@example.com'], MESSAGE, [], [])
+
+
+def free_port():
+    """A local port with nothing listening on it"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def expect_open(send):
+    try:
+        send()
+        assert False, "Expected CircuitOpenError"
+    except CircuitOpenError as e:
+        return e
+
+
+def test_states():
+    """Failures in a row open the breaker; after the probe interval one probe decides"""
+    breaker = CircuitBreaker('smtp.example.com:587', failure_threshold=3, probe_interval=0.1)
+    for _ in range(2):
+        breaker.allow()
+        breaker.failure(ConnectionRefusedError())
+    assert breaker.state == CLOSED
+    breaker.allow()
+    breaker.success()
+    assert breaker.stats()['failures'] == 0
+    for _ in range(3):
+        breaker.allow()
+        breaker.failure(ConnectionRefusedError())
+    assert breaker.state == OPEN and not breaker.available()
+    assert 0 < expect_open(breaker.allow).retry_after <= 0.1
+
+    time.sleep(0.12)
+    assert breaker.state == HALF_OPEN and breaker.available()
+    breaker.allow()
+    # Only one probe at a time
+    expect_open(breaker.allow)
+    breaker.failure(socket.timeout())
+    assert breaker.state == OPEN
+
+    time.sleep(0.12)
+    breaker.allow()
+    breaker.success()
+    assert breaker.state == CLOSED
+    stats = breaker.stats()
+    assert stats['opened'] == 2 and stats['rejected'] == 2
+    assert stats['last_error'] == 'TimeoutError'
+
+
+def test_endpoint_failures():
+    """Unreachable servers, failed logins and 421 count; a rejected message does not"""
+    assert is_endpoint_failure(ConnectionRefusedError())
+    assert is_endpoint_failure(socket.timeout())
+    assert is_endpoint_failure(smtplib.SMTPServerDisconnected())
+    assert is_endpoint_failure(smtplib.SMTPAuthenticationError(535, b'5.7.8 Username and Password not accepted'))
+    assert is_endpoint_failure(smtplib.SMTPDataError(421, b'4.7.0 Service not available'))
+    assert not is_endpoint_failure(smtplib.SMTPDataError(550, b'5.4.5 Daily user sending quota exceeded.'))
+    assert not is_endpoint_failure(smtplib.SMTPRecipientsRefused({'bob@example.com': (550, b'5.1.1 No such user')}))
+
+
+def test_pool_fails_fast_and_recovers():
+    """While the server is down sends fail without connecting; once it is back a probe closes the breaker"""
+    port = free_port()
+    pool = SMTPConnectionPool('127.0.0.1', port, use_tls=False, size=2, timeout=5,
+                              breaker=CircuitBreaker(f'127.0.0.1:{port}', failure_threshold=2, probe_interval=0.2))
+    for _ in range(2):
+        try:
+            pool.sendmail(*ENVELOPE)
+            assert False, "Expected a connection error"
+        except ConnectionRefusedError:
+            pass
+    assert not pool.available()
+    assert pool.stats()['breaker']['state'] == OPEN
+    expect_open(lambda: pool.sendmail(*ENVELOPE))
+
+    sink = SMTPSink(port=port).start()
+    try:
+        # Still open until the probe interval has passed, even though the server is back
+        expect_open(lambda: pool.sendmail(*ENVELOPE))
+        time.sleep(0.25)
+        pool.sendmail(*ENVELOPE)
+        assert pool.stats()['breaker']['state'] == CLOSED
+        assert sink.wait_for(1, timeout=5)
+    finally:
+        pool.close()
+        sink.stop()
+
+
+def test_rejected_message_keeps_breaker_closed():
+    """A server that rejects messages is up"""
+    sink = SMTPSink().start()
+    sink.reject = (554, '5.6.0 Message rejected')
+    pool = SMTPConnectionPool(sink.host, sink.port, use_tls=False, size=1,
+                              breaker=CircuitBreaker('sink', failure_threshold=1))
+    try:
+        for _ in range(3):
+            try:
+                pool.sendmail(*ENVELOPE)
+            except smtplib.SMTPDataError:
+                pass
+        assert pool.breaker.state == CLOSED
+    finally:
+        pool.close()
+        sink.stop()
+
+
+def test_accounts_skip_open_breaker():
+    """An account whose breaker is open gets no messages"""
+    sinks = [SMTPSink().start() for _ in range(2)]
+    accounts = [
+        SMTPAccount(f'account-{index}', SMTPConnectionPool(sink.host, sink.port, use_tls=False, size=1,
+                                                           breaker=CircuitBreaker(f'account-{index}', 1, 60)))
+        for index, sink in enumerate(sinks)
+    ]
+    transport = SMTPAccountPool(accounts)
+    try:
+        accounts[0].pool.breaker.failure(ConnectionRefusedError())
+        for _ in range(4):
+            transport.sendmail(*ENVELOPE)
+        assert [account.sent for account in accounts] == [0, 4]
+        assert transport.available()
+        stats = transport.stats()
+        assert stats['available'] == 1 and stats['accounts'][0]['pool']['breaker']['state'] == OPEN
+        accounts[1].pool.breaker.failure(ConnectionRefusedError())
+        assert not transport.available()
+    finally:
+        transport.close()
+        for sink in sinks:
+            sink.stop()
+
+
+def test_retry_waits_for_probe():
+    """Queued retries wait for the probe and spend no budget; a waiting client is not held that long"""
+    error = CircuitOpenError('smtp.example.com:587', 30)
+    assert is_transient(error)
+    budget = RetryBudget(ratio=0, min_per_second=0)
+    budget._tokens = 0
+    assert 30 <= RetryPolicy(5, 1, 300, budget).next_delay(error, 1) <= 300
+    assert budget.denied == 0
+    assert RetryPolicy(3, 1, 2, budget).next_delay(error, 1) is None
+
+
+def test_sync_send_fails_fast():
+    """An inline send while the breaker is open returns 503 with Retry-After at once"""
+    port = free_port()
+    breaker = CircuitBreaker(f'127.0.0.1:{port}', failure_threshold=1, probe_interval=30)
+    breaker.failure(ConnectionRefusedError())
+    service = EmailService(None, SMTPConnectionPool('127.0.0.1', port, use_tls=False, breaker=breaker),
+                           message_builder=MessageBuilder())
+    start = time.monotonic()
+    with Flask(__name__).app_context():
+        response = service.send_email(
+            'alice@example.com', 'welcome_email',
+            {'name': 'Alice', 'email': 'alice@example.com', 'login_url': 'https://x'},
+            sender_email='sender@example.com'
+        )
+    body, status, headers = response
+    assert 'unavailable' in body.get_json()['error'], body.get_json()
+    assert status == 503 and 25 <= int(headers['Retry-After']) <= 30
+    assert time.monotonic() - start < 1
+
+
+def open_breaker_service(directory):
+    """EmailService over an SMTP pool whose breaker is open, with an outbox and a dead-letter store"""
+    port = free_port()
+    breaker = CircuitBreaker(f'127.0.0.1:{port}', failure_threshold=1, probe_interval=30)
+    breaker.failure(ConnectionRefusedError())
+    return EmailService(None, SMTPConnectionPool('127.0.0.1', port, use_tls=False, breaker=breaker),
+                        Outbox(os.path.join(directory, 'outbox.db')), message_builder=MessageBuilder(),
+                        retry_policy=RetryPolicy(3, 1, 2), sync_retry_policy=RetryPolicy(3, 1, 2),
+                        dead_letters=SQLiteDeadLetterStore(os.path.join(directory, 'dead_letters.db')))
+
+
+def test_open_breaker_is_not_dead_lettered():
+    """Sends refused by an open breaker never reached the server: no dead letter, nothing left to replay"""
+    service = open_breaker_service(tempfile.mkdtemp(prefix='breaker-test-'))
+    with Flask(__name__).app_context():
+        for _ in range(3):
+            assert service.send_email('alice@example.com', 'welcome_email', VARIABLES,
+                                      sender_email='sender@example.com')[1] == 503
+        items = [{'receiver_email': 'alice@example.com', 'email_type': 'welcome_email', 'variables': VARIABLES}] * 2
+        body, _ = service.send_batch(items, sender_email='sender@example.com')
+    assert body.get_json()['failed'] == 2
+    assert service.dead_letters.count() == 0
+    # close() flushes the outbox marks that are still waiting for the writer
+    service.close()
+    outbox = Outbox(service.outbox.path)
+    try:
+        assert outbox.claim_pending(0) == []
+        assert outbox.counts() == {FAILED: 5}
+    finally:
+        outbox.close()
+
+
+def test_open_breaker_queues_inline_sends():
+    """With a queue to fall back on, an inline send the breaker refuses is queued (202) instead"""
+    service = open_breaker_service(tempfile.mkdtemp(prefix='breaker-test-'))
+    transport = MemoryTransport()
+    fallback = DeliveryQueue(EmailService(None, transport), workers=1)
+    try:
+        with Flask(__name__).app_context():
+            body, status = service.send_email('alice@example.com', 'welcome_email', VARIABLES,
+                                              sender_email='sender@example.com', breaker_queue=fallback)
+            assert status == 202 and body.get_json()['status'] == 'queued'
+            job = fallback.get_job(body.get_json()['job_id'])
+            items = [{'receiver_email': 'bob@example.com', 'email_type': 'welcome_email', 'variables': VARIABLES}]
+            body, _ = service.send_batch(items, sender_email='sender@example.com', breaker_queue=fallback)
+        result, = body.get_json()['results']
+        assert result['success'] and result['status'] == 'queued' and 'error' not in result
+        batch_job = fallback.get_job(result['job_id'])
+        deadline = time.time() + 5
+        while (job.status, batch_job.status) != (SENT, SENT):
+            assert time.time() < deadline, "queued sends were not delivered"
+            time.sleep(0.01)
+        assert len(transport.messages()) == 2 and service.dead_letters.count() == 0
+    finally:
+        fallback.stop()
+        service.close()
+
+
+def main():
+    """Run all tests"""
+    test_states()
+    test_endpoint_failures()
+    test_pool_fails_fast_and_recovers()
+    test_rejected_message_keeps_breaker_closed()
+    test_accounts_skip_open_breaker()
+    test_retry_waits_for_probe()
+    test_sync_send_fails_fast()
+    test_open_breaker_is_not_dead_lettered()
+    test_open_breaker_queues_inline_sends()
+    print("All circuit breaker tests passed")
+
+
+if __name__ == "__main__":
+    main()
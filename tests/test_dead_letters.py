@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Tests for the dead-letter store and replay (no running server or SMTP server required)
+"""
+
+import os
+import shutil
+import smtplib
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.dead_letters import replay
+from app.services.dead_letters import SQLiteDeadLetterStore
+from app.services.email_service import EmailService
+from app.services.transports import MemoryTransport
+
+MESSAGE = b'Subject: Hello\r\nContent-Type: text/html\r\n\r\n<p>Hello</p>\r\n'
+
+
+def envelope(receiver):
+    return ('sender@example.com', [receiver], MESSAGE, [], [])
+
+
+class RejectingTransport(MemoryTransport):
+    """Rejects mail for one recipient and delivers the rest"""
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        if 'bounce@example.com' in to_addrs:
+            raise smtplib.SMTPRecipientsRefused({'bounce@example.com': (550, b'5.1.1 No such user')})
+        return super().sendmail(from_addr, to_addrs, msg, mail_options, rcpt_options)
+
+
+def make_store(directory):
+    store = SQLiteDeadLetterStore(os.path.join(directory, 'dead_letters.db'))
+    store.add('a', envelope('alice@example.com'), '451 try later', 5, 'exhausted', 'welcome_email', 'alice@example.com')
+    store.add('b', envelope('bounce@example.com'), '550 no such user', 1, 'permanent', 'invoice_email', 'bounce@example.com')
+    store.add('c', envelope('carol@example.com'), '451 try later', 5, 'exhausted', 'invoice_email', 'carol@example.com')
+    return store
+
+
+def test_store_is_created_lazily():
+    """No database file exists until something is dead-lettered"""
+    directory = tempfile.mkdtemp(prefix='dead-letter-test-')
+    try:
+        store = SQLiteDeadLetterStore(os.path.join(directory, 'sub', 'dead_letters.db'))
+        assert store.count() == 0
+        assert not os.path.exists(os.path.join(directory, 'sub'))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_list_and_filter():
+    """Entries are listed newest first and can be filtered by type and reason"""
+    directory = tempfile.mkdtemp(prefix='dead-letter-test-')
+    try:
+        store = make_store(directory)
+        assert [entry.id for entry in store.list()] == ['c', 'b', 'a']
+        assert [entry.id for entry in store.list(email_type='invoice_email')] == ['c', 'b']
+        assert [entry.id for entry in store.list(reason='exhausted', limit=1)] == ['c']
+        view = store.get('b').to_dict()
+        assert view['recipients'] == ['bounce@example.com'] and view['size'] == len(MESSAGE)
+        assert 'message' not in view
+        assert store.remove('a') and not store.remove('a')
+        assert store.count() == 2
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_replay():
+    """Replayed entries that go through are removed; failures stay with a higher attempt count"""
+    directory = tempfile.mkdtemp(prefix='dead-letter-test-')
+    try:
+        store = make_store(directory)
+        transport = RejectingTransport()
+        delivered = replay(store, EmailService(None, transport), store.list())
+        assert delivered == 2
+        assert [m['recipients'] for m in transport.messages()] == [['carol@example.com'], ['alice@example.com']]
+        remaining = store.list()
+        assert [entry.id for entry in remaining] == ['b']
+        assert remaining[0].attempts == 2 and remaining[0].reason == 'permanent'
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    """Run all tests"""
+    test_store_is_created_lazily()
+    test_list_and_filter()
+    test_replay()
+    print("All dead-letter tests passed")
+
+
+if __name__ == "__main__":
+    main()
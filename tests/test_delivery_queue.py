@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-process delivery queue (no running server or SMTP server required)
+"""
+
+import os
+import smtplib
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.delivery_queue import DeliveryQueue, QUEUED, SENDING, RETRYING, SENT, FAILED
+from app.services.email_service import EmailService
+from app.services.outbox import Outbox, DELIVERED
+from app.services.retry import RetryPolicy
+from app.services.transports import MemoryTransport
+
+MESSAGE = b'Subject: Hello\r\nContent-Type: text/html\r\n\r\n<p>Hello</p>\r\n'
+ENVELOPE = ('sender@example.com', ['alice@example.com'], MESSAGE, [], [])
+
+
+class FlakyTransport(MemoryTransport):
+    """Fails the first sends with an SMTP error (transient by default)"""
+
+    def __init__(self, failures=1, code=451):
+        super().__init__()
+        self.failures = failures
+        self.code = code
+
+    def sendmail(self, *envelope):
+        if self.failures:
+            self.failures -= 1
+            raise smtplib.SMTPDataError(self.code, b'Try again later' if self.code < 500 else b'Rejected')
+        return super().sendmail(*envelope)
+
+
+class BlockingTransport(MemoryTransport):
+    """Holds every send until released"""
+
+    def __init__(self):
+        super().__init__()
+        self.sending = threading.Event()
+        self.release = threading.Event()
+
+    def sendmail(self, *envelope):
+        self.sending.set()
+        self.release.wait(5)
+        return super().sendmail(*envelope)
+
+
+class QuickRetryPolicy(RetryPolicy):
+    """Retries after 200ms"""
+
+    def backoff(self, attempt):
+        return 0.2
+
+
+def wait_for(job, statuses, timeout=5):
+    deadline = time.time() + timeout
+    while job.status not in statuses:
+        assert time.time() < deadline, f"job stuck in {job.status}"
+        time.sleep(0.01)
+
+
+def test_enqueue_delivers():
+    """A queued message is sent by a worker and marked delivered in the outbox"""
+    transport = MemoryTransport()
+    outbox = Outbox(os.path.join(tempfile.mkdtemp(prefix='delivery-queue-test-'), 'outbox.db'))
+    delivery_queue = DeliveryQueue(EmailService(None, transport, outbox), workers=2)
+    try:
+        job = delivery_queue.enqueue(ENVELOPE, 'welcome_email', 'alice@example.com', 'Hello')
+        wait_for(job, (SENT,))
+        assert job.attempts == 1 and job.error is None and job.envelope is None and job.finished_at
+        assert job.lane == 'default'
+        assert [message['message'] for message in transport.messages()] == [MESSAGE]
+    finally:
+        delivery_queue.stop()
+    outbox.close()
+    outbox = Outbox(outbox.path)
+    assert outbox.counts() == {DELIVERED: 1}
+    outbox.close()
+
+
+def test_transient_failure_is_retried():
+    """A transient failure waits for the policy's backoff and is then retried; a permanent one fails"""
+    transport = FlakyTransport(failures=1)
+    delivery_queue = DeliveryQueue(EmailService(None, transport, retry_policy=QuickRetryPolicy(3)), workers=1)
+    try:
+        job = delivery_queue.enqueue(ENVELOPE, 'welcome_email', 'alice@example.com', 'Hello')
+        wait_for(job, (RETRYING, SENT))
+        assert job.status == RETRYING and job.next_attempt_at is not None and '451' in job.error
+        assert delivery_queue.retrying() == 1
+        wait_for(job, (SENT,))
+        assert job.attempts == 2 and job.next_attempt_at is None and len(transport.messages()) == 1
+
+        transport.failures, transport.code = 1, 550
+        job = delivery_queue.enqueue(ENVELOPE, 'welcome_email', 'alice@example.com', 'Hello')
+        wait_for(job, (FAILED,))
+        assert job.attempts == 1 and '550' in job.error and delivery_queue.retrying() == 0
+    finally:
+        delivery_queue.stop()
+
+
+def test_get_job_status_transitions():
+    """get_job follows a job from queued through sending to sent"""
+    transport = BlockingTransport()
+    delivery_queue = DeliveryQueue(EmailService(None, transport), workers=1)
+    try:
+        first = delivery_queue.enqueue(ENVELOPE, 'welcome_email', 'alice@example.com', 'First')
+        assert transport.sending.wait(5)
+        second = delivery_queue.enqueue(ENVELOPE, 'welcome_email', 'bob@example.com', 'Second')
+        assert delivery_queue.get_job(first.id).status == SENDING
+        assert delivery_queue.get_job(second.id).to_dict()['status'] == QUEUED
+        assert delivery_queue.depth() == 1
+        transport.release.set()
+        wait_for(second, (SENT,))
+        assert delivery_queue.get_job(first.id).status == SENT
+        assert delivery_queue.get_job(second.id).to_dict()['subject'] == 'Second'
+        assert delivery_queue.get_job('no-such-job') is None
+    finally:
+        transport.release.set()
+        delivery_queue.stop()
+
+
+def test_stop_drains_queue():
+    """stop() lets workers finish the queued jobs, then their threads exit; the queue can start again"""
+    transport = BlockingTransport()
+    delivery_queue = DeliveryQueue(EmailService(None, transport), workers=2)
+    jobs = [delivery_queue.enqueue(ENVELOPE, 'welcome_email', 'alice@example.com', 'Hello') for _ in range(5)]
+    threads = list(delivery_queue._threads)
+    assert transport.sending.wait(5) and delivery_queue.depth() >= 3
+    # Jobs are still queued when stop() is called
+    threading.Timer(0.1, transport.release.set).start()
+    delivery_queue.stop()
+    assert all(job.status == SENT for job in jobs) and len(transport.messages()) == 5
+    assert not any(thread.is_alive() for thread in threads)
+    assert not delivery_queue._scheduler.is_alive()
+    # A second stop is a no-op
+    delivery_queue.stop()
+
+    job = delivery_queue.enqueue(ENVELOPE, 'welcome_email', 'alice@example.com', 'Hello')
+    wait_for(job, (SENT,))
+    delivery_queue.stop()
+
+
+def main():
+    """Run all tests"""
+    test_enqueue_delivers()
+    test_transient_failure_is_retried()
+    test_get_job_status_transitions()
+    test_stop_drains_queue()
+    print("All delivery queue tests passed")
+
+
+if __name__ == "__main__":
+    main()
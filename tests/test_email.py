@@ -245,6 +245,43 @@ def test_missing_fields():
         print("Error: Could not connect to server. Make sure the server is running.")
         print()
 
+def test_send_batch():
+    """Test sending a batch with one valid and one invalid item"""
+    print("Testing batch send...")
+    data = {
+        "sender_name": "Test App",
+        "sender_email": "noreply@example.com",
+        "items": [
+            {
+                "receiver_email": user_email,
+                "email_type": "welcome_email",
+                "variables": {
+                    "name": "Batch User",
+                    "email": user_email,
+                    "login_url": "https://example.com/login"
+                }
+            },
+            {
+                "receiver_email": user_email,
+                "email_type": "invalid_email_type",
+                "variables": {}
+            }
+        ]
+    }
+    
+    try:
+        response = requests.post(
+            f"{BASE_URL}/send-email/batch",
+            headers=HEADERS,
+            data=json.dumps(data)
+        )
+        print(f"Status Code: {response.status_code}")
+        print(f"Response: {response.json()}")
+        print()
+    except requests.exceptions.ConnectionError:
+        print("Error: Could not connect to server. Make sure the server is running.")
+        print()
+
 def test_unauthorized_access():
     """Test accessing protected endpoints without API key"""
     print("Testing unauthorized access...")
@@ -298,6 +335,7 @@ def main():
     test_send_invoice()
     test_invalid_email_type()
     test_missing_fields()
+    test_send_batch()
     test_unauthorized_access()
     test_invalid_api_key()
     
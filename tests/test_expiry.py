@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Tests for delivery deadlines (no running server, Redis or SMTP server required)
+"""
+
+import os
+import smtplib
+import sqlite3
+import sys
+import tempfile
+import time
+
+import fakeredis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.delivery_queue import DeliveryQueue, EXPIRED, SENT
+from app.services.dead_letters import SQLiteDeadLetterStore
+from app.services.email_service import EmailService
+from app.services.outbox import Outbox
+from app.services.redis_queue import RedisStreamQueue
+from app.services.metrics import EXPIRED_DELIVERIES_TOTAL
+from app.services.retry import RetryPolicy
+from app.services.transports import MemoryTransport
+from app.utils.utils import delivery_deadline, validate_batch_request, validate_email_request
+from app.worker import Worker
+
+MESSAGE = b'Subject: Reset\r\nContent-Type: text/html\r\n\r\n<p>Reset</p>\r\n'
+ENVELOPE = ('sender@example.com', ['alice@example.com'], MESSAGE, [], [])
+
+
+class FailingTransport(MemoryTransport):
+    def sendmail(self, *envelope):
+        raise smtplib.SMTPDataError(451, b'4.3.0 Try again later')
+
+
+class FixedRetryPolicy(RetryPolicy):
+    """Waits 10 seconds before every retry"""
+
+    def backoff(self, attempt):
+        return 10
+
+
+class RecordingQueue:
+    """Stands in for RedisStreamQueue in Worker tests"""
+
+    def __init__(self):
+        self.calls = []
+
+    def expire(self, entry_id, job_id, lane=None):
+        self.calls.append(('expire', job_id))
+
+    def mark_sending(self, job_id):
+        self.calls.append(('sending', job_id))
+        return 1
+
+    def complete(self, entry_id, job_id, error=None, lane=None):
+        self.calls.append(('complete', job_id))
+
+    def get_job(self, job_id):
+        return None
+
+
+def wait_for(job, statuses, timeout=5):
+    deadline = time.time() + timeout
+    while job.status not in statuses:
+        assert time.time() < deadline, f"job stuck in {job.status}"
+        time.sleep(0.01)
+
+
+def expired_count(action):
+    return EXPIRED_DELIVERIES_TOTAL.collect().get(('password_reset_email', action), 0)
+
+
+def test_deadline_from_expiry_hours():
+    """Link emails expire expiry_hours after they are due; an explicit expires_at wins"""
+    now = time.time()
+    deadline = delivery_deadline('password_reset_email', {'expiry_hours': 2})
+    assert now + 7200 <= deadline <= time.time() + 7200
+    assert delivery_deadline('password_reset_email', {'expiry_hours': '1'}, send_at=now + 600) == now + 4200
+    assert delivery_deadline('password_reset_email', {'expiry_hours': 2}, expires_at=now + 60) == now + 60
+    assert delivery_deadline('welcome_email', {'expiry_hours': 2}) is None
+    assert delivery_deadline('welcome_email', {}, expires_at=now + 60) == now + 60
+    for hours in ('soon', 0, -1, None, float('inf')):
+        assert delivery_deadline('account_confirmation_email', {'expiry_hours': hours}) is None
+
+
+def test_past_deadline_is_rejected():
+    """A request whose expires_at has already passed, or comes before its send_at, is a 400"""
+    now = time.time()
+    request = {'receiver_email': 'alice@example.com', 'sender_email': 'sender@example.com', 'email_type': 'welcome_email',
+               'variables': {'name': 'Alice', 'email': 'alice@example.com', 'login_url': 'https://x'}}
+    assert validate_email_request(dict(request, expires_at=now + 60)) == []
+    assert validate_email_request(dict(request, expires_at=now - 1)) == ["expires_at is in the past"]
+    assert validate_email_request(dict(request, expires_at='2001-01-01T00:00:00Z')) == ["expires_at is in the past"]
+    assert validate_email_request(dict(request, send_at=now + 120, expires_at=now + 60)) == [
+        "expires_at must be after send_at"]
+    # An unparsable time is reported once, by the format check
+    assert len(validate_email_request(dict(request, send_at='soon', expires_at=now - 1))) == 1
+    batch = {'sender_email': 'sender@example.com', 'items': [request]}
+    assert validate_batch_request(dict(batch, expires_at=now - 1), 10) == ["expires_at is in the past"]
+
+
+def test_expired_job_is_not_sent():
+    """A job whose deadline passed while it waited is dropped without touching SMTP"""
+    transport = MemoryTransport()
+    delivery_queue = DeliveryQueue(EmailService(None, transport), workers=1)
+    before = expired_count('drop')
+    job = delivery_queue.enqueue(ENVELOPE, 'password_reset_email', 'alice@example.com', 'Reset', time.time() - 1)
+    fresh = delivery_queue.enqueue(ENVELOPE, 'password_reset_email', 'alice@example.com', 'Reset', time.time() + 60)
+    wait_for(job, (EXPIRED,))
+    wait_for(fresh, (SENT,))
+    assert len(transport.messages()) == 1
+    assert job.attempts == 0 and job.to_dict()['expires_at'] < time.time()
+    assert expired_count('drop') == before + 1
+    delivery_queue.stop()
+
+
+def test_expired_job_is_dead_lettered():
+    """With EXPIRED_EMAIL_ACTION=dead_letter, expired jobs are kept with reason 'expired'"""
+    store = SQLiteDeadLetterStore(os.path.join(tempfile.mkdtemp(prefix='expiry-test-'), 'dead_letters.db'))
+    service = EmailService(None, MemoryTransport(), dead_letters=store, expired_action='dead_letter')
+    delivery_queue = DeliveryQueue(service, workers=1)
+    job = delivery_queue.enqueue(ENVELOPE, 'password_reset_email', 'alice@example.com', 'Reset', time.time() - 1)
+    wait_for(job, (EXPIRED,))
+    entry = store.get(job.id)
+    assert entry.reason == 'expired' and entry.envelope == ENVELOPE
+    delivery_queue.stop()
+
+
+def test_retry_past_deadline_expires():
+    """A failed job is not retried when its next attempt would come after the deadline"""
+    policy = FixedRetryPolicy(5)
+    delivery_queue = DeliveryQueue(EmailService(None, FailingTransport(), retry_policy=policy), workers=1)
+    job = delivery_queue.enqueue(ENVELOPE, 'password_reset_email', 'alice@example.com', 'Reset', time.time() + 5)
+    wait_for(job, (EXPIRED,))
+    assert job.attempts == 1 and delivery_queue.retrying() == 0
+    delivery_queue.stop()
+
+
+def test_worker_expires_entry():
+    """The Redis worker acknowledges an expired entry instead of sending it"""
+    transport = MemoryTransport()
+    queue = RecordingQueue()
+    worker = Worker(queue, EmailService(None, transport))
+    worker._process('1-0', 'job-1', ENVELOPE, 'transactional', time.time() - 1)
+    worker._process('2-0', 'job-2', ENVELOPE, 'transactional', time.time() + 60)
+    worker._process('3-0', 'job-3', ENVELOPE, 'transactional', None)
+    assert queue.calls == [('expire', 'job-1'), ('sending', 'job-2'), ('complete', 'job-2'),
+                           ('sending', 'job-3'), ('complete', 'job-3')]
+    assert len(transport.messages()) == 2
+
+
+def test_replayed_outbox_keeps_deadline():
+    """After a crash, an outbox entry whose deadline passed is expired on replay instead of sent"""
+    directory = tempfile.mkdtemp(prefix='expiry-test-')
+    outbox = Outbox(os.path.join(directory, 'outbox.db'))
+    outbox.append_many([
+        ('stale', 'password_reset_email', 'alice@example.com', 'Reset', ENVELOPE, time.time() - 1),
+        ('fresh', 'password_reset_email', 'alice@example.com', 'Reset', ENVELOPE, time.time() + 60),
+        ('no-deadline', 'welcome_email', 'alice@example.com', 'Hi', ENVELOPE)
+    ])
+    # Crash: the entries are never marked delivered
+    outbox.close()
+
+    outbox = Outbox(os.path.join(directory, 'outbox.db'))
+    entries = outbox.claim_pending(0)
+    assert {entry.id: entry.expires_at is not None for entry in entries} == {
+        'stale': True, 'fresh': True, 'no-deadline': False}
+    transport = MemoryTransport()
+    delivery_queue = DeliveryQueue(EmailService(None, transport, outbox), workers=1)
+    assert delivery_queue.replay(entries) == 3
+    deadline = time.time() + 5
+    while delivery_queue.get_job('no-deadline') is None:
+        assert time.time() < deadline, "entries were not replayed"
+        time.sleep(0.01)
+    wait_for(delivery_queue.get_job('stale'), (EXPIRED,))
+    wait_for(delivery_queue.get_job('fresh'), (SENT,))
+    wait_for(delivery_queue.get_job('no-deadline'), (SENT,))
+    assert len(transport.messages()) == 2
+    delivery_queue.stop()
+
+
+def test_redis_replay_keeps_deadline():
+    """Outbox entries handed to the Redis stream keep their deadline"""
+    outbox = Outbox(os.path.join(tempfile.mkdtemp(prefix='expiry-test-'), 'outbox.db'))
+    expires_at = time.time() - 1
+    outbox.append('stale', 'password_reset_email', 'alice@example.com', 'Reset', ENVELOPE, expires_at)
+    queue = RedisStreamQueue(fakeredis.FakeRedis(), outbox=outbox)
+    queue.ensure_group()
+    assert queue.replay(outbox.claim_pending(0)) == 1
+    (_, _, _, _, entry_expires_at), = queue.consume('worker-1', block_ms=None)
+    assert entry_expires_at == expires_at
+
+
+def test_old_outbox_is_migrated():
+    """An outbox file from before deadlines gains the expires_at column"""
+    path = os.path.join(tempfile.mkdtemp(prefix='expiry-test-'), 'outbox.db')
+    connection = sqlite3.connect(path)
+    connection.executescript('''
+        CREATE TABLE outbox (id TEXT PRIMARY KEY, status TEXT NOT NULL, email_type TEXT, receiver_email TEXT,
+            subject TEXT, sender TEXT NOT NULL, recipients TEXT NOT NULL, message BLOB NOT NULL,
+            mail_options TEXT NOT NULL, rcpt_options TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL);
+        INSERT INTO outbox VALUES ('old', 'pending', 'welcome_email', 'alice@example.com', 'Hi', 'sender@example.com',
+            '["alice@example.com"]', X'00', '[]', '[]', 0, NULL, 0, 0);
+    ''')
+    connection.commit()
+    connection.close()
+    outbox = Outbox(path)
+    entry, = outbox.claim_pending(0)
+    assert entry.id == 'old' and entry.expires_at is None
+    outbox.append('new', 'password_reset_email', 'alice@example.com', 'Reset', ENVELOPE, time.time() + 60)
+    outbox.close()
+
+
+def main():
+    """Run all tests"""
+    test_deadline_from_expiry_hours()
+    test_past_deadline_is_rejected()
+    test_expired_job_is_not_sent()
+    test_expired_job_is_dead_lettered()
+    test_retry_past_deadline_expires()
+    test_worker_expires_entry()
+    test_replayed_outbox_keeps_deadline()
+    test_redis_replay_keeps_deadline()
+    test_old_outbox_is_migrated()
+    print("All delivery deadline tests passed")
+
+
+if __name__ == "__main__":
+    main()
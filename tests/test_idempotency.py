@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Tests for the Idempotency-Key store (no running server or Redis required)
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.idempotency import IdempotencyStore, fingerprint, NEW, REPLAY, MISMATCH, IN_PROGRESS
+
+RESPONSE = (200, 'application/json', b'{"success": true}')
+
+
+def test_replays_completed_key():
+    """A finished key returns the stored response"""
+    store = IdempotencyStore()
+    request = fingerprint('send_email', b'{"a": 1}')
+    assert store.acquire('k', request) == (NEW, None)
+    store.complete('k', RESPONSE)
+    assert store.acquire('k', request) == (REPLAY, RESPONSE)
+    assert store.stats()['replays'] == 1
+
+
+def test_rejects_different_request():
+    """Reusing a key with another body is a mismatch"""
+    store = IdempotencyStore()
+    store.acquire('k', fingerprint('send_email', b'{"a": 1}'))
+    store.complete('k', RESPONSE)
+    assert store.acquire('k', fingerprint('send_email', b'{"a": 2}')) == (MISMATCH, None)
+
+
+def test_duplicate_waits_for_first_request():
+    """A duplicate arriving in flight gets the first request's response"""
+    store = IdempotencyStore()
+    store.acquire('k', 'f')
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(store.acquire('k', 'f', timeout=5)))
+    waiter.start()
+    time.sleep(0.05)
+    assert not results
+    store.complete('k', RESPONSE)
+    waiter.join()
+    assert results == [(REPLAY, RESPONSE)]
+
+
+def test_released_key_runs_again():
+    """After a failed first request, a waiting duplicate takes the key over"""
+    store = IdempotencyStore()
+    store.acquire('k', 'f')
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(store.acquire('k', 'f', timeout=5)))
+    waiter.start()
+    time.sleep(0.05)
+    store.release('k')
+    waiter.join()
+    assert results == [(NEW, None)]
+
+
+def test_wait_times_out():
+    """A duplicate gives up once the first request outlasts the timeout"""
+    store = IdempotencyStore()
+    store.acquire('k', 'f')
+    start = time.monotonic()
+    assert store.acquire('k', 'f', timeout=0.05) == (IN_PROGRESS, None)
+    assert time.monotonic() - start < 1
+
+
+def test_expiry_and_eviction():
+    """Keys expire after ttl, and the oldest finished keys are evicted first"""
+    store = IdempotencyStore(ttl=0.05)
+    store.acquire('k', 'f')
+    store.complete('k', RESPONSE)
+    time.sleep(0.06)
+    assert store.acquire('k', 'f')[0] == NEW
+
+    store = IdempotencyStore(max_entries=2)
+    store.acquire('in-flight', 'f')
+    store.acquire('a', 'f')
+    store.complete('a', RESPONSE)
+    store.acquire('b', 'f')
+    assert store.stats()['keys'] == 2 and store.stats()['evictions'] == 1
+    assert store.acquire('a', 'f')[0] == NEW
+    assert store.acquire('in-flight', 'f', timeout=0)[0] == IN_PROGRESS
+
+
+def main():
+    """Run all tests"""
+    test_replays_completed_key()
+    test_rejects_different_request()
+    test_duplicate_waits_for_first_request()
+    test_released_key_runs_again()
+    test_wait_times_out()
+    test_expiry_and_eviction()
+    print("All idempotency tests passed")
+
+
+if __name__ == "__main__":
+    main()
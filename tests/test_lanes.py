@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Tests for priority lanes in the delivery queue (no running server or SMTP server required)
+"""
+
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.delivery_queue import DeliveryJob, DeliveryQueue, SENT
+from app.services.email_service import EmailService
+from app.services.lanes import LaneQueue, LaneRouter, parse_lanes
+from app.services.transports import MemoryTransport
+
+MESSAGE = b'Subject: Hello\r\nContent-Type: text/html\r\n\r\n<p>Hello</p>\r\n'
+ENVELOPE = ('sender@example.com', ['alice@example.com'], MESSAGE, [], [])
+
+
+def job(email_type):
+    return DeliveryJob(ENVELOPE, email_type, 'alice@example.com', 'Hello')
+
+
+def drain(lane_queue, count):
+    return [lane_queue.get().lane[0] for _ in range(count)]
+
+
+class SlowTransport(MemoryTransport):
+    """Takes 10 ms per message, like a fast SMTP server"""
+
+    def sendmail(self, *envelope):
+        time.sleep(0.01)
+        return super().sendmail(*envelope)
+
+
+def test_default_lanes():
+    """Without DELIVERY_LANES, OTP-style types are transactional and invoices are bulk"""
+    router = LaneRouter.from_config({'DELIVERY_LANES': ''})
+    assert [(lane.name, lane.weight) for lane in router.lanes] == [('transactional', 8), ('default', 4), ('bulk', 1)]
+    assert router.lane_for('password_reset_email').name == 'transactional'
+    assert router.lane_for('invoice_email').name == 'bulk'
+    assert router.lane_for('welcome_email').name == 'default'
+
+
+def test_parse_lanes_validation():
+    """Bad lane definitions are rejected; a catch-all lane is added when missing"""
+    lanes = parse_lanes({'DELIVERY_LANES': '[{"name": "otp", "weight": 3, "email_types": ["access_key_email"]}]'})
+    assert [lane.name for lane in lanes] == ['otp', 'default']
+    for raw in ('not json', '[]', '[{"name": "a", "weight": 0}]',
+                '[{"name": "a", "email_types": ["x"]}, {"name": "b", "email_types": ["x"]}]',
+                '[{"name": "a"}, {"name": "b"}]', '[{"name": "a"}, {"name": "a", "email_types": ["x"]}]'):
+        try:
+            parse_lanes({'DELIVERY_LANES': raw})
+            assert False, f"Expected ValueError for {raw}"
+        except ValueError:
+            pass
+
+
+def test_weighted_order():
+    """A backlog of bulk jobs does not hold back transactional ones"""
+    lane_queue = LaneQueue(LaneRouter.from_config({'DELIVERY_LANES': ''}), max_wait=0)
+    for _ in range(20):
+        lane_queue.put(job('invoice_email'))
+    for _ in range(4):
+        lane_queue.put(job('password_reset_email'))
+    for _ in range(2):
+        lane_queue.put(job('welcome_email'))
+    assert ''.join(drain(lane_queue, 26)) == 'tdttdt' + 'b' * 20
+    stats = lane_queue.stats()
+    assert stats['transactional']['served'] == 4 and stats['bulk']['depth'] == 0
+
+
+def test_low_priority_is_not_starved():
+    """Bulk keeps a share of the workers while higher lanes stay busy"""
+    lane_queue = LaneQueue(LaneRouter.from_config({'DELIVERY_LANES': ''}), max_wait=0)
+    for _ in range(100):
+        lane_queue.put(job('password_reset_email'))
+        lane_queue.put(job('invoice_email'))
+    assert drain(lane_queue, 18).count('b') == 2
+
+
+def test_aged_jobs_are_served_out_of_turn():
+    """A job past max_wait is served next, but at most every other pick"""
+    lane_queue = LaneQueue(LaneRouter.from_config({'DELIVERY_LANES': ''}), max_wait=0.05)
+    for _ in range(3):
+        lane_queue.put(job('invoice_email'))
+    time.sleep(0.06)
+    for _ in range(10):
+        lane_queue.put(job('password_reset_email'))
+    assert ''.join(drain(lane_queue, 6)) == 'btbtbt'
+    assert lane_queue.stats()['bulk']['aged'] == 3
+
+
+def test_lanes_are_bounded_separately():
+    """A full bulk lane does not reject transactional mail"""
+    lane_queue = LaneQueue(LaneRouter.from_config({'DELIVERY_LANES': ''}), maxsize=2)
+    lane_queue.put_nowait(job('invoice_email'))
+    lane_queue.put_nowait(job('invoice_email'))
+    try:
+        lane_queue.put_nowait(job('invoice_email'))
+        assert False, "Expected queue.Full"
+    except queue.Full:
+        pass
+    lane_queue.put_nowait(job('access_key_email'))
+    assert lane_queue.qsize() == 3
+
+
+def test_stop_after_drain():
+    """A stop signal is returned only once every lane is empty"""
+    lane_queue = LaneQueue(LaneRouter.from_config({'DELIVERY_LANES': ''}))
+    lane_queue.put(job('invoice_email'))
+    lane_queue.put(None)
+    assert lane_queue.get().email_type == 'invoice_email'
+    assert lane_queue.get() is None
+    results = []
+    getter = threading.Thread(target=lambda: results.append(lane_queue.get()))
+    getter.start()
+    lane_queue.put(job('welcome_email'))
+    getter.join(5)
+    assert results[0].lane == 'default'
+
+
+def test_delivery_queue_prioritises_transactional():
+    """With one worker busy on an invoice run, a password reset is sent almost immediately"""
+    transport = SlowTransport()
+    delivery_queue = DeliveryQueue(
+        EmailService(None, transport), workers=1, lanes=LaneRouter.from_config({'DELIVERY_LANES': ''})
+    )
+    bulk = [delivery_queue.enqueue(ENVELOPE, 'invoice_email', 'alice@example.com', 'Invoice') for _ in range(30)]
+    reset = delivery_queue.enqueue(ENVELOPE, 'password_reset_email', 'alice@example.com', 'Reset')
+    deadline = time.time() + 5
+    while reset.status != SENT:
+        assert time.time() < deadline, "password reset was not sent"
+        time.sleep(0.005)
+    assert sum(1 for j in bulk if j.status == SENT) <= 3
+    assert reset.to_dict()['lane'] == 'transactional'
+    assert set(delivery_queue.lanes()) == {'transactional', 'default', 'bulk'}
+    delivery_queue.stop()
+
+
+def main():
+    """Run all tests"""
+    test_default_lanes()
+    test_parse_lanes_validation()
+    test_weighted_order()
+    test_low_priority_is_not_starved()
+    test_aged_jobs_are_served_out_of_turn()
+    test_lanes_are_bounded_separately()
+    test_stop_after_drain()
+    test_delivery_queue_prioritises_transactional()
+    print("All priority lane tests passed")
+
+
+if __name__ == "__main__":
+    main()
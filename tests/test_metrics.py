@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Tests for the metrics registry and Prometheus exposition (no running server required)
+"""
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.metrics import MetricsRegistry, Counter, Histogram, Gauge, bounded_label
+
+
+def test_counter_across_threads():
+    """Per-thread shards add up to the total, including threads that have exited"""
+    registry = MetricsRegistry()
+    counter = Counter('test_total', 'Test counter', ('kind',), registry=registry)
+
+    def work():
+        for _ in range(1000):
+            counter.inc('a')
+        counter.inc('b', amount=5)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.collect() == {('a',): 8000, ('b',): 40}
+    # Finished threads are folded into the retired totals
+    assert counter._shards == []
+    counter.inc('a')
+    assert counter.collect()[('a',)] == 8001
+
+
+def test_histogram_exposition():
+    """Buckets are cumulative and end with +Inf, followed by _sum and _count"""
+    registry = MetricsRegistry()
+    histogram = Histogram('test_seconds', 'Test histogram', ('stage',), buckets=(0.1, 1.0), registry=registry)
+    histogram.observe(0.05, 'render')
+    histogram.observe(0.1, 'render')
+    histogram.observe(0.5, 'render')
+    histogram.observe(5, 'render')
+
+    lines = registry.render().splitlines()
+    assert lines[0] == '# HELP test_seconds Test histogram'
+    assert lines[1] == '# TYPE test_seconds histogram'
+    assert 'test_seconds_bucket{stage="render",le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{stage="render",le="1"} 3' in lines
+    assert 'test_seconds_bucket{stage="render",le="+Inf"} 4' in lines
+    assert 'test_seconds_sum{stage="render"} 5.65' in lines
+    assert 'test_seconds_count{stage="render"} 4' in lines
+
+
+def test_timer_records_outcome():
+    """time() labels the observation ok or error"""
+    registry = MetricsRegistry()
+    histogram = Histogram('test_seconds', 'Test histogram', ('stage', 'outcome'), registry=registry)
+    with histogram.time('deliver'):
+        pass
+    try:
+        with histogram.time('deliver'):
+            raise RuntimeError('boom')
+    except RuntimeError:
+        pass
+    collected = histogram.collect()
+    assert set(collected) == {('deliver', 'ok'), ('deliver', 'error')}
+
+
+def test_gauge_and_disabled_registry():
+    """Gauges are read at scrape time; a disabled registry records nothing"""
+    registry = MetricsRegistry()
+    depth = [3]
+    Gauge('test_depth', 'Queue depth', lambda: depth[0], registry=registry)
+    Gauge('test_pool', 'Pool', lambda: {('idle',): 1, ('in_use',): 2}, ('state',), registry=registry)
+    text = registry.render()
+    assert 'test_depth 3' in text
+    assert 'test_pool{state="idle"} 1' in text
+
+    counter = Counter('test_total', 'Test counter', registry=registry)
+    registry.enabled = False
+    counter.inc()
+    assert counter.collect() == {}
+
+
+def test_bounded_label():
+    """Unknown or non-string values collapse to one label value"""
+    assert bounded_label('welcome_email', ['welcome_email']) == 'welcome_email'
+    assert bounded_label('x' * 100, ['welcome_email']) == 'unknown'
+    assert bounded_label(['welcome_email'], ['welcome_email']) == 'unknown'
+
+
+def main():
+    """Run all tests"""
+    test_counter_across_threads()
+    test_histogram_exposition()
+    test_timer_records_outcome()
+    test_gauge_and_disabled_registry()
+    test_bounded_label()
+    print("All metrics tests passed")
+
+
+if __name__ == "__main__":
+    main()
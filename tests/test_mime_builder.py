@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests for the wire-format message builder (no running server required)
+"""
+
+import os
+import sys
+from email import message_from_bytes
+from email.header import decode_header, make_header
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.templates.templates import TEMPLATE_VARIABLES
+from app.templates.engine import get_compiled_template
+from app.services.mime_builder import MessageBuilder
+
+builder = MessageBuilder()
+
+
+def build(email_type, variables, subject='Hello', sender='Test App <noreply@example.com>'):
+    """Build a message and parse it back"""
+    envelope = builder.build(email_type, variables, subject, sender, 'user@example.com')
+    return envelope, message_from_bytes(envelope[2])
+
+
+def test_body_round_trips():
+    """The decoded body equals the engine's rendered body for every template"""
+    for email_type, names in TEMPLATE_VARIABLES.items():
+        variables = {name: f'value of {name} ' * 10 for name in names}
+        _, parsed = build(email_type, variables)
+        expected = get_compiled_template(email_type)['body'].render(variables)
+        decoded = parsed.get_payload(decode=True).decode('utf-8').replace('\r\n', '\n')
+        assert decoded == expected
+
+
+def test_lines_are_short():
+    """Every encoded line stays within the quoted-printable limit"""
+    variables = {'name': 'x' * 500, 'email': 'é' * 200, 'login_url': 'https://example.com/' + 'a' * 300}
+    envelope, _ = build('welcome_email', variables)
+    body = envelope[2].split(b'\r\n\r\n', 1)[1]
+    assert max(len(line) for line in body.split(b'\r\n')) <= 76
+
+
+def test_headers():
+    """Headers carry the envelope addresses and an encoded non-ASCII subject"""
+    variables = {'name': 'Zoë', 'email': 'zoe@example.com', 'login_url': 'https://example.com'}
+    envelope, parsed = build('welcome_email', variables, subject='Bienvenue Zoë')
+    assert envelope[0].endswith('<noreply@example.com>')
+    assert envelope[1] == ['user@example.com']
+    assert parsed['To'] == 'user@example.com'
+    assert parsed.get_content_type() == 'text/html'
+    assert str(make_header(decode_header(parsed['Subject']))) == 'Bienvenue Zoë'
+    assert 'Zoë' in parsed.get_payload(decode=True).decode('utf-8')
+
+
+def test_header_injection_rejected():
+    """Newlines in header values are refused"""
+    try:
+        build('welcome_email', {}, subject='Hi\r\nBcc: victim@example.com')
+    except Exception as e:
+        assert type(e).__name__ == 'BadHeaderError'
+    else:
+        raise AssertionError("BadHeaderError not raised")
+
+
+def main():
+    """Run all tests"""
+    test_body_round_trips()
+    test_lines_are_short()
+    test_headers()
+    test_header_injection_rejected()
+    print("All message builder tests passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQLite outbox (no running server or SMTP server required)
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.outbox import Outbox, PENDING, DELIVERED, FAILED
+
+MESSAGE = b'Subject: Hello\r\nContent-Type: text/html\r\n\r\n<p>Hello</p>\r\n'
+ENVELOPE = ('sender@example.com', ['alice@example.com', 'bob@example.com'], MESSAGE, ['SMTPUTF8'], [])
+
+
+def outbox_path():
+    return os.path.join(tempfile.mkdtemp(prefix='outbox-test-'), 'outbox.db')
+
+
+def entry(entry_id):
+    return (entry_id, 'welcome_email', 'alice@example.com', 'Hello', ENVELOPE)
+
+
+def test_group_commit():
+    """A batch shares one commit, and concurrent appends are grouped into fewer commits than appends"""
+    outbox = Outbox(outbox_path())
+    try:
+        outbox.append_many([entry(f'batch-{index}') for index in range(50)])
+        assert outbox.stats() == {'appends': 50, 'commits': 1}
+
+        threads = [threading.Thread(target=outbox.append, args=entry(f'thread-{index}')) for index in range(40)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = outbox.stats()
+        assert stats['appends'] == 90 and stats['commits'] <= 41
+        assert outbox.counts() == {PENDING: 90}
+    finally:
+        outbox.close()
+
+
+def test_idempotent_append():
+    """Appending an id again keeps the first entry and does not fail the commit it shares"""
+    outbox = Outbox(outbox_path())
+    try:
+        outbox.append('job-1', 'welcome_email', 'alice@example.com', 'First', ENVELOPE)
+        outbox.append_many([
+            ('job-1', 'welcome_email', 'alice@example.com', 'Second', ENVELOPE),
+            entry('job-2')
+        ])
+        assert outbox.counts() == {PENDING: 2}
+        subjects = {claimed.id: claimed.subject for claimed in outbox.claim_pending(0)}
+        assert subjects == {'job-1': 'First', 'job-2': 'Hello'}
+    finally:
+        outbox.close()
+
+
+def test_mark_delivered_and_failed():
+    """Delivered and failed entries are never replayed"""
+    path = outbox_path()
+    outbox = Outbox(path)
+    outbox.append_many([entry('delivered'), entry('failed'), entry('pending')])
+    outbox.mark_delivered('delivered')
+    outbox.mark_failed('failed', '550 No such user')
+    # close() flushes marks that are still waiting for the writer
+    outbox.close()
+
+    outbox = Outbox(path)
+    try:
+        assert outbox.counts() == {DELIVERED: 1, FAILED: 1, PENDING: 1}
+        assert [claimed.id for claimed in outbox.claim_pending(0)] == ['pending']
+    finally:
+        outbox.close()
+
+
+def test_claim_after_crash():
+    """After a crash undelivered entries are replayed intact, once, and only outside the grace window"""
+    path = outbox_path()
+    crashed = Outbox(path)
+    crashed.append('job-1', 'password_reset_email', 'alice@example.com', 'Reset', ENVELOPE, time.time() + 60)
+    time.sleep(0.05)
+    crashed.append_many([entry('job-2')])
+    # The process dies without marking anything or closing the outbox
+
+    restarted = Outbox(path)
+    try:
+        # Entries touched within the grace window may still be in flight elsewhere
+        assert restarted.claim_pending(60) == []
+        claimed = restarted.claim_pending(0)
+        assert [claimed_entry.id for claimed_entry in claimed] == ['job-1', 'job-2']
+        first = claimed[0]
+        assert first.envelope == ENVELOPE and isinstance(first.envelope[2], bytes)
+        assert (first.email_type, first.receiver_email, first.subject) == (
+            'password_reset_email', 'alice@example.com', 'Reset')
+        assert first.expires_at is not None and claimed[1].expires_at is None
+        # Claimed entries are touched, so a process starting right after does not replay them too
+        assert restarted.claim_pending(0.5) == []
+        time.sleep(0.1)
+        assert len(restarted.claim_pending(0.05)) == 2
+    finally:
+        restarted.close()
+        crashed.close()
+
+
+def test_closed_outbox_rejects_writes():
+    """Writes after close() raise instead of being lost"""
+    outbox = Outbox(outbox_path())
+    outbox.close()
+    for write in (lambda: outbox.append(*entry('late')), lambda: outbox.mark_delivered('late')):
+        try:
+            write()
+            assert False, "Expected RuntimeError"
+        except RuntimeError:
+            pass
+
+
+def main():
+    """Run all tests"""
+    test_group_commit()
+    test_idempotent_append()
+    test_mark_delivered_and_failed()
+    test_claim_after_crash()
+    test_closed_outbox_rejects_writes()
+    print("All outbox tests passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Tests for the hybrid local/Redis rate limit storage (no running server or Redis required)
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from limits import parse
+from limits.storage import MemoryStorage, storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+from app.services import rate_limit_storage
+from app.services.rate_limit_storage import FailoverRedisStorage, HybridRedisStorage
+
+LIMIT = parse('10/second')
+
+
+class FakeRedis:
+    """In-memory stand-in for the Redis commands the storage uses, shared between 'processes'"""
+
+    def __init__(self, data=None):
+        self.data = data if data is not None else {}
+        self.calls = 0
+        self.down = False
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+    def _run(self, command, *args):
+        if self.down:
+            raise ConnectionError("Redis is down")
+        self.calls += 1
+        return getattr(self, '_' + command)(*args)
+
+    def _incrby(self, key, amount):
+        value, expires = self.data.get(key, (0, None))
+        self.data[key] = (value + amount, expires)
+        return value + amount
+
+    def _pttl(self, key):
+        value, expires = self.data.get(key, (0, None))
+        return -1 if expires is None else int((expires - time.time()) * 1000)
+
+    def _pexpireat(self, key, when):
+        value, _ = self.data[key]
+        self.data[key] = (value, when / 1000)
+
+    def _zadd(self, key, mapping):
+        members = self.data.setdefault(key, {})
+        members.update(mapping)
+
+    def _zremrangebyscore(self, key, low, high):
+        members = self.data.setdefault(key, {})
+        for member in [m for m, score in members.items() if low <= score <= high]:
+            del members[member]
+
+    def _zcard(self, key):
+        return len(self.data.get(key, {}))
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def ping(self):
+        if self.down:
+            raise ConnectionError("Redis is down")
+        return True
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, command):
+        return lambda *args: self.commands.append((command, args))
+
+    def execute(self):
+        return [self.redis._run(command, *args) for command, args in self.commands]
+
+
+class FakeRedisStorage:
+    """limits' Redis storage stand-in (counts in memory) whose commands fail while its FakeRedis is down"""
+
+    def __init__(self, redis):
+        self.storage = redis
+        self.counts = MemoryStorage()
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            if self.storage.down:
+                raise ConnectionError("Redis is down")
+            return getattr(self.counts, method)(*args, **kwargs)
+        return call
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def make_storage(redis, **options):
+    storage = HybridRedisStorage('hybrid+redis://localhost:6379/0', client=redis, **options)
+    # Tests drive syncs explicitly
+    storage._thread = False
+    return storage
+
+
+def test_registered_scheme():
+    """Flask-Limiter can build the storage from a hybrid+redis:// URI"""
+    storage = storage_from_string('hybrid+redis://localhost:6379/0', client=FakeRedis())
+    assert isinstance(storage, HybridRedisStorage)
+
+
+def test_single_process_is_local_and_exact():
+    """With one process the limit holds exactly and requests never call Redis"""
+    redis = FakeRedis()
+    storage = make_storage(redis)
+    limiter = FixedWindowRateLimiter(storage)
+    results = [limiter.hit(LIMIT, 'client') for _ in range(15)]
+    assert results == [True] * 10 + [False] * 5
+    assert redis.calls == 0
+
+    storage._sync()
+    assert redis.calls > 0
+    assert storage.get(LIMIT.key_for('client')) == 15
+
+
+def test_processes_see_each_others_hits():
+    """After a sync each process counts the hits taken by the others"""
+    redis = FakeRedis()
+    first, second = make_storage(redis), make_storage(FakeRedis(redis.data))
+    first_limiter, second_limiter = FixedWindowRateLimiter(first), FixedWindowRateLimiter(second)
+
+    for _ in range(6):
+        assert first_limiter.hit(LIMIT, 'client')
+    first._sync()
+    # The second process only learns about the first one's hits at its next sync
+    assert second_limiter.hit(LIMIT, 'client')
+    second._sync()
+    assert second.get(LIMIT.key_for('client')) == 7
+    results = [second_limiter.hit(LIMIT, 'client') for _ in range(5)]
+    assert results == [True] * 3 + [False] * 2
+
+
+def test_inline_sync_bounds_unsynced_hits():
+    """With several processes, unsynced hits are pushed once they reach the tolerance share"""
+    redis = FakeRedis()
+    storage = make_storage(redis, tolerance=0.2)
+    storage.processes = 3
+    limiter = FixedWindowRateLimiter(storage)
+    # 10 * 0.2 / (3 - 1) = 1 unsynced hit per process before an inline sync
+    limiter.hit(LIMIT, 'client')
+    assert storage.inline_syncs == 1
+    assert storage._windows[LIMIT.key_for('client')].unsynced == 0
+
+
+def test_redis_outage_enforces_locally():
+    """When Redis is unreachable the limit is still enforced on local counts"""
+    redis = FakeRedis()
+    redis.down = True
+    storage = make_storage(redis)
+    limiter = FixedWindowRateLimiter(storage)
+    results = [limiter.hit(LIMIT, 'client') for _ in range(12)]
+    assert results.count(True) == 10
+    storage._sync()
+    assert storage.sync_errors == 1
+
+    redis.down = False
+    storage._sync()
+    assert storage.last_sync_error is None
+    assert storage.get(LIMIT.key_for('client')) == 12
+
+
+def test_no_inline_sync_while_redis_is_down():
+    """Requests do not wait on Redis once a sync has failed"""
+    redis = FakeRedis()
+    redis.down = True
+    storage = make_storage(redis, tolerance=0.2)
+    storage.processes = 3
+    storage._sync()
+    assert storage.backend == 'memory'
+    limiter = FixedWindowRateLimiter(storage)
+    assert all(limiter.hit(LIMIT, 'client') for _ in range(5))
+    assert storage.inline_syncs == 0
+
+
+def test_failover_promotes_to_redis_and_back():
+    """The exact mode counts in memory until Redis answers, and again after it is lost"""
+    redis = FakeRedis()
+    redis.down = True
+    original = rate_limit_storage.storage_from_string
+    rate_limit_storage.storage_from_string = lambda uri, **options: FakeRedisStorage(redis)
+    try:
+        storage = FailoverRedisStorage('failover+redis://localhost:6379/0', reconnect_interval=0.01)
+        limiter = FixedWindowRateLimiter(storage)
+        assert storage.backend == 'memory'
+        results = [limiter.hit(LIMIT, 'client') for _ in range(12)]
+        assert results.count(True) == 10
+
+        redis.down = False
+        wait_until(lambda: storage.backend == 'redis')
+        assert storage.promotions == 1
+        assert limiter.hit(LIMIT, 'other')
+
+        redis.down = True
+        assert limiter.hit(LIMIT, 'other')
+        assert storage.backend == 'memory'
+        assert storage.failovers == 1
+
+        redis.down = False
+        wait_until(lambda: storage.backend == 'redis')
+        assert storage.promotions == 2
+        storage.close()
+    finally:
+        rate_limit_storage.storage_from_string = original
+
+
+def main():
+    """Run all tests"""
+    test_registered_scheme()
+    test_single_process_is_local_and_exact()
+    test_processes_see_each_others_hits()
+    test_inline_sync_bounds_unsynced_hits()
+    test_redis_outage_enforces_locally()
+    test_no_inline_sync_while_redis_is_down()
+    test_failover_promotes_to_redis_and_back()
+    print("All rate limit storage tests passed")
+
+
+if __name__ == "__main__":
+    main()
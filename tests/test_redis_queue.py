@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Tests for the Redis Streams delivery queue (fakeredis, no Redis server required)
+
+Install the test dependencies first: pip install -r requirements-dev.txt
+"""
+
+import os
+import sys
+import time
+
+import fakeredis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.delivery_queue import QUEUED, SENDING, RETRYING, SENT
+from app.services.redis_queue import RedisStreamQueue
+
+MESSAGE = b'Subject: Hello\r\nContent-Type: text/html\r\n\r\n<p>Hello</p>\r\n'
+ENVELOPE = ('sender@example.com', ['alice@example.com'], MESSAGE, [], [])
+
+
+def redis_queue(**kwargs):
+    queue = RedisStreamQueue(fakeredis.FakeRedis(), **kwargs)
+    queue.ensure_group()
+    return queue
+
+
+def test_consume_and_ack():
+    """A consumed entry carries the message; completing it acknowledges and removes it"""
+    queue = redis_queue()
+    job = queue.enqueue(ENVELOPE, 'welcome_email', 'alice@example.com', 'Hello')
+    assert queue.get_job(job.id).status == QUEUED and queue.depth() == 1
+
+    (entry_id, job_id, envelope, lane, expires_at), = queue.consume('worker-1', block_ms=None)
+    assert (job_id, envelope, lane, expires_at) == (job.id, ENVELOPE, 'default', None)
+    assert queue.consume('worker-1', block_ms=None) == []
+    assert queue.redis.xpending(queue.stream, queue.group)['pending'] == 1
+
+    assert queue.mark_sending(job_id) == 1
+    assert queue.get_job(job_id).status == SENDING
+    queue.complete(entry_id, job_id, lane=lane)
+    stored = queue.get_job(job_id)
+    assert stored.status == SENT and stored.attempts == 1 and stored.finished_at
+    assert queue.redis.xpending(queue.stream, queue.group)['pending'] == 0
+    assert queue.redis.xlen(queue.stream) == 0 and queue.depth() == 0
+
+
+def test_reclaim():
+    """Entries a crashed consumer never acknowledged are taken over with XAUTOCLAIM"""
+    queue = redis_queue()
+    job = queue.enqueue(ENVELOPE, 'welcome_email', 'alice@example.com', 'Hello')
+    (entry_id, _, _, _, _), = queue.consume('crashed-worker', block_ms=None)
+    # Not idle long enough yet
+    assert queue.reclaim('worker-2', min_idle_ms=60000) == []
+    time.sleep(0.01)
+    reclaimed, = queue.reclaim('worker-2', min_idle_ms=5)
+    assert reclaimed[:4] == (entry_id, job.id, ENVELOPE, 'default')
+    pending, = queue.redis.xpending_range(queue.stream, queue.group, '-', '+', 10)
+    assert pending['consumer'] == b'worker-2' and pending['times_delivered'] == 2
+    queue.complete(entry_id, job.id, lane='default')
+    assert queue.reclaim('worker-3', min_idle_ms=0) == []
+
+
+def test_delayed_entries_are_promoted():
+    """A deferred entry waits in the delayed set until it is due, then goes back on the stream"""
+    queue = redis_queue()
+    job = queue.enqueue(ENVELOPE, 'welcome_email', 'alice@example.com', 'Hello')
+    (entry_id, job_id, envelope, lane, _), = queue.consume('worker-1', block_ms=None)
+    queue.mark_sending(job_id)
+    queue.defer(entry_id, job_id, envelope, 0.1, '451 Try again later', lane)
+
+    stored = queue.get_job(job.id)
+    assert stored.status == RETRYING and stored.error == '451 Try again later' and stored.next_attempt_at
+    assert queue.retrying() == 1 and queue.redis.xlen(queue.stream) == 0
+    assert queue.promote_due() == 0
+
+    time.sleep(0.15)
+    assert queue.promote_due() == 1
+    assert queue.retrying() == 0 and queue.get_job(job.id).status == QUEUED
+    assert not queue.redis.exists(queue._payload_key(job.id))
+    (_, job_id, envelope, _, _), = queue.consume('worker-1', block_ms=None)
+    assert job_id == job.id and envelope == ENVELOPE
+    assert queue.mark_sending(job_id) == 2
+
+
+def test_job_hash_keeps_ttl():
+    """Status writes to a job hash that expired recreate it with a TTL, not forever"""
+    queue = redis_queue(job_ttl=600)
+    job = queue.enqueue(ENVELOPE, 'welcome_email', 'alice@example.com', 'Hello')
+    key = queue._job_key(job.id)
+    assert 0 < queue.redis.ttl(key) <= 600
+
+    (entry_id, job_id, envelope, lane, _), = queue.consume('worker-1', block_ms=None)
+    # The entry waited longer than job_ttl
+    queue.redis.delete(key)
+    assert queue.mark_sending(job_id) == 1
+    assert 0 < queue.redis.ttl(key) <= 600
+
+    queue.redis.delete(key)
+    queue.defer(entry_id, job_id, envelope, 0, 'Try again', lane)
+    assert 0 < queue.redis.ttl(key) <= 600
+
+    queue.redis.delete(key)
+    assert queue.promote_due() == 1
+    assert 0 < queue.redis.ttl(key) <= 600
+
+    (entry_id, job_id, _, lane, _), = queue.consume('worker-1', block_ms=None)
+    queue.redis.delete(key)
+    queue.complete(entry_id, job_id, lane=lane)
+    assert 0 < queue.redis.ttl(key) <= 600
+
+
+def main():
+    """Run all tests"""
+    test_consume_and_ack()
+    test_reclaim()
+    test_delayed_entries_are_promoted()
+    test_job_hash_keeps_ttl()
+    print("All Redis queue tests passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Tests for the rendered-output cache (no running server required)
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.templates.engine import get_compiled_template
+from app.services.render_cache import RenderCache
+
+WELCOME = get_compiled_template('welcome_email')
+VARIABLES = {'name': 'Alice', 'email': 'alice@example.com', 'login_url': 'https://example.com/login'}
+
+
+class DictRedis:
+    """Minimal in-memory stand-in for the two Redis commands the cache uses"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+
+def test_key_is_stable():
+    """Keys ignore variable order and change with the variables, email type and kind"""
+    cache = RenderCache()
+    key = cache.key('welcome_email', WELCOME, VARIABLES)
+    assert key == cache.key('welcome_email', WELCOME, dict(reversed(list(VARIABLES.items()))))
+    assert key != cache.key('welcome_email', WELCOME, dict(VARIABLES, name='Bob'))
+    assert key != cache.key('welcome_email', WELCOME, VARIABLES, 'qp')
+    assert cache.key('welcome_email', WELCOME, {'name': object()}) is None
+
+
+def test_hits_and_misses():
+    """A second lookup of the same render is a hit and skips rendering"""
+    cache = RenderCache()
+    calls = []
+
+    def render():
+        calls.append(1)
+        return 'Subject', '<p>Body</p>'
+
+    key = cache.key('welcome_email', WELCOME, VARIABLES)
+    assert cache.get_or_render(key, render) == ('Subject', '<p>Body</p>')
+    assert cache.get_or_render(key, render) == ('Subject', '<p>Body</p>')
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1 and stats['entries'] == 1
+
+
+def test_entry_and_byte_limits():
+    """The least recently used renders are evicted past either limit"""
+    cache = RenderCache(max_entries=2, max_bytes=100)
+    cache.set('a', 's', 'x' * 10)
+    cache.set('b', 's', 'x' * 10)
+    cache.get('a')
+    cache.set('c', 's', 'x' * 10)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+
+    cache.set('d', 's', 'x' * 80)
+    assert cache.stats()['bytes'] <= 100
+    cache.set('huge', 's', 'x' * 1000)
+    assert cache.get('huge') is None
+
+
+def test_byte_budget_counts_encoded_bytes():
+    """Non-ASCII text is counted by its UTF-8 size, and message bytes by their length"""
+    cache = RenderCache(max_bytes=100)
+    cache.set('euro', '€', '€' * 10)
+    assert cache.stats()['bytes'] == 33
+    cache.set('message', 's', b'x' * 10)
+    assert cache.stats()['bytes'] == 44
+    cache.set('euro', 's', 'é')
+    assert cache.stats()['bytes'] == 14
+    # 40 characters, but 120 bytes
+    cache.set('wide', 's', '€' * 40)
+    assert cache.get('wide') is None and cache.stats()['bytes'] == 14
+
+
+def test_redis_tier():
+    """A render cached by one process is served to another through Redis"""
+    redis_client = DictRedis()
+    first = RenderCache(redis_client=redis_client)
+    second = RenderCache(redis_client=redis_client)
+
+    key = first.key('welcome_email', WELCOME, VARIABLES)
+    first.set(key, 'Sujet é', b'=C3=A9 encoded')
+    first.set(key + 'html', 'Subject', '<p>é</p>')
+
+    assert second.get(key) == ('Sujet é', b'=C3=A9 encoded')
+    assert second.get(key + 'html') == ('Subject', '<p>é</p>')
+    assert second.stats()['redis_hits'] == 2
+    # Now served from the local tier
+    second.get(key)
+    assert second.stats()['redis_hits'] == 2
+
+
+def main():
+    """Run all tests"""
+    test_key_is_stable()
+    test_hits_and_misses()
+    test_entry_and_byte_limits()
+    test_byte_budget_counts_encoded_bytes()
+    test_redis_tier()
+    print("All render cache tests passed")
+
+
+if __name__ == "__main__":
+    main()
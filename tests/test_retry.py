@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Tests for retrying transient delivery failures (no running server or SMTP server required)
+"""
+
+import os
+import shutil
+import smtplib
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.delivery_queue import DeliveryQueue, SENT, FAILED
+from app.services.dead_letters import SQLiteDeadLetterStore
+from app.services.email_service import EmailService
+from app.services.outbox import Outbox
+from app.services.retry import RetryBudget, RetryPolicy, is_transient
+from app.services.transports import MemoryTransport
+
+MESSAGE = b'Subject: Hello\r\nContent-Type: text/html\r\n\r\n<p>Hello</p>\r\n'
+ENVELOPE = ('sender@example.com', ['alice@example.com'], MESSAGE, [], [])
+TRANSIENT = smtplib.SMTPDataError(451, b'4.3.0 Temporary server error')
+PERMANENT = smtplib.SMTPDataError(550, b'5.7.1 Message rejected')
+
+
+class FlakyTransport(MemoryTransport):
+    """Raises the queued errors one per send before delivering"""
+
+    def __init__(self, *errors):
+        super().__init__()
+        self.errors = list(errors)
+        self.attempts = 0
+
+    def sendmail(self, *envelope):
+        self.attempts += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return super().sendmail(*envelope)
+
+
+def make_service(transport, directory, max_attempts=3, budget=None):
+    policy = RetryPolicy(max_attempts, base_delay=0.001, max_delay=0.01, budget=budget)
+    store = SQLiteDeadLetterStore(os.path.join(directory, 'dead_letters.db'))
+    return EmailService(None, transport, retry_policy=policy, sync_retry_policy=policy, dead_letters=store)
+
+
+def wait_for(job, statuses, timeout=5):
+    deadline = time.time() + timeout
+    while job.status not in statuses:
+        assert time.time() < deadline, f"job stuck in {job.status}"
+        time.sleep(0.01)
+
+
+def test_is_transient():
+    """4xx replies and connection errors are retried; 5xx and other errors are not"""
+    assert is_transient(TRANSIENT)
+    assert is_transient(smtplib.SMTPServerDisconnected('Connection unexpectedly closed'))
+    assert is_transient(ConnectionResetError())
+    assert is_transient(smtplib.SMTPRecipientsRefused({'alice@example.com': (450, b'Mailbox busy')}))
+    assert not is_transient(PERMANENT)
+    assert not is_transient(smtplib.SMTPRecipientsRefused({'alice@example.com': (550, b'No such user')}))
+    assert not is_transient(ValueError('bad header'))
+
+
+def test_backoff_is_jittered_and_capped():
+    """Delays stay within the exponential bound and never exceed max_delay"""
+    policy = RetryPolicy(max_attempts=10, base_delay=1, max_delay=5)
+    for attempt in range(1, 10):
+        for _ in range(50):
+            assert 0 <= policy.backoff(attempt) <= min(5, 2 ** (attempt - 1))
+    assert policy.next_delay(TRANSIENT, 9) is not None
+    assert policy.next_delay(TRANSIENT, 10) is None
+    assert policy.next_delay(PERMANENT, 1) is None
+
+
+def test_retry_budget():
+    """Retries are limited to the budget's share of first attempts"""
+    budget = RetryBudget(ratio=0.5, min_per_second=0)
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    assert budget.stats()['spent'] == 1 and budget.stats()['denied'] == 2
+
+
+def test_sync_send_retries_inline():
+    """A synchronous delivery retries transient failures before succeeding"""
+    directory = tempfile.mkdtemp(prefix='retry-test-')
+    try:
+        transport = FlakyTransport(TRANSIENT, smtplib.SMTPServerDisconnected('dropped'))
+        service = make_service(transport, directory)
+        service.deliver_recorded('entry-1', ENVELOPE)
+        assert transport.attempts == 3
+        assert transport.stats()['sent'] == 1
+        assert service.dead_letters.count() == 0
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_permanent_failure_is_dead_lettered():
+    """A 5xx reply to a queued email is not retried and lands in the dead-letter store"""
+    directory = tempfile.mkdtemp(prefix='retry-test-')
+    try:
+        transport = FlakyTransport(PERMANENT)
+        service = make_service(transport, directory)
+        delivery_queue = DeliveryQueue(service, workers=1)
+        job = delivery_queue.enqueue(ENVELOPE, 'welcome_email', 'alice@example.com', 'Hello')
+        wait_for(job, (SENT, FAILED))
+        delivery_queue.stop()
+        assert job.status == FAILED and transport.attempts == 1
+        entry = service.dead_letters.get(job.id)
+        assert entry.reason == 'permanent' and entry.attempts == 1
+        assert entry.envelope == ENVELOPE and entry.email_type == 'welcome_email'
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_inline_failure_is_not_dead_lettered():
+    """A failed inline send is reported to the client, who may resend, so replay must not send it too"""
+    directory = tempfile.mkdtemp(prefix='retry-test-')
+    try:
+        transport = FlakyTransport(PERMANENT)
+        service = make_service(transport, directory)
+        service.outbox = Outbox(os.path.join(directory, 'outbox.db'))
+        service.outbox.append('entry-1', 'welcome_email', 'alice@example.com', 'Hello', ENVELOPE)
+        try:
+            service.deliver_recorded('entry-1', ENVELOPE)
+            assert False, "Expected SMTPDataError"
+        except smtplib.SMTPDataError:
+            pass
+        assert service.dead_letters.count() == 0
+        # Nor is the outbox entry replayed on the next start
+        service.outbox.close()
+        outbox = Outbox(service.outbox.path)
+        assert outbox.claim_pending(0) == []
+        outbox.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_queue_schedules_retries():
+    """Queued jobs are retried with backoff and finish as sent"""
+    directory = tempfile.mkdtemp(prefix='retry-test-')
+    try:
+        transport = FlakyTransport(TRANSIENT, TRANSIENT)
+        delivery_queue = DeliveryQueue(make_service(transport, directory), workers=1)
+        job = delivery_queue.enqueue(ENVELOPE, 'welcome_email', 'alice@example.com', 'Hello')
+        wait_for(job, (SENT, FAILED))
+        assert job.status == SENT and job.attempts == 3 and job.error is None
+        assert delivery_queue.retrying() == 0
+        delivery_queue.stop()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_exhausted_retries_are_dead_lettered():
+    """A job still failing after max_attempts is marked failed and dead-lettered"""
+    directory = tempfile.mkdtemp(prefix='retry-test-')
+    try:
+        transport = FlakyTransport(*[TRANSIENT] * 5)
+        service = make_service(transport, directory, max_attempts=2)
+        delivery_queue = DeliveryQueue(service, workers=1)
+        job = delivery_queue.enqueue(ENVELOPE, 'welcome_email', 'alice@example.com', 'Hello')
+        wait_for(job, (SENT, FAILED))
+        assert job.status == FAILED and job.attempts == 2
+        entry = service.dead_letters.get(job.id)
+        assert entry.reason == 'exhausted' and entry.attempts == 2
+        delivery_queue.stop()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_budget_stops_retries():
+    """With the budget spent, a transient failure is given up on the first attempt"""
+    directory = tempfile.mkdtemp(prefix='retry-test-')
+    try:
+        transport = FlakyTransport(TRANSIENT)
+        service = make_service(transport, directory, budget=RetryBudget(ratio=0, min_per_second=0))
+        try:
+            service.deliver_recorded('entry-1', ENVELOPE)
+            assert False, "Expected SMTPDataError"
+        except smtplib.SMTPDataError:
+            pass
+        assert transport.attempts == 1
+        assert service.dead_letters.count() == 0
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    """Run all tests"""
+    test_is_transient()
+    test_backoff_is_jittered_and_capped()
+    test_retry_budget()
+    test_sync_send_retries_inline()
+    test_permanent_failure_is_dead_lettered()
+    test_inline_failure_is_not_dead_lettered()
+    test_queue_schedules_retries()
+    test_exhausted_retries_are_dead_lettered()
+    test_budget_stops_retries()
+    print("All retry tests passed")
+
+
+if __name__ == "__main__":
+    main()
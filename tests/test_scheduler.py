@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Tests for scheduled sends (no running server or SMTP server required)
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.delivery_queue import DeliveryQueue, SCHEDULED, QUEUED, SENT
+from app.services.email_service import EmailService
+from app.services.outbox import Outbox
+from app.services.scheduler import ScheduleStore, Scheduler
+from app.services.transports import MemoryTransport
+from app.utils.utils import parse_timestamp, validate_timestamp
+
+MESSAGE = b'Subject: Hello\r\nContent-Type: text/html\r\n\r\n<p>Hello</p>\r\n'
+ENVELOPE = ('sender@example.com', ['alice@example.com'], MESSAGE, [], [])
+
+
+def store_path():
+    return os.path.join(tempfile.mkdtemp(prefix='schedule-test-'), 'schedule.db')
+
+
+def entry(job_id, send_at):
+    return (job_id, send_at, 'welcome_email', 'alice@example.com', 'Hello', ENVELOPE, None)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_parse_send_at():
+    """send_at takes ISO 8601 times (UTC by default) or Unix timestamps"""
+    assert parse_timestamp(None) is None
+    assert parse_timestamp('2030-01-01T00:00:00Z') == 1893456000
+    assert parse_timestamp('2030-01-01T00:00:00') == 1893456000
+    assert parse_timestamp('2030-01-01T01:00:00+01:00') == 1893456000
+    assert parse_timestamp(1893456000) == 1893456000
+    assert parse_timestamp('1893456000.5') == 1893456000.5
+    for bad in ('tomorrow', True, [], 'nan', float('inf')):
+        assert validate_timestamp(bad), f"Expected an error for {bad!r}"
+
+
+def test_store_claims_due_in_order():
+    """Only due emails are claimed, earliest first, and each only once"""
+    store = ScheduleStore(store_path())
+    assert store.next_due() is None and store.count() == 0
+    now = time.time()
+    store.add_many([entry('later', now + 3600), entry('second', now - 1), entry('first', now - 2)])
+    assert store.count() == 3 and store.next_due() == now - 2
+    claimed = store.claim_due(now, 10)
+    assert [e.id for e in claimed] == ['first', 'second']
+    assert claimed[0].envelope == ENVELOPE
+    assert store.claim_due(now, 10) == []
+    assert store.count() == 1 and store.get('later').subject == 'Hello'
+
+
+def test_failed_record_keeps_emails():
+    """If recording a release fails, the emails stay scheduled"""
+    store = ScheduleStore(store_path())
+    store.add_many([entry('a', time.time() - 1)])
+
+    def record(entries):
+        raise RuntimeError("disk full")
+    try:
+        store.claim_due(time.time(), 10, record)
+        assert False, "Expected RuntimeError"
+    except RuntimeError:
+        pass
+    assert [e.id for e in store.claim_due(time.time(), 10)] == ['a']
+
+
+def test_schedule_survives_restart():
+    """A new store on the same file sees emails scheduled before"""
+    path = store_path()
+    store = ScheduleStore(path)
+    store.add_many([entry('a', time.time() + 60)])
+    store.close()
+    assert ScheduleStore(path).get('a') is not None
+
+
+def test_release_rate():
+    """A burst of due emails is released no faster than the release rate"""
+    store = ScheduleStore(store_path())
+    now = time.time()
+    store.add_many([entry(f'job-{index}', now - 1) for index in range(60)])
+    released = []
+    scheduler = Scheduler(store, released.extend, rate=100)
+    scheduler._tokens = 0
+    start = time.monotonic()
+    scheduler.start()
+    wait_for(lambda: len(released) == 60)
+    elapsed = time.monotonic() - start
+    scheduler.stop()
+    assert elapsed >= 0.5, f"released too fast ({elapsed:.2f}s)"
+    assert [e.id for e in released] == [f'job-{index}' for index in range(60)]
+
+
+def test_delivery_queue_sends_at_send_at():
+    """A scheduled email waits on disk, then is recorded in the outbox and sent"""
+    directory = tempfile.mkdtemp(prefix='schedule-test-')
+    transport = MemoryTransport()
+    outbox = Outbox(os.path.join(directory, 'outbox.db'))
+    schedule = ScheduleStore(os.path.join(directory, 'schedule.db'))
+    delivery_queue = DeliveryQueue(EmailService(None, transport, outbox), workers=1, schedule=schedule)
+
+    send_at = time.time() + 0.3
+    job = delivery_queue.schedule(ENVELOPE, 'welcome_email', 'alice@example.com', 'Hello', send_at)
+    assert job.status == SCHEDULED and job.envelope is None
+    assert delivery_queue.get_job(job.id).to_dict()['send_at'] == send_at
+    assert delivery_queue.scheduled()['pending'] == 1
+
+    wait_for(lambda: transport.messages())
+    assert time.time() >= send_at
+    wait_for(lambda: delivery_queue.get_job(job.id).status == SENT)
+    wait_for(lambda: outbox.counts().get('delivered') == 1)
+    assert delivery_queue.scheduled()['pending'] == 0
+
+    # A send_at in the past is queued straight away
+    assert delivery_queue.schedule(ENVELOPE, 'welcome_email', 'alice@example.com', 'Hi', time.time() - 1).status in (
+        QUEUED, SENT)
+    delivery_queue.stop()
+
+
+def main():
+    """Run all tests"""
+    test_parse_send_at()
+    test_store_claims_due_in_order()
+    test_failed_record_keeps_emails()
+    test_schedule_survives_restart()
+    test_release_rate()
+    test_delivery_queue_sends_at_send_at()
+    print("All scheduled send tests passed")
+
+
+if __name__ == "__main__":
+    main()
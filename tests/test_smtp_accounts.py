@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Tests for balancing mail across several SMTP accounts (local SMTP sinks, no Gmail account required)
+"""
+
+import base64
+import json
+import os
+import smtplib
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.smtp_sink import SMTPSink
+from app.services.smtp_accounts import (
+    SMTPAccount, SMTPAccountPool, SMTPAccountsUnavailable, parse_accounts, should_drain
+)
+from app.services.smtp_pool import SMTPConnectionPool
+from app.services.transports import create_transport
+
+MESSAGE = b'Subject: Hello\r\nContent-Type: text/html\r\n\r\n<p>Hello</p>\r\n'
+ENVELOPE = ('sender@example.com', ['alice@example.com'], MESSAGE, [], [])
+QUOTA_REPLY = (550, '5.4.5 Daily user sending quota exceeded.')
+
+CONFIG = {
+    'MAIL_SERVER': 'smtp.example.com',
+    'MAIL_PORT': 587,
+    'MAIL_USE_TLS': True,
+    'MAIL_USE_SSL': False,
+    'MAIL_BACKEND': 'smtp',
+    'SMTP_POOL_SIZE': 2,
+    'SMTP_POOL_IDLE_TIMEOUT': 60,
+    'SMTP_POOL_HEALTH_CHECK_INTERVAL': 10,
+    'SMTP_TIMEOUT': 5,
+    'SMTP_ACCOUNTS': '',
+    'SMTP_ACCOUNT_STRATEGY': 'weighted',
+    'SMTP_ACCOUNT_DRAIN_SECONDS': 300
+}
+
+
+def make_accounts(*weights, strategy='weighted'):
+    """One sink and account per weight"""
+    sinks = [SMTPSink().start() for _ in weights]
+    accounts = [
+        SMTPAccount(f'account-{index}', SMTPConnectionPool(sink.host, sink.port, use_tls=False, size=2), weight)
+        for index, (sink, weight) in enumerate(zip(sinks, weights))
+    ]
+    return sinks, SMTPAccountPool(accounts, strategy)
+
+
+def stop(sinks, transport):
+    transport.close()
+    for sink in sinks:
+        sink.stop()
+
+
+def test_parse_accounts():
+    """SMTP_ACCOUNTS entries decode their password and inherit the MAIL_* settings"""
+    config = dict(CONFIG, SMTP_ACCOUNTS=json.dumps([
+        {'username': 'a@example.com', 'password': base64.b64encode(b'secret').decode(), 'weight': 3},
+        {'name': 'relay', 'host': 'relay.example.com', 'port': 2525, 'use_tls': False}
+    ]))
+    first, second = parse_accounts(config)
+    assert first['name'] == 'account-0' and first['password'] == 'secret' and first['weight'] == 3
+    assert first['host'] == 'smtp.example.com' and first['port'] == 587 and first['pool_size'] == 2
+    assert second['name'] == 'relay' and second['port'] == 2525 and second['use_tls'] is False
+    assert parse_accounts(CONFIG) == []
+    assert isinstance(create_transport(config), SMTPAccountPool)
+    assert isinstance(create_transport(CONFIG), SMTPConnectionPool)
+    try:
+        parse_accounts(dict(CONFIG, SMTP_ACCOUNTS='{"username": "a"}'))
+        assert False, "Expected ValueError"
+    except ValueError:
+        pass
+
+
+def test_should_drain():
+    """Quota, throttling and login errors drain an account; a rejected recipient does not"""
+    assert should_drain(smtplib.SMTPDataError(*QUOTA_REPLY))
+    assert should_drain(smtplib.SMTPSenderRefused(421, b'4.7.0 Try again later', 'sender@example.com'))
+    assert should_drain(smtplib.SMTPAuthenticationError(535, b'5.7.8 Username and Password not accepted'))
+    assert should_drain(ConnectionRefusedError())
+    assert not should_drain(smtplib.SMTPRecipientsRefused({'bob@example.com': (550, b'5.1.1 No such user')}))
+    assert not should_drain(smtplib.SMTPDataError(552, b'5.3.4 Message size exceeds fixed limit'))
+
+
+def test_weighted_round_robin():
+    """Messages are split by weight"""
+    sinks, transport = make_accounts(2, 1)
+    try:
+        for _ in range(30):
+            transport.sendmail(*ENVELOPE)
+        assert [account.sent for account in transport.accounts] == [20, 10]
+        assert sinks[0].wait_for(20, timeout=5) and sinks[1].wait_for(10, timeout=5)
+    finally:
+        stop(sinks, transport)
+
+
+def test_least_loaded():
+    """The account with the fewest sends in flight per unit of weight is picked"""
+    sinks, transport = make_accounts(1, 1, strategy='least_loaded')
+    try:
+        transport.accounts[0].in_flight = 3
+        transport.sendmail(*ENVELOPE)
+        assert [account.sent for account in transport.accounts] == [0, 1]
+    finally:
+        stop(sinks, transport)
+
+
+def test_quota_error_drains_account():
+    """An account over its quota is drained and the message goes to the next one"""
+    sinks, transport = make_accounts(1, 1)
+    sinks[0].reject = QUOTA_REPLY
+    try:
+        for _ in range(4):
+            transport.sendmail(*ENVELOPE)
+        first, second = transport.accounts
+        assert first.drains == 1 and first.sent == 0
+        assert second.sent == 4
+        assert sinks[0].stats()['rejected'] == 1
+        stats = transport.stats()
+        assert stats['available'] == 1
+        assert stats['accounts'][0]['drained_for'] == 300
+        # /health shows the error class, not the server's reply or the login
+        assert stats['accounts'][0]['last_error'] == 'SMTPDataError'
+        assert 'username' not in stats['accounts'][0] and 'host' not in stats['accounts'][0]
+
+        sinks[1].reject = QUOTA_REPLY
+        try:
+            transport.sendmail(*ENVELOPE)
+            assert False, "Expected SMTPAccountsUnavailable"
+        except SMTPAccountsUnavailable:
+            pass
+    finally:
+        stop(sinks, transport)
+
+
+def test_message_rejection_is_not_retried():
+    """A rejection of the message itself is raised without draining or trying another account"""
+    sinks, transport = make_accounts(1, 1)
+    sinks[0].reject = sinks[1].reject = (554, '5.6.0 Message rejected')
+    try:
+        try:
+            transport.sendmail(*ENVELOPE)
+            assert False, "Expected SMTPDataError"
+        except smtplib.SMTPDataError:
+            pass
+        assert sum(sink.stats()['rejected'] for sink in sinks) == 1
+        assert all(account.drains == 0 for account in transport.accounts)
+    finally:
+        stop(sinks, transport)
+
+
+def test_session_spreads_and_reuses_connections():
+    """A batch session balances per message and keeps one connection per account"""
+    sinks, transport = make_accounts(1, 1)
+    try:
+        with transport.session() as session:
+            for _ in range(10):
+                session.sendmail(*ENVELOPE)
+        assert [account.sent for account in transport.accounts] == [5, 5]
+        assert [account.pool.stats()['created'] for account in transport.accounts] == [1, 1]
+        assert all(account.pool.stats()['in_use'] == 0 for account in transport.accounts)
+    finally:
+        stop(sinks, transport)
+
+
+def main():
+    """Run all tests"""
+    test_parse_accounts()
+    test_should_drain()
+    test_weighted_round_robin()
+    test_least_loaded()
+    test_quota_error_drains_account()
+    test_message_rejection_is_not_retried()
+    test_session_spreads_and_reuses_connections()
+    print("All SMTP account tests passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Tests for the SMTP connection pool (a fake smtplib.SMTP, no SMTP server required)
+"""
+
+import os
+import smtplib
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.smtp_pool import SMTPConnectionPool, SMTPPoolExhausted
+
+MESSAGE = b'Subject: Hello\r\nContent-Type: text/html\r\n\r\n<p>Hello</p>\r\n'
+ENVELOPE = ('sender@example.com', ['alice@example.com'], MESSAGE, [], [])
+
+
+class FakeSMTP:
+    """Stands in for smtplib.SMTP; a dropped connection fails like one the server has closed"""
+
+    instances = []
+    # Set to make every connection fail as if the server dropped it
+    drop_all = False
+
+    def __init__(self, host, port, timeout=None):
+        self.host = host
+        self.port = port
+        self.logged_in = False
+        self.dropped = False
+        self.closed = False
+        self.noops = 0
+        self.sent = []
+        FakeSMTP.instances.append(self)
+
+    def starttls(self):
+        pass
+
+    def login(self, username, password):
+        self.logged_in = True
+
+    def noop(self):
+        self.noops += 1
+        if self.dropped:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        return 250, b'2.0.0 OK'
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        if self.dropped or self.closed or FakeSMTP.drop_all:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        self.sent.append(msg)
+        return {}
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+def fake_pool(**kwargs):
+    FakeSMTP.instances = []
+    FakeSMTP.drop_all = False
+    return SMTPConnectionPool('smtp.example.com', 587, 'user', 'secret', **kwargs)
+
+
+def with_fake_smtp(test):
+    """Run a test with smtplib.SMTP replaced by FakeSMTP"""
+    def run():
+        original = smtplib.SMTP
+        smtplib.SMTP = FakeSMTP
+        try:
+            test()
+        finally:
+            smtplib.SMTP = original
+    run.__name__ = test.__name__
+    run.__doc__ = test.__doc__
+    return run
+
+
+@with_fake_smtp
+def test_checkout_and_return():
+    """A returned connection is reused instead of opening a new session"""
+    pool = fake_pool()
+    connection, reused = pool.acquire()
+    assert not reused and connection.logged_in
+    assert pool.stats()['in_use'] == 1
+    pool.release(connection)
+    assert pool.stats()['idle'] == 1 and pool.stats()['in_use'] == 0
+    again, reused = pool.acquire()
+    assert again is connection and reused
+    pool.release(again)
+    for _ in range(3):
+        pool.sendmail(*ENVELOPE)
+    assert len(FakeSMTP.instances) == 1 and len(connection.sent) == 3
+    assert pool.stats()['created'] == 1
+
+
+@with_fake_smtp
+def test_health_check():
+    """A connection idle past the health check interval is checked with NOOP and replaced if dead"""
+    pool = fake_pool(health_check_interval=0)
+    connection, _ = pool.acquire()
+    pool.release(connection)
+    again, reused = pool.acquire()
+    assert again is connection and reused and connection.noops == 1
+    pool.release(again)
+
+    connection.dropped = True
+    replacement, reused = pool.acquire()
+    assert replacement is not connection and not reused and connection.closed
+    pool.release(replacement)
+
+    # Within the interval a connection is reused without a round trip
+    pool = fake_pool(health_check_interval=60)
+    connection, _ = pool.acquire()
+    pool.release(connection)
+    pool.release(pool.acquire()[0])
+    assert connection.noops == 0
+
+
+@with_fake_smtp
+def test_idle_expiry():
+    """A connection idle past idle_timeout is closed rather than reused"""
+    pool = fake_pool(idle_timeout=0.05)
+    connection, _ = pool.acquire()
+    pool.release(connection)
+    time.sleep(0.1)
+    replacement, reused = pool.acquire()
+    assert replacement is not connection and not reused and connection.closed
+    assert pool.stats()['created'] == 2
+    pool.release(replacement)
+
+
+@with_fake_smtp
+def test_reconnects_once():
+    """A reused connection the server dropped is retried once on a fresh one; a fresh failure is raised"""
+    pool = fake_pool()
+    pool.sendmail(*ENVELOPE)
+    first = FakeSMTP.instances[0]
+    first.dropped = True
+    pool.sendmail(*ENVELOPE)
+    assert len(FakeSMTP.instances) == 2 and first.closed
+    assert len(FakeSMTP.instances[1].sent) == 1
+    assert pool.stats()['reconnects'] == 1 and pool.stats()['idle'] == 1
+
+    # Every connection fails: one reconnect, then the error surfaces
+    FakeSMTP.drop_all = True
+    try:
+        pool.sendmail(*ENVELOPE)
+        assert False, "Expected SMTPServerDisconnected"
+    except smtplib.SMTPServerDisconnected:
+        pass
+    assert len(FakeSMTP.instances) == 3 and pool.stats()['reconnects'] == 2
+    assert pool.stats()['in_use'] == 0 and pool.stats()['idle'] == 0
+
+
+@with_fake_smtp
+def test_size_bound():
+    """No more than size connections are checked out at once"""
+    pool = fake_pool(size=2, checkout_timeout=0.05)
+    held = [pool.acquire()[0] for _ in range(2)]
+    start = time.monotonic()
+    try:
+        pool.acquire()
+        assert False, "Expected SMTPPoolExhausted"
+    except SMTPPoolExhausted:
+        pass
+    assert time.monotonic() - start >= 0.05
+    pool.release(held.pop())
+    connection, reused = pool.acquire()
+    assert reused and len(FakeSMTP.instances) == 2
+    pool.release(connection)
+    pool.release(held.pop())
+
+
+@with_fake_smtp
+def test_close_closes_checked_out_connections():
+    """close() closes idle connections now and checked-out ones when they come back"""
+    pool = fake_pool()
+    idle, _ = pool.acquire()
+    busy, _ = pool.acquire()
+    pool.release(idle)
+    pool.close()
+    assert idle.closed and not busy.closed
+    pool.release(busy)
+    assert busy.closed
+    assert pool.stats()['idle'] == 0 and pool.stats()['in_use'] == 0
+
+
+def main():
+    """Run all tests"""
+    test_checkout_and_return()
+    test_health_check()
+    test_idle_expiry()
+    test_reconnects_once()
+    test_size_bound()
+    test_close_closes_checked_out_connections()
+    print("All SMTP pool tests passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Delivery tests against the local SMTP sink (no running server or Gmail account required)
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.smtp_sink import SMTPSink
+from app.services.smtp_pool import SMTPConnectionPool
+from app.services.mime_builder import MessageBuilder
+from app.templates.engine import get_compiled_template
+
+VARIABLES = {'name': 'Alice', 'email': 'alice@example.com', 'login_url': 'https://example.com/login'}
+
+
+def build_envelope(receiver_email):
+    """A welcome email built the same way the server builds it"""
+    subject = get_compiled_template('welcome_email')['subject'].render(VARIABLES)
+    return MessageBuilder().build('welcome_email', VARIABLES, subject, 'Example <noreply@example.com>', receiver_email)
+
+
+def test_pool_delivers_to_sink():
+    """Pooled sends reach the sink and reuse one connection"""
+    sink = SMTPSink().start()
+    pool = SMTPConnectionPool(sink.host, sink.port, use_tls=False, size=2)
+    try:
+        for index in range(5):
+            pool.sendmail(*build_envelope(f'user{index}@example.com'))
+        assert sink.wait_for(5, timeout=5)
+        stats = sink.stats()
+        assert stats['messages'] == 5
+        assert stats['bytes'] > 0
+        assert pool.stats()['created'] == 1
+    finally:
+        pool.close()
+        sink.stop()
+
+
+def test_session_sends_several_messages():
+    """One held session delivers a sequence of messages"""
+    sink = SMTPSink().start()
+    pool = SMTPConnectionPool(sink.host, sink.port, use_tls=False, size=1)
+    try:
+        with pool.session() as session:
+            for index in range(3):
+                session.sendmail(*build_envelope(f'user{index}@example.com'))
+        assert sink.wait_for(3, timeout=5)
+    finally:
+        pool.close()
+        sink.stop()
+
+
+def main():
+    """Run all tests"""
+    test_pool_delivers_to_sink()
+    test_session_sends_several_messages()
+    print("All SMTP sink tests passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Tests for the precompiled template engine (no running server required)
+"""
+
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.templates.templates import TEMPLATE_MAP, TEMPLATE_VARIABLES
+from app.templates.engine import TemplateSyntaxError, compile_template, get_compiled_template, render_many
+from app.templates.layouts import BASE_LAYOUT_KEY, extend_layout
+
+
+def test_every_template_is_compiled():
+    """Every TEMPLATE_MAP entry has a compiled subject and body"""
+    for email_type, template in TEMPLATE_MAP.items():
+        compiled = get_compiled_template(email_type)
+        assert compiled['subject'].source == template['subject']
+        assert compiled['body'].source == template['body']
+
+
+def test_all_placeholders_are_substituted():
+    """Rendering with every required variable leaves no placeholders behind"""
+    for email_type, names in TEMPLATE_VARIABLES.items():
+        variables = {name: f'<{name}>' for name in names}
+        body = get_compiled_template(email_type)['body'].render(variables)
+        assert '{{' not in body
+        for name in names:
+            assert f'<{name}>' in body
+
+
+def test_value_types():
+    """Strings and numbers are substituted, other values and unknown names are left as-is"""
+    template = compile_template('{{a}} {{b}} {{c}} {{d}} {{missing}}')
+    rendered = template.render({'a': 'x', 'b': 3, 'c': 1.5, 'd': {'k': 'v'}})
+    assert rendered == 'x 3 1.5 {{d}} {{missing}}'
+
+
+def test_repeated_placeholder():
+    """A placeholder used more than once is substituted everywhere"""
+    template = compile_template('<p>{{name}}</p><p>{{name}}</p>')
+    assert template.render({'name': 'Bob'}) == '<p>Bob</p><p>Bob</p>'
+
+
+def test_for_loop():
+    """Loops render each item with attribute access and support an else branch"""
+    template = compile_template(
+        '<ul>\n{% for item in items %}\n<li>{{loop.index}}. {{item.name}} - ${{item.price}}</li>\n{% else %}\n<li>None</li>\n{% endfor %}\n</ul>'
+    )
+    items = [{'name': 'A', 'price': 1}, {'name': 'B', 'price': 2}]
+    assert template.render({'items': items}) == '<ul>\n<li>1. A - $1</li>\n<li>2. B - $2</li>\n</ul>'
+    assert template.render({'items': []}) == '<ul>\n<li>None</li>\n</ul>'
+    assert template.render({}) == '<ul>\n<li>None</li>\n</ul>'
+
+
+def test_large_loop():
+    """A 1,000-line invoice renders every line"""
+    template = compile_template('{% for line in lines %}<tr><td>{{line.sku}}</td><td>{{line.qty}}</td></tr>{% endfor %}')
+    lines = [{'sku': f'SKU-{index}', 'qty': index} for index in range(1000)]
+    rendered = template.render({'lines': lines})
+    assert rendered.count('<tr>') == 1000
+    assert rendered.endswith('<td>SKU-999</td><td>999</td></tr>')
+
+
+def test_conditionals():
+    """if/elif/else pick the first true branch; missing names are false"""
+    template = compile_template(
+        '{% if tier == "gold" %}Gold{% elif credits > 10 and not expired %}Credit{% else %}Basic{% endif %}'
+    )
+    assert template.render({'tier': 'gold'}) == 'Gold'
+    assert template.render({'credits': 20, 'expired': False}) == 'Credit'
+    assert template.render({'credits': 20, 'expired': True}) == 'Basic'
+    assert template.render({}) == 'Basic'
+
+
+def test_filters():
+    """Filters transform values and take arguments"""
+    template = compile_template(
+        '{{name|title}} {{notes|default("n/a")}} {{"%.2f"|format(total)}} {{tags|join(", ")|upper}} {{html|escape}}'
+    )
+    rendered = template.render({'name': 'ada lovelace', 'total': 12.5, 'tags': ['a', 'b'], 'html': '<b>'})
+    assert rendered == 'Ada Lovelace n/a 12.50 A, B &lt;b&gt;'
+
+
+def test_filter_edge_cases():
+    """A filter that cannot handle its value leaves the placeholder; a missing argument is passed as ''"""
+    template = compile_template('[{{x|int}}]')
+    for value in (1e400, '1e400', '-inf', 'nan', 'abc', None):
+        assert template.render({'x': value}) == '[{{x|int}}]', value
+    assert template.render({'x': '42.9'}) == '[42]'
+    assert compile_template('[{{"%s"|format(missing)}}]').render({}) == '[]'
+    assert compile_template('[{{"%s-%s"|format(a, b)}}]').render({'b': 2}) == '[-2]'
+
+
+def test_syntax_errors():
+    """Malformed templates fail when they are compiled"""
+    for source in ('{% if a %}', '{% endfor %}', '{{a|unknown}}', '{% for a %}{% endfor %}', '{% if (a %}{% endif %}'):
+        try:
+            compile_template(source)
+        except TemplateSyntaxError:
+            continue
+        raise AssertionError(f"{source!r} compiled without an error")
+
+
+def test_extend_layout():
+    """Templates share the base layout and override only their own blocks"""
+    body = extend_layout(BASE_LAYOUT_KEY, {'title': 'T', 'content': '<p>{{name}}</p>'})
+    assert '<title>T</title>' in body
+    assert '<p>{{name}}</p>' in body
+    assert '.header {' in body
+    assert 'contact our support team' in body  # default footer block
+    assert '{%' not in body
+    for template in TEMPLATE_MAP.values():
+        assert '{% block' not in template['body']
+        assert '{% include' not in template['body']
+
+
+def test_extend_layout_rejects_unknown_block():
+    """A misspelled block name fails at import time instead of being silently dropped"""
+    try:
+        extend_layout(BASE_LAYOUT_KEY, {'contnet': '<p>oops</p>'})
+    except KeyError:
+        return
+    raise AssertionError("extend_layout accepted an unknown block")
+
+
+def test_minified_bodies_render_the_same_text():
+    """Minifying strips formatting whitespace without changing the visible text"""
+    def text(html):
+        html = re.sub(r'<style.*?</style>', '', html, flags=re.DOTALL)
+        return ' '.join(re.sub(r'<[^>]+>', ' ', html).split())
+
+    for email_type, names in TEMPLATE_VARIABLES.items():
+        variables = {name: f'value of {name}' for name in names}
+        source = TEMPLATE_MAP[email_type]['body']
+        plain = compile_template(source).render(variables)
+        minified = compile_template(source, minify=True).render(variables)
+        assert len(minified) < len(plain)
+        assert '\n' not in minified
+        assert text(minified) == text(plain)
+
+
+def test_render_many():
+    """render_many yields the same renders as one render per recipient, in order, serially or in processes"""
+    compiled = get_compiled_template('welcome_email')
+    recipients = [
+        {'name': f'User {index}', 'email': f'user{index}@example.com', 'login_url': 'https://example.com'}
+        for index in range(50)
+    ]
+    expected = [(compiled['subject'].render(v), compiled['body'].render(v)) for v in recipients]
+    assert list(render_many('welcome_email', iter(recipients))) == expected
+    assert list(render_many('welcome_email', iter(recipients), processes=2, chunk_size=7)) == expected
+
+
+def main():
+    """Run all tests"""
+    test_every_template_is_compiled()
+    test_all_placeholders_are_substituted()
+    test_value_types()
+    test_repeated_placeholder()
+    test_for_loop()
+    test_large_loop()
+    test_conditionals()
+    test_filters()
+    test_filter_edge_cases()
+    test_syntax_errors()
+    test_render_many()
+    test_extend_layout()
+    test_extend_layout_rejects_unknown_block()
+    test_minified_bodies_render_the_same_text()
+    print("All template engine tests passed")
+
+
+if __name__ == "__main__":
+    main()
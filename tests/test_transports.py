@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Tests for the MAIL_BACKEND transports (no running server required)
+"""
+
+import email
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.transports import MemoryTransport, FileTransport, NullTransport, create_transport
+from app.services.smtp_pool import SMTPConnectionPool
+
+MESSAGE = b'Subject: Hello\r\nContent-Type: text/html\r\n\r\n<p>Hello</p>\r\n'
+ENVELOPE = ('sender@example.com', ['alice@example.com', 'bob@example.com'], MESSAGE, [], [])
+
+CONFIG = {
+    'MAIL_BACKEND': 'smtp',
+    'MAIL_MEMORY_SIZE': 3,
+    'MAIL_FILE_PATH': None,
+    'MAIL_FILE_FORMAT': 'maildir',
+    'MAIL_SERVER': 'localhost',
+    'MAIL_PORT': 25,
+    'SMTP_POOL_SIZE': 2,
+    'SMTP_POOL_IDLE_TIMEOUT': 60,
+    'SMTP_POOL_HEALTH_CHECK_INTERVAL': 10,
+    'SMTP_TIMEOUT': 5
+}
+
+
+def test_memory_ring_buffer():
+    """Only the most recent messages are kept, but every send is counted"""
+    transport = MemoryTransport(max_messages=3)
+    for index in range(5):
+        transport.sendmail(f'sender{index}@example.com', ['alice@example.com'], MESSAGE)
+    messages = transport.messages()
+    assert [m['sender'] for m in messages] == ['sender2@example.com', 'sender3@example.com', 'sender4@example.com']
+    assert messages[0]['message'] == MESSAGE
+    stats = transport.stats()
+    assert stats['sent'] == 5 and stats['buffered'] == 3 and stats['bytes'] == 5 * len(MESSAGE)
+
+    with transport.session() as session:
+        session.sendmail(*ENVELOPE)
+    assert transport.messages()[-1]['recipients'] == ['alice@example.com', 'bob@example.com']
+
+
+def test_file_maildir():
+    """Messages are delivered to new/ with the envelope recorded in headers"""
+    directory = tempfile.mkdtemp(prefix='maildir-test-')
+    try:
+        transport = FileTransport(directory)
+        transport.sendmail(*ENVELOPE)
+        transport.sendmail(*ENVELOPE)
+        assert sorted(os.listdir(directory)) == ['cur', 'new', 'tmp']
+        assert os.listdir(os.path.join(directory, 'tmp')) == []
+        delivered = os.listdir(os.path.join(directory, 'new'))
+        assert len(delivered) == 2
+
+        with open(os.path.join(directory, 'new', delivered[0]), 'rb') as f:
+            message = email.message_from_bytes(f.read())
+        assert message['Return-Path'] == '<sender@example.com>'
+        assert message.get_all('Delivered-To') == ['alice@example.com', 'bob@example.com']
+        assert message['Subject'] == 'Hello'
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_file_eml():
+    """The eml format writes one .eml file per message into the directory"""
+    directory = tempfile.mkdtemp(prefix='eml-test-')
+    try:
+        transport = FileTransport(directory, 'eml')
+        transport.sendmail(*ENVELOPE)
+        files = os.listdir(directory)
+        assert len(files) == 1 and files[0].endswith('.eml')
+    finally:
+        shutil.rmtree(directory)
+
+    try:
+        FileTransport(directory, 'mbox')
+        assert False, "Expected ValueError"
+    except ValueError:
+        pass
+
+
+def test_null_discards():
+    """The null backend only counts"""
+    transport = NullTransport()
+    with transport.session() as session:
+        session.sendmail(*ENVELOPE)
+    assert transport.stats() == {'backend': 'null', 'sent': 1, 'bytes': len(MESSAGE)}
+
+
+def test_create_transport():
+    """MAIL_BACKEND selects the transport; smtp without pooling falls back to Flask-Mail"""
+    assert isinstance(create_transport(CONFIG), SMTPConnectionPool)
+    assert create_transport(dict(CONFIG, SMTP_POOL_SIZE=0)) is None
+    assert isinstance(create_transport(dict(CONFIG, MAIL_BACKEND='memory')), MemoryTransport)
+    assert isinstance(create_transport(dict(CONFIG, MAIL_BACKEND='null')), NullTransport)
+    try:
+        create_transport(dict(CONFIG, MAIL_BACKEND='carrier-pigeon'))
+        assert False, "Expected ValueError"
+    except ValueError:
+        pass
+
+
+def main():
+    """Run all tests"""
+    test_memory_ring_buffer()
+    test_file_maildir()
+    test_file_eml()
+    test_null_discards()
+    test_create_transport()
+    print("All transport tests passed")
+
+
+if __name__ == "__main__":
+    main()